@@ -65,7 +65,14 @@ def charge() -> None:
     write_data_base(data, f"firmware/{db_name}")
 
 
-def get_battery_info() -> None:
+def get_battery_info() -> dict:
+    """
+    Sign battery's charge cycles with the current time
+
+    :return: Battery's info (v, r, s, charges, time)
+    :rtype: dict
+    """
+
     charges = open_data_base(f"firmware/{get_db_name()}")['Charge cycles']
     time = int(dt.datetime.utcnow().timestamp())
     _private_key = int(private_key, base=16).to_bytes(32, byteorder='big')
@@ -79,9 +86,7 @@ def get_battery_info() -> None:
     r = '0' * (64 -len(hex(battery_id[1])[2:])) + hex(battery_id[1])[2:]
     s = '0' * (64 -len(hex(battery_id[2])[2:])) + hex(battery_id[2])[2:]
 
-    data = {'v': v, 'r': r, 's': s, 'charges': charges, 'time': time}
-
-    write_data_base(data, f"firmware/{os.path.basename(__file__)[:-3]}_data.json")
+    return {'v': v, 'r': r, 's': s, 'charges': charges, 'time': time}
 
 
 def create_parser() -> argparse.ArgumentParser:
@@ -116,7 +121,7 @@ def main():
     if args.charge:
         charge()
     elif args.get:
-        get_battery_info()
+        write_data_base(get_battery_info(), f"firmware/{os.path.basename(__file__)[:-3]}_data.json")
 
 
 if __name__ == "__main__":
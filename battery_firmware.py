@@ -0,0 +1,144 @@
+import sys
+import datetime as dt
+import argparse
+import json
+from typing import Union
+from sha3 import keccak_256
+from py_ecc.secp256k1 import ecdsa_raw_sign
+
+# Project modules
+from keystore import Keystore
+from TextColor.color import bcolors
+
+# Keystore opened on first use
+_keystore = None
+
+
+def get_keystore() -> Keystore:
+    """
+    Open keystore once per process
+
+    :return: Keystore
+    :rtype: Keystore
+    """
+
+    global _keystore
+
+    if _keystore is None:
+        _keystore = Keystore()
+
+    return _keystore
+
+
+def sign_battery_info(_private_key: bytes, _charges: int, _time: int) -> dict:
+    """
+    Sign battery's charge cycles and time the same way as battery firmware does
+
+    :param bytes _private_key: Battery's private key
+    :param int _charges: Charge cycles
+    :param int _time: Timestamp
+    :return: Battery's info (v, r, s, charges, time)
+    :rtype: dict
+    """
+
+    message = (_charges * (1 << 32) + _time).to_bytes(32, byteorder='big')
+    v, r, s = ecdsa_raw_sign(keccak_256(message).digest(), _private_key)
+
+    return {'v': v, 'r': f"{r:064x}", 's': f"{s:064x}", 'charges': _charges, 'time': _time}
+
+
+def get_battery_info(_battery_id: str) -> Union[dict, None]:
+    """
+    Get battery info(v, r, s, charges, time)
+
+    :param str _battery_id: Battery id or its prefix
+    :return: None if battery does not exist and battery's info if it does
+    :rtype: None/dict
+    """
+
+    keystore = get_keystore()
+    battery_id = keystore.resolve(_battery_id)
+
+    if battery_id is None:
+        return None
+
+    private_key, charges = keystore.get(battery_id)
+
+    return sign_battery_info(private_key, charges, int(dt.datetime.utcnow().timestamp()))
+
+
+def charge(_battery_id: str) -> bool:
+    """
+    Increase battery's charge cycles
+
+    :param str _battery_id: Battery id or its prefix
+    :return: True if battery exists and False if not
+    :rtype: bool
+    """
+
+    keystore = get_keystore()
+    battery_id = keystore.resolve(_battery_id)
+
+    if battery_id is None:
+        return False
+
+    keystore.charge(battery_id)
+
+    return True
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create cli argument parser
+
+    :return: Parser
+    :rtype: argparse.ArgumentParser
+    """
+
+    parser = argparse.ArgumentParser(
+        description = 'Battery firmware runtime'
+    )
+
+    parser.add_argument(
+        '--charge', type=str, required=False,
+        help="Charge battery <battery_id>"
+    )
+
+    parser.add_argument(
+        '--get', type=str, required=False,
+        help="Get battery info <battery_id>"
+    )
+
+    parser.add_argument(
+        '--migrate', action='store_true', required=False,
+        help="Move keys of per-file firmware to the keystore"
+    )
+
+    return parser
+
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+
+    if args.charge:
+        if not charge(args.charge):
+            sys.exit(f"{bcolors.FAIL}Battery does not exist{bcolors.ENDC}")
+
+    elif args.get:
+        info = get_battery_info(args.get)
+
+        if info is None:
+            sys.exit(f"{bcolors.FAIL}Battery does not exist{bcolors.ENDC}")
+
+        print(json.dumps(info))
+
+    elif args.migrate:
+        print(f"Migrated batteries: {get_keystore().migrate_firmware()}")
+
+    else:
+        sys.exit(f"{bcolors.FAIL}No parameters provided{bcolors.ENDC}")
+
+
+if __name__ == "__main__":
+    main()
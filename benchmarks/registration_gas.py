@@ -0,0 +1,183 @@
+import sys, os
+import argparse
+import subprocess
+import tempfile
+from web3 import Web3
+from web3.middleware import geth_poa_middleware
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project modules
+import utils
+from TextColor.color import bcolors
+
+
+URL = "http://127.0.0.1:8545"
+
+ACCOUNT_DB_NAME = 'account.json'
+CONTRACTS_DIR = 'contracts'
+CONTRACTS = {'token':  ('ERC20Token.sol', 'ERC20Token'),
+             'wallet': ('ServiceProviderWallet.sol', 'ServiceProviderWallet'),
+             'mgmt':   ('ManagementContract.sol', 'ManagementContract'),
+             'battery': ('BatteryManagement.sol', 'BatteryManagement')}
+BATCH_SIZES = [1, 10, 100, 1000]
+BENCHMARK_FEE = 1
+VENDOR_NAME = b'Benchmark'
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create cli argument parser
+
+    :return: Parser
+    :rtype: argparse.ArgumentParser
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Gas used by registration of batteries before and after the contracts change',
+        epilog="""
+               Run from the repository root against a development node.
+               Contracts of the working tree are compared with the contracts
+               of the baseline revision.
+               """
+    )
+
+    parser.add_argument(
+        '--baseline', type=str, required=True,
+        help='Git revision with the baseline contracts, e.g. the commit before the batch registration'
+    )
+
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=BATCH_SIZES,
+        help=f'Numbers of batteries registered in one transaction, {BATCH_SIZES} by default'
+    )
+
+    return parser
+
+
+def export_contracts(_revision: str, _dir: str) -> str:
+    """
+    Write contracts of the git revision to the directory
+
+    :param str _revision: Git revision
+    :param str _dir: Target directory
+    :return: Path to the exported contracts directory
+    :rtype: str
+    """
+
+    archive = subprocess.run(['git', 'archive', _revision, CONTRACTS_DIR], stdout=subprocess.PIPE, check=True)
+    subprocess.run(['tar', '-x', '-C', _dir], input=archive.stdout, check=True)
+
+    return os.path.join(_dir, CONTRACTS_DIR)
+
+
+def deploy(_w3: Web3, _actor: str, _contracts_dir: str, _batteries: int):
+    """
+    Deploy contracts from the directory and register the actor as a vendor
+
+    :param Web3 _w3: Web3 instance
+    :param str _actor: Account deploying contracts
+    :param str _contracts_dir: Directory with contracts sources
+    :param int _batteries: Number of batteries the vendor deposit has to cover
+    :return: Management contract
+    :rtype: Contract
+    """
+
+    from solcx import compile_files
+
+    files = {key: os.path.join(_contracts_dir, src) for key, (src, _) in CONTRACTS.items()}
+    compiled = compile_files(list(files.values()))
+    tx = {'from': _actor, 'gasPrice': utils.get_actual_gas_price(_w3)}
+
+    def deploy_one(key: str, *args) -> str:
+        factory = utils.initialize_contract_factory(_w3, compiled, files[key] + ":" + CONTRACTS[key][1])
+        tx_hash = factory.constructor(*args).transact(tx)
+
+        return _w3.eth.waitForTransactionReceipt(tx_hash, 120)['contractAddress']
+
+    token = deploy_one('token')
+    wallet = deploy_one('wallet')
+    mgmt = deploy_one('mgmt', wallet, _w3.toWei(BENCHMARK_FEE, 'gwei'))
+    battery = deploy_one('battery', mgmt, token)
+
+    mgmt_contract = utils.initialize_contract_factory(_w3, compiled, files['mgmt'] + ":" + CONTRACTS['mgmt'][1], mgmt)
+
+    tx_hash = mgmt_contract.functions.setBatteryManagementContract(battery).transact(tx)
+    _w3.eth.waitForTransactionReceipt(tx_hash, 120)
+
+    # vendor registration requires deposit for at least 1000 batteries
+    value = _w3.toWei(BENCHMARK_FEE, 'gwei') * max(1000, _batteries)
+    tx_hash = mgmt_contract.functions.registerVendor(VENDOR_NAME).transact(dict(tx, value=value))
+    _w3.eth.waitForTransactionReceipt(tx_hash, 120)
+
+    return mgmt_contract
+
+
+def measure(_w3: Web3, _actor: str, _mgmt_contract, _sizes: list) -> dict:
+    """
+    Estimate gas of batteries registration for every batch size
+
+    :param Web3 _w3: Web3 instance
+    :param str _actor: Registered vendor
+    :param Contract _mgmt_contract: Management contract
+    :param list _sizes: Batch sizes
+    :return: Pairs of batch size and gas, None if the batch does not fit the gas cap of the node
+    :rtype: dict
+    """
+
+    result = {}
+
+    for size in _sizes:
+        ids = [os.urandom(20) for _ in range(size)]
+
+        try:
+            result[size] = _mgmt_contract.functions.registerBatteries(ids).estimateGas({'from': _actor})
+        except ValueError:
+            result[size] = None
+
+    return result
+
+
+def _format(_gas: int, _size: int) -> str:
+    if _gas is None:
+        return f"{'exceeds gas cap':>28}"
+
+    return f"{_gas:>14} {_gas // _size:>13}"
+
+
+def main() -> None:
+    w3 = Web3(Web3.HTTPProvider(URL))
+
+    # configure provider to work with PoA chains
+    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    data = utils.open_data_base(ACCOUNT_DB_NAME)
+
+    if data is None:
+        sys.exit(f"{bcolors.FAIL}Cannot access account database{bcolors.ENDC}")
+
+    actor = data['account']
+    utils.unlock_account(w3, actor, data['password'])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = measure(w3, actor, deploy(w3, actor, export_contracts(args.baseline, tmp), max(args.sizes)),
+                           args.sizes)
+
+    current = measure(w3, actor, deploy(w3, actor, CONTRACTS_DIR, max(args.sizes)), args.sizes)
+
+    print(f"{'Batch':>6} | {'Baseline gas':>14} {'per battery':>13} | {'Current gas':>14} {'per battery':>13} | Saved")
+
+    for size in args.sizes:
+        saved = ''
+
+        if baseline[size] is not None and current[size] is not None:
+            saved = f"{100 * (baseline[size] - current[size]) / baseline[size]:.1f}%"
+
+        print(f"{size:>6} | {_format(baseline[size], size)} | {_format(current[size], size)} | {saved}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import sys, os
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project modules
+from registry import BatteryRegistry
+
+
+BATTERIES = 1000000
+OWNERS = 1000
+VENDORS = 10
+LOOKUPS = 100000
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create cli argument parser
+
+    :return: Parser
+    :rtype: argparse.ArgumentParser
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Memory per battery of the packed registry and of a dict of hex strings'
+    )
+
+    parser.add_argument(
+        '--count', type=int, default=BATTERIES,
+        help=f'Number of batteries, {BATTERIES} by default'
+    )
+
+    return parser
+
+
+def generate(_count: int) -> list:
+    """
+    Generate random batteries
+
+    :param int _count: Number of batteries
+    :return: Triples of battery id, vendor id and owner
+    :rtype: list
+    """
+
+    owners = [os.urandom(20) for _ in range(OWNERS)]
+    vendors = [os.urandom(4) for _ in range(VENDORS)]
+
+    return [(os.urandom(20), random.choice(vendors), random.choice(owners)) for _ in range(_count)]
+
+
+def build_dict(_batteries: list) -> dict:
+    # the same shape as JSON databases opened with utils.open_data_base
+    return {'0x' + battery_id.hex(): {'vendor': '0x' + vendor_id.hex(), 'owner': '0x' + owner.hex()}
+            for battery_id, vendor_id, owner in _batteries}
+
+
+def build_registry(_batteries: list) -> BatteryRegistry:
+    registry = BatteryRegistry(len(_batteries))
+
+    for battery_id, vendor_id, owner in _batteries:
+        registry.add(battery_id, vendor_id, owner)
+
+    return registry
+
+
+def measure(_build, _batteries: list) -> tuple:
+    """
+    :param callable _build: Function building the structure
+    :param list _batteries: Batteries
+    :return: Structure and allocated bytes
+    :rtype: tuple
+    """
+
+    tracemalloc.start()
+    structure = _build(_batteries)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return structure, allocated
+
+
+def lookup_rate(_lookup, _keys: list) -> float:
+    start = time.perf_counter()
+
+    for key in _keys:
+        _lookup(key)
+
+    return len(_keys) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = create_parser()
+    args = parser.parse_args()
+
+    batteries = generate(args.count)
+    sample = random.sample(batteries, min(LOOKUPS, args.count))
+
+    baseline, baseline_bytes = measure(build_dict, batteries)
+    baseline_rate = lookup_rate(lambda key: baseline[key]['owner'], ['0x' + battery[0].hex() for battery in sample])
+    del baseline
+
+    registry, registry_bytes = measure(build_registry, batteries)
+    registry_rate = lookup_rate(registry.owner_of, [battery[0] for battery in sample])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'registry.bin')
+        registry.save(path)
+        registry.release()
+
+        start = time.perf_counter()
+        loaded = BatteryRegistry.load(path)
+        load_time = time.perf_counter() - start
+        loaded_rate = lookup_rate(loaded.owner_of, [battery[0] for battery in sample])
+        snapshot_size = os.path.getsize(path)
+        loaded.release()
+
+    print(f"Batteries: {args.count}")
+    print(f"{'':<22} {'bytes/battery':>14} {'lookups/s':>12}")
+    print(f"{'dict of hex strings':<22} {baseline_bytes / args.count:>14.1f} {baseline_rate:>12.0f}")
+    print(f"{'registry':<22} {registry_bytes / args.count:>14.1f} {registry_rate:>12.0f}")
+    print(f"{'registry (mmap)':<22} {snapshot_size / args.count:>14.1f} {loaded_rate:>12.0f}")
+    print(f"Snapshot load time: {load_time * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import time
+import threading
+from collections import OrderedDict
+from web3 import Web3
+
+# Project modules
+from rpc_batch import BatchCall, CallResult, BLOCK_NUMBER
+
+
+# Returned by get() when there is no valid entry
+MISS = object()
+
+
+class CallCache:
+    """
+    LRU cache of read-only contract calls keyed by the block they were
+    evaluated at. Only entries of the latest known block are returned.
+    The latest block is learned from the batch requests sending the missed
+    calls or from the background follower of long-running processes, so
+    lookups never wait for the node
+    """
+
+    def __init__(self, _w3: Web3, _maxsize: int = 1024, _block_poll: float = 1):
+        """
+        :param Web3 _w3: Web3 instance
+        :param int _maxsize: Maximum number of entries
+        :param float _block_poll: Delay between checks for a new block in seconds. Without
+                                  the follower the known block is trusted for twice this time
+        """
+
+        self.w3 = _w3
+        self.maxsize = _maxsize
+        self.block_poll = _block_poll
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.block = None
+        self.block_seen_at = 0
+        self.follower = None
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'blocks': 0}
+
+    def advance(self, _block: int) -> None:
+        """
+        Remember the latest block and drop entries of the previous ones
+
+        :param int _block: Block number
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            self.block_seen_at = time.monotonic()
+
+            if self.block is not None and _block <= self.block:
+                return
+
+            self.block = _block
+            self.counters['blocks'] += 1
+
+            for key in [key for key in self.entries if key[0] != _block]:
+                del self.entries[key]
+
+    def follow(self) -> None:
+        """
+        Follow new blocks in a background thread
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        def run() -> None:
+            while True:
+                try:
+                    self.advance(self.w3.eth.blockNumber)
+                except IOError:
+                    # node is temporarily unreachable, cached block is not trusted after a while
+                    pass
+
+                time.sleep(self.block_poll)
+
+        with self.lock:
+            if self.follower is None:
+                self.follower = threading.Thread(target=run, daemon=True)
+                self.follower.start()
+
+    @staticmethod
+    def _key(_block: int, _function, _tx: dict) -> tuple:
+        return (_block, _function.address, _function.fn_name, repr(_function.args), repr(sorted((_tx or {}).items())))
+
+    def get(self, _function, _tx: dict = None):
+        """
+        :param ContractFunction _function: Contract function with arguments
+        :param dict _tx: Call parameters
+        :return: Value cached at the latest known block or MISS
+        """
+
+        with self.lock:
+            if self.block is None or time.monotonic() - self.block_seen_at > 2 * self.block_poll:
+                self.counters['misses'] += 1
+                return MISS
+
+            key = self._key(self.block, _function, _tx)
+            entry = self.entries.get(key, MISS)
+
+            if entry is MISS:
+                self.counters['misses'] += 1
+                return MISS
+
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+
+            return entry
+
+    def put(self, _function, _value, _block: int, _tx: dict = None) -> None:
+        """
+        :param ContractFunction _function: Contract function with arguments
+        :param _value: Call result
+        :param int _block: Block the call was evaluated at
+        :param dict _tx: Call parameters
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            if self.block is not None and _block < self.block:
+                return
+
+            key = self._key(_block, _function, _tx)
+            self.entries[key] = _value
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def call_many(self, _calls: dict) -> dict:
+        """
+        Take results of the calls from the cache and send the rest of them
+        with the latest block number in one batch request
+
+        :param dict _calls: Pairs of call keys and contract functions
+        :return: Pairs of call keys and their results
+        :rtype: dict
+        """
+
+        batch = BatchCall(self.w3)
+        results = {}
+
+        for key, function in _calls.items():
+            value = self.get(function)
+
+            if value is MISS:
+                batch.add(key, function)
+            else:
+                results[key] = CallResult(value, None)
+
+        if len(batch.calls) == 0:
+            return results
+
+        # head is requested before the calls, so their results are at least as new
+        batch.add_block_number()
+        executed = batch.execute()
+        block = executed.pop(BLOCK_NUMBER)
+
+        if block.error is None:
+            self.advance(block.result)
+
+        for key, result in executed.items():
+            if result.error is None and block.error is None:
+                self.put(_calls[key], result.result, block.result)
+
+            results[key] = result
+
+        return results
+
+    def call(self, _function, _tx: dict = None):
+        """
+        Call contract function or return its cached result
+
+        :param ContractFunction _function: Contract function with arguments
+        :param dict _tx: Call parameters
+        :return: Call result
+        """
+
+        value = self.get(_function, _tx)
+
+        if value is not MISS:
+            return value
+
+        executed = BatchCall(self.w3).add_block_number().add('call', _function, _tx).execute()
+        block, result = executed[BLOCK_NUMBER], executed['call']
+
+        if result.error is not None:
+            raise result.error
+
+        if block.error is None:
+            self.advance(block.result)
+            self.put(_function, result.result, block.result, _tx)
+
+        return result.result
+
+    def stats(self) -> dict:
+        """
+        :return: Hit, miss, eviction and new block counters and number of entries
+        :rtype: dict
+        """
+
+        return dict(self.counters, size=len(self.entries))
@@ -1,8 +1,12 @@
 import sys, os
+import time
 import subprocess
 import datetime as dt
 from random import randint
 import argparse
+from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+import requests
 import web3
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
@@ -10,10 +14,15 @@ from eth_utils import decode_hex
 
 # Project modules
 import utils
+from nonces import get_nonce_manager
 from TextColor.color import bcolors
 
 URL = "http://127.0.0.1:8545"
 ACCOUNT_DB_NAME = 'car.json'
+SCENTER_URL = "http://127.0.0.1:8600"
+# Battery transfer waits for the receipt on the service center side
+SCENTER_TIMEOUT = 180
+REPLACEMENT_WORKERS = 4
 MGMT_CONTRACT_DB_NAME = utils.MGMT_CONTRACT_DB_NAME
 MGMT_CONTRACT_SRC_PATH = utils.MGMT_CONTRACT_SRC_PATH
 CONFIG = utils.open_data_base(ACCOUNT_DB_NAME)
@@ -90,12 +99,14 @@ def register_car(_w3: Web3):
     if registration_required_gas * gas_price > _w3.eth.getBalance(car_address):
         return 'No enough funds to send transaction'
 
-    nonce = _w3.eth.getTransactionCount(car_address)
-    tx = {'gasPrice': gas_price, 'nonce': nonce}
+    def send(nonce: int):
+        tx = {'gasPrice': gas_price, 'nonce': nonce}
 
-    regTx = mgmt_contract.functions.registerCar().buildTransaction(tx)
-    signTx = _w3.eth.account.signTransaction(regTx, private_key)
-    txHash = _w3.eth.sendRawTransaction(signTx.rawTransaction)
+        regTx = mgmt_contract.functions.registerCar().buildTransaction(tx)
+        signTx = _w3.eth.account.signTransaction(regTx, private_key)
+        return _w3.eth.sendRawTransaction(signTx.rawTransaction)
+
+    txHash = get_nonce_manager(_w3, car_address).send(send)
     receipt = web3.eth.wait_for_transaction_receipt(_w3, txHash, 120, 0.1)
 
     if receipt.status == 1:
@@ -143,24 +154,54 @@ def create_parser() -> argparse.ArgumentParser:
     )
 
     parser.add_argument(
-        '--initiate_replacement', nargs=2, required=False,
-        help='Initiate deal <car_battery> <sc_battery>'
+        '--initiate_replacement', nargs='+', required=False,
+        help='Initiate deal <car_battery> [<sc_battery>], the best battery of the service center by default'
+    )
+
+    parser.add_argument(
+        '--swap', nargs='+', required=False,
+        help='Initiate deal with batteries exchanged in one transaction <car_battery> [<sc_battery>]'
     )
 
     return parser
 
 
-def ask_for_replacement(car_battery_id: str, sc_battery_id: str, car_address: str) -> None:
+def scenter_request(path: str, payload: dict) -> Union[dict, None]:
+    """
+    Send request to the service center running in server mode
+
+    :param str path: Request path
+    :param dict payload: Request parameters
+    :return: None if the server is not running and response if it is
+    :rtype: None/dict
+    """
+
+    try:
+        response = requests.post(SCENTER_URL + path, json=payload, timeout=SCENTER_TIMEOUT)
+    except requests.ConnectionError:
+        return None
+
+    return response.json()
+
+
+def ask_for_replacement(car_battery_id: str, sc_battery_id: str, car_address: str) -> Union[dict, None]:
     """
     Ask service center for replacement approval
 
     :param str car_battery_id: Car's battery
     :param str sc_battery_id: Service center's battery
     :param str car_address: Car's blockchain address
-    :return: Nothing
-    :rtype: None 
+    :return: Approval status and maybe error or None if something went wrong
+    :rtype: dict/None
     """
 
+    message = scenter_request('/approve_replacement', {'car_battery_id': car_battery_id,
+                                                       'sc_battery_id': sc_battery_id,
+                                                       'car_address': car_address})
+
+    if message is not None:
+        return message
+
     if os.path.exists(f"scenter.py"):
         subprocess.run(
             [
@@ -175,6 +216,33 @@ def ask_for_replacement(car_battery_id: str, sc_battery_id: str, car_address: st
     else:
         sys.exit(f"{bcolors.FAIL}The asked service center does not exists{bcolors.ENDC}")
 
+    return utils.open_data_base('replacement.json')
+
+
+def select_sc_battery() -> str:
+    """
+    Ask service center for its battery with the least charge cycles
+
+    return: Service center's battery id
+    rtype: str
+    """
+
+    response = scenter_request('/select_battery', {})
+
+    if response is not None:
+        if 'error' in response:
+            sys.exit(response['error'])
+
+        return response['battery_id']
+
+    command = "python scenter.py --select_battery".split(' ')
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    return result.stdout[:-1]
+
 
 def get_sc_address() -> str:
     """
@@ -184,33 +252,34 @@ def get_sc_address() -> str:
     rtype: str
     """
 
+    response = scenter_request('/get_address', {})
+
+    if response is not None:
+        return response['address']
+
     command = "python scenter.py --get_address".split(' ')
     result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
 
     return result.stdout[:-1]
 
 
-def transfer_battery_to_sc(w3: Web3, car_battery_id: str, sc_address: str):
+def sign_transfer_to_sc(w3: Web3, car_battery_id: str, sc_address: str) -> tuple:
     """
-    Transfer battery to service center
+    Build and sign transfer of the battery to service center
+    without sending it
 
     :param Web3 w3: Web3 instance
     :param str car_battery_id: Car's battery id
-    :param str sc_battery_id: Service centers's battery id
+    :param str sc_address: Service centers's address
 
-    return: Nothing
-    rtype: None
+    return: Signed transaction and reserved nonce
+    rtype: tuple
     """
 
-    data = utils.open_data_base(MGMT_CONTRACT_DB_NAME)
-
-    if data is None:
-        return 'Cannot access management contract database'
-        
     data = utils.open_data_base(ACCOUNT_DB_NAME)
 
     if data is None:
-        return 'Cannot access account database'
+        sys.exit('Cannot access account database')
 
     private_key = data['key']
     battery_mgmt_contract_addr = utils.get_battery_managment_contract_addr(w3)
@@ -218,11 +287,26 @@ def transfer_battery_to_sc(w3: Web3, car_battery_id: str, sc_address: str):
     car_address = w3.eth.account.privateKeyToAccount(private_key).address
     gas_price = utils.get_actual_gas_price(w3)
 
-    nonce = w3.eth.getTransactionCount(car_address)
+    nonce = get_nonce_manager(w3, car_address).reserve()
     tx = {'gasPrice': gas_price, 'nonce': nonce, 'gas': 2204 * 68 + 21000}
 
     reg_tx = battery_mgmt_contract.functions.transfer(sc_address, decode_hex(car_battery_id)).buildTransaction(tx)
     sign_tx = w3.eth.account.signTransaction(reg_tx, private_key)
+
+    return sign_tx, nonce
+
+
+def send_transfer_to_sc(w3: Web3, sign_tx) -> None:
+    """
+    Send signed transfer of the battery and wait for its inclusion
+
+    :param Web3 w3: Web3 instance
+    :param sign_tx: Signed transaction
+
+    return: Nothing
+    rtype: None
+    """
+
     tx_hash = w3.eth.sendRawTransaction(sign_tx.rawTransaction)
     receipt = web3.eth.wait_for_transaction_receipt(w3, tx_hash, 120, 0.1)
 
@@ -230,6 +314,27 @@ def transfer_battery_to_sc(w3: Web3, car_battery_id: str, sc_address: str):
         sys.exit(f"{bcolors.FAIL}The car does not own this battery!{bcolors.ENDC}")
 
 
+def transfer_battery_to_sc(w3: Web3, car_battery_id: str, sc_address: str):
+    """
+    Transfer battery to service center
+
+    :param Web3 w3: Web3 instance
+    :param str car_battery_id: Car's battery id
+    :param str sc_battery_id: Service centers's battery id
+
+    return: Nothing
+    rtype: None
+    """
+
+    data = utils.open_data_base(MGMT_CONTRACT_DB_NAME)
+
+    if data is None:
+        return 'Cannot access management contract database'
+
+    sign_tx, _ = sign_transfer_to_sc(w3, car_battery_id, sc_address)
+    send_transfer_to_sc(w3, sign_tx)
+
+
 def get_new_battery(car_account: str, car_battery_id: str, sc_battery_id) -> float:
     """
     Call battery replacement in service center
@@ -240,15 +345,46 @@ def get_new_battery(car_account: str, car_battery_id: str, sc_battery_id) -> flo
     :rtype: float
     """
 
+    response = scenter_request('/transfer_battery_to_car', {'car_account': car_account,
+                                                            'car_battery_id': car_battery_id,
+                                                            'sc_battery_id': sc_battery_id})
+
+    if response is not None:
+        if 'error' in response:
+            sys.exit(response['error'])
+
+        return response['cost']
+
     command = f"python scenter.py --transfer_battery_to_car {car_account} {car_battery_id} {sc_battery_id}".split(' ')
     result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
 
     return float(result.stdout[:-1])
 
 
+def _timed(timings: dict, phase: str, func, *args):
+    """
+    Run function and record its duration
+
+    :param dict timings: Pairs of phases and their durations
+    :param str phase: Phase name
+    :param callable func: Function to run
+    :return: Function result
+    """
+
+    start = time.monotonic()
+
+    try:
+        return func(*args)
+    finally:
+        timings[phase] = time.monotonic() - start
+
+
 def initiate_replacement(w3: Web3, car_battery_id: str, sc_battery_id: str) -> None:
     """
-    Initiate battery replacement
+    Initiate battery replacement. Verification of the service center's
+    battery, approval request, service center's address lookup and
+    signing of the outgoing transfer run concurrently; the transfer is
+    sent only after both verifications succeed
 
     :param Web3 w3: Web3 instance
     :param str car_battery_id: Car's battery
@@ -257,65 +393,162 @@ def initiate_replacement(w3: Web3, car_battery_id: str, sc_battery_id: str) -> N
     :rtype: None
     """
 
-    sc_battery_id_path = f"firmware/{car_battery_id[:8]}.py"
-    car_battery_id_path = f"firmware/{sc_battery_id[:8]}.py"
+    car_address = get_car_account_from_db(w3)
+    timings = {}
+    started = time.monotonic()
 
-    print("Verifying battery...")
+    print("Verifying battery and asking service center for replacement...")
 
-    data = utils.verify_battery(w3, sc_battery_id_path)
+    with ThreadPoolExecutor(max_workers=REPLACEMENT_WORKERS) as pool:
+        verification = pool.submit(_timed, timings, 'Battery verification', utils.verify_battery, w3, sc_battery_id)
+        approval = pool.submit(_timed, timings, 'Replacement approval', ask_for_replacement,
+                               car_battery_id, sc_battery_id, car_address)
+        sc_address = pool.submit(_timed, timings, 'Service center address', get_sc_address)
+        # outgoing transfer is signed while approval is pending
+        transfer = pool.submit(lambda: _timed(timings, 'Transfer signing', sign_transfer_to_sc,
+                                              w3, car_battery_id, sc_address.result()))
 
-    if not data[0]:
-        sys.exit(f"{bcolors.FAIL}The battery is fake{bcolors.ENDC}")
+        try:
+            if not verification.result()[0]:
+                sys.exit(f"{bcolors.FAIL}The battery is fake{bcolors.ENDC}")
 
-    sys.stdout.write("\033[F") #back to previous line
-    sys.stdout.write("\033[K") #clear line
+            print(f"Verifying battery...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
 
-    print(f"Verifying battery...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
+            message = approval.result()
 
-    print("Asking service center for replacement...")
+            if message is None:
+                sys.exit(f"{bcolors.FAIL}Somethong went wrong...{bcolors.ENDC}")
 
-    ask_for_replacement(car_battery_id, sc_battery_id, get_car_account_from_db(w3))
+            if not message['approved']:
+                sys.exit(message['error'])
 
-    message = utils.open_data_base('replacement.json')
+            print(f"Asking service center for replacement...{bcolors.OKGREEN}Approved{bcolors.ENDC}", u'\u2713')
 
-    if message is None:
-        sys.exit(f"{bcolors.FAIL}Somethong went wrong...{bcolors.ENDC}")
-    
-    if not message['approved']:
-        sys.exit(message['error'])
-    
-    sys.stdout.write("\033[F") #back to previous line
-    sys.stdout.write("\033[K") #clear line
+            sign_tx, nonce = transfer.result()
+        except SystemExit:
+            # signed transfer is not sent, its nonce is free again
+            if transfer.exception() is None:
+                get_nonce_manager(w3, car_address).release(transfer.result()[1])
+            raise
 
-    print(f"Asking service center for replacement...{bcolors.OKGREEN}Approved{bcolors.ENDC}", u'\u2713')
+    print("Transferring battery to the service center...")
 
-    print("Getting address of the service center...")
-    
-    sc_address = get_sc_address()
+    _timed(timings, 'Transfer to service center', send_transfer_to_sc, w3, sign_tx)
 
     sys.stdout.write("\033[F") #back to previous line
     sys.stdout.write("\033[K") #clear line
 
-    print(f"Getting address of the service center...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
+    print(f"Transferring battery to the service center...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
 
-    print("Transferring battery to the service center...")
+    print("Waiting for new battery installation...")
 
-    transfer_battery_to_sc(w3, car_battery_id, sc_address)
+    result = _timed(timings, 'New battery installation', get_new_battery, car_address, car_battery_id, sc_battery_id)
 
     sys.stdout.write("\033[F") #back to previous line
     sys.stdout.write("\033[K") #clear line
 
-    print(f"Transferring battery to the service center...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
+    print(f"Battery was installed...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
 
-    print("Waiting for new battery installation...")
+    for phase, duration in timings.items():
+        print(f"{phase}: {duration:.2f} s")
+
+    print(f"Total: {time.monotonic() - started:.2f} s")
+    
+    return result
+
+
+def swap_with_sc(w3: Web3, car_battery_id: str, sc_battery_id: str, sc_address: str) -> float:
+    """
+    Sign the swap and ask service center to exchange the batteries in one transaction
+
+    :param Web3 w3: Web3 instance
+    :param str car_battery_id: Car's battery id
+    :param str sc_battery_id: Service center's battery id
+    :param str sc_address: Service centers's address
+    :return: Work's cost
+    :rtype: float
+    """
+
+    private_key = CONFIG['key']
+    car_address = w3.eth.account.privateKeyToAccount(private_key).address
+    deadline = int(time.time()) + utils.SWAP_SIGNATURE_TTL
 
-    result = get_new_battery(get_car_account_from_db(w3), car_battery_id, sc_battery_id)
+    h = utils.swap_hash(w3, car_address, sc_address, car_battery_id, sc_battery_id, deadline)
+    signature = utils.sign_swap(w3, h, _private_key=private_key)
+
+    response = scenter_request('/swap', {'car_account': car_address,
+                                         'car_battery_id': car_battery_id,
+                                         'sc_battery_id': sc_battery_id,
+                                         'deadline': deadline,
+                                         'car_signature': signature})
+
+    if response is not None:
+        if 'error' in response:
+            sys.exit(response['error'])
+
+        return response['cost']
+
+    command = f"python scenter.py --swap {car_address} {car_battery_id} {sc_battery_id} {deadline} {signature}".split(' ')
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    return float(result.stdout[:-1])
+
+
+def initiate_swap(w3: Web3, car_battery_id: str, sc_battery_id: str) -> float:
+    """
+    Initiate battery replacement with both ownership changes in one transaction
+
+    :param Web3 w3: Web3 instance
+    :param str car_battery_id: Car's battery
+    :param str sc_battery_id: Service center's battery
+    :return: Work's cost
+    :rtype: float
+    """
+
+    car_address = get_car_account_from_db(w3)
+    timings = {}
+    started = time.monotonic()
+
+    print("Verifying battery and asking service center for replacement...")
+
+    with ThreadPoolExecutor(max_workers=REPLACEMENT_WORKERS) as pool:
+        verification = pool.submit(_timed, timings, 'Battery verification', utils.verify_battery, w3, sc_battery_id)
+        approval = pool.submit(_timed, timings, 'Replacement approval', ask_for_replacement,
+                               car_battery_id, sc_battery_id, car_address)
+        sc_address = pool.submit(_timed, timings, 'Service center address', get_sc_address)
+
+        if not verification.result()[0]:
+            sys.exit(f"{bcolors.FAIL}The battery is fake{bcolors.ENDC}")
+
+        print(f"Verifying battery...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
+
+        message = approval.result()
+
+        if message is None:
+            sys.exit(f"{bcolors.FAIL}Somethong went wrong...{bcolors.ENDC}")
+
+        if not message['approved']:
+            sys.exit(message['error'])
+
+        print(f"Asking service center for replacement...{bcolors.OKGREEN}Approved{bcolors.ENDC}", u'\u2713')
+
+    print("Swapping batteries...")
+
+    result = _timed(timings, 'Swap', swap_with_sc, w3, car_battery_id, sc_battery_id, sc_address.result())
 
     sys.stdout.write("\033[F") #back to previous line
     sys.stdout.write("\033[K") #clear line
 
-    print(f"Battery was installed...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
-    
+    print(f"Swapping batteries...{bcolors.OKGREEN}Success{bcolors.ENDC}", u'\u2713')
+
+    for phase, duration in timings.items():
+        print(f"{phase}: {duration:.2f} s")
+
+    print(f"Total: {time.monotonic() - started:.2f} s")
+
     return result
 
 
@@ -345,7 +578,13 @@ def main():
         print(f"Vendor name: {data[3]}")
     
     elif args.initiate_replacement:
-        cost = initiate_replacement(w3, args.initiate_replacement[0], args.initiate_replacement[1])
+        sc_battery_id = args.initiate_replacement[1] if len(args.initiate_replacement) > 1 else select_sc_battery()
+        cost = initiate_replacement(w3, args.initiate_replacement[0], sc_battery_id)
+        print(f"Cost of work: {cost} eth")
+
+    elif args.swap:
+        sc_battery_id = args.swap[1] if len(args.swap) > 1 else select_sc_battery()
+        cost = initiate_swap(w3, args.swap[0], sc_battery_id)
         print(f"Cost of work: {cost} eth")
 
 
@@ -20,7 +20,7 @@ contract BatteryManagement is Ownable, BasicNFToken{
     // from - address of the previous owner
     // to - address of the new owner
     // batteryId - battery identifier
-    event Transfer(address from, address to, bytes20 batteryId);
+    event Transfer(address indexed from, address indexed to, bytes20 indexed batteryId);
 
     // Contract constructor
     // - The address of the contract managing the list of vendors.
@@ -45,6 +45,23 @@ contract BatteryManagement is Ownable, BasicNFToken{
         _transfer(address(0), _vendor, _tokenId);
     }
 
+    // Creates several new batteries in one call.
+    // The owner of the batteries is their creator.
+    // Creating new batteries may only be available.
+    // management contract
+    // - battery manufacturer address
+    // - battery identifiers
+    function createBatteries(address _vendor, bytes20[] calldata _tokenIds) external {
+        require(msg.sender == address(managementContract), "Not enough rights to call");
+
+        for (uint i = 0; i < _tokenIds.length; i++){
+            require(!batteryExists(_tokenIds[i]), "Battery id is not unique");
+
+            _setTokenWithID(_tokenIds[i], _vendor);
+            _transfer(address(0), _vendor, _tokenIds[i]);
+        }
+    }
+
     // Checks if a token with this identifier is registered by any of the manufacturers.
     function batteryExists(bytes20 _batteryId) internal view returns (bool) {
         return tokenID[_batteryId] != address(0);
@@ -64,6 +81,76 @@ contract BatteryManagement is Ownable, BasicNFToken{
         emit Transfer(msg.sender, _to, _tokenId);
     }
 
+    // Changes the owner of several batteries. Batteries which are not
+    // owned by the caller are skipped, transferred ones are reported
+    // by Transfer events
+    //_to - address of the new owner
+    //_tokenIds - battery identifiers
+    function transferBatch(address _to, bytes20[] calldata _tokenIds) external {
+        bool transferred = false;
+
+        for (uint i = 0; i < _tokenIds.length; i++){
+            if (msg.sender != tokenIdToOwner[_tokenIds[i]]) {
+                continue;
+            }
+
+            _transfer(msg.sender, _to, _tokenIds[i]);
+            transferred = true;
+
+            emit Transfer(msg.sender, _to, _tokenIds[i]);
+        }
+
+        if (transferred) {
+            carHasBattery[_to] = true;
+        }
+    }
+
+    // Calculates the hash of the swap signed by both parties
+    // _car - address of the car
+    // _sc - address of the service center
+    // _carBatteryId - identifier of the car's battery
+    // _scBatteryId - identifier of the service center's battery
+    // _deadline - time until which the signatures are valid
+    function swapHash(address _car, address _sc, bytes20 _carBatteryId, bytes20 _scBatteryId, uint256 _deadline)
+    public view returns (bytes32){
+        return keccak256(abi.encodePacked(address(this), _car, _sc, _carBatteryId, _scBatteryId, _deadline));
+    }
+
+    // Returns the address which signed the hash as an Ethereum signed message
+    function swapSigner(bytes32 _hash, uint8 _v, bytes32 _r, bytes32 _s) internal pure returns (address){
+        return ecrecover(keccak256(abi.encodePacked("\x19Ethereum Signed Message:\n32", _hash)), _v, _r, _s);
+    }
+
+    // Exchanges batteries of the car and the service center in one transaction.
+    // Can be sent by anyone holding signatures of both parties
+    // _car - address of the car
+    // _sc - address of the service center
+    // _carBatteryId - identifier of the car's battery
+    // _scBatteryId - identifier of the service center's battery
+    // _deadline - time until which the signatures are valid
+    // _v, _r, _s - signature components of the car (0) and the service center (1)
+    function swap(address _car, address _sc, bytes20 _carBatteryId, bytes20 _scBatteryId, uint256 _deadline,
+                  uint8[2] calldata _v, bytes32[2] calldata _r, bytes32[2] calldata _s) external {
+        require(now <= _deadline, "Swap signatures expired");
+        require(_car == tokenIdToOwner[_carBatteryId], "The car does not own this battery");
+        require(_sc == tokenIdToOwner[_scBatteryId], "Service center does not own this battery");
+
+        bytes32 h = swapHash(_car, _sc, _carBatteryId, _scBatteryId, _deadline);
+
+        require(!reused[h], "Swap is already done");
+        require(swapSigner(h, _v[0], _r[0], _s[0]) == _car, "Wrong car signature");
+        require(swapSigner(h, _v[1], _r[1], _s[1]) == _sc, "Wrong service center signature");
+
+        reused[h] = true;
+
+        _transfer(_car, _sc, _carBatteryId);
+        _transfer(_sc, _car, _scBatteryId);
+        carHasBattery[_car] = true;
+
+        emit Transfer(_car, _sc, _carBatteryId);
+        emit Transfer(_sc, _car, _scBatteryId);
+    }
+
     // Calculates battery Id from information from its firmware
     // _v - v signature component for battery
     // _r - r signature component for the battery
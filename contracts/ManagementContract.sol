@@ -33,12 +33,12 @@ contract ManagementContract is Ownable {
     //To notify the registration of a new manufacturer
     //  - account address from which registration took place
     //  - manufacturer identifier
-    event Vendor(address owner, bytes4 tokenId);
+    event Vendor(address indexed owner, bytes4 indexed tokenId);
 
     // To alert you when a new battery is created
     // - manufacturer identifier
     // - battery identifier
-    event NewBattery(bytes4 tokenId, bytes20 batteryId);
+    event NewBattery(bytes4 indexed tokenId, bytes20 indexed batteryId);
 
     // Contract constructor
     // _serviceProviderWalletAddr - address of the contract responsible for the accumulation of cryptocurrency,
@@ -93,9 +93,9 @@ contract ManagementContract is Ownable {
             address(serviceProviderWallet).transfer(msg.value);
         }
 
-        for (uint i = 0; i < _n; i++){
-            batteryManagement.createBattery(msg.sender, _ids[i]);
+        batteryManagement.createBatteries(msg.sender, _ids);
 
+        for (uint i = 0; i < _n; i++){
             emit NewBattery(_tokenId, _ids[i]);
         }
 
@@ -0,0 +1,33 @@
+pragma solidity ^0.6.4;
+
+import "./ManagementContract.sol";
+import "./BatteryManagement.sol";
+
+contract Multicall {
+    ManagementContract public managementContract;
+
+    // Contract constructor
+    // _mgmt - address of the contract managing the list of vendors
+    constructor(address _mgmt) public {
+        managementContract = ManagementContract(_mgmt);
+    }
+
+    // Returns vendor of the battery, vendor identifier and name.
+    // Vendor is zero address if the battery is not registered.
+    // _batteryId - battery identifier
+    function batteryVendor(bytes20 _batteryId) public view
+    returns (address vendor, bytes4 vendorId, bytes memory vendorName) {
+        BatteryManagement batteryManagement = BatteryManagement(managementContract.getBatteryManagmentAddr());
+
+        vendor = batteryManagement.vendorOf(_batteryId);
+        vendorId = managementContract.vendorId(vendor);
+        vendorName = managementContract.vendorNames(vendorId);
+    }
+
+    // Returns battery registration fee and vendor's deposit
+    // _vendor - vendor address
+    function vendorInfo(address _vendor) public view returns (uint256 fee, uint256 deposit) {
+        fee = managementContract.getFee();
+        deposit = managementContract.vendorDeposit(_vendor);
+    }
+}
@@ -0,0 +1,88 @@
+import os
+import hmac
+import hashlib
+from eth_keys import keys
+
+
+# Order of the secp256k1 curve
+SECP256K1_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAEDCE6AF48A03BBFD25E8CD0364141
+HARDENED = 1 << 31
+MASTER_KEY_SALT = b"Battery seed"
+
+
+def new_seed() -> str:
+    """
+    Generate vendor master seed
+
+    :return: Seed in hex
+    :rtype: str
+    """
+
+    return os.urandom(32).hex()
+
+
+def _master_node(_seed: bytes) -> tuple:
+    digest = hmac.new(MASTER_KEY_SALT, _seed, hashlib.sha512).digest()
+
+    return int.from_bytes(digest[:32], 'big'), digest[32:]
+
+
+def _child_node(_node: tuple, _index: int) -> tuple:
+    """
+    Hardened child derivation (BIP32)
+
+    :param tuple _node: Parent key and chain code
+    :param int _index: Child index, less than 2**31
+    :return: Child key and chain code
+    :rtype: tuple
+    """
+
+    key, chain_code = _node
+    data = b'\0' + key.to_bytes(32, 'big') + (_index + HARDENED).to_bytes(4, 'big')
+    digest = hmac.new(chain_code, data, hashlib.sha512).digest()
+    tweak = int.from_bytes(digest[:32], 'big')
+    child = (tweak + key) % SECP256K1_N
+
+    if tweak >= SECP256K1_N or child == 0:
+        raise ValueError(f"Invalid key at index {_index}")
+
+    return child, digest[32:]
+
+
+def derive_battery_key(_seed: str, _index: int) -> str:
+    """
+    Derive battery private key from vendor master seed and battery serial index
+    along the path m/(index / 2**31)'/(index % 2**31)'
+
+    :param str _seed: Vendor master seed in hex
+    :param int _index: Battery serial index
+    :return: Private key in hex
+    :rtype: str
+    """
+
+    node = _master_node(bytes.fromhex(_seed))
+    node = _child_node(node, _index // HARDENED)
+    key, _ = _child_node(node, _index % HARDENED)
+
+    return hex(key)
+
+
+def derive_keys_range(_seed: str, _start: int, _count: int) -> list:
+    """
+    Derive keys of the batteries with serial indexes [_start, _start + _count)
+
+    :param str _seed: Vendor master seed in hex
+    :param int _start: First serial index
+    :param int _count: Number of keys
+    :return: Pairs of private key (hex) and battery address
+    :rtype: list
+    """
+
+    result = []
+
+    for index in range(_start, _start + _count):
+        key = derive_battery_key(_seed, index)
+        address = keys.PrivateKey(int(key, 16).to_bytes(32, 'big')).public_key.to_checksum_address()
+        result.append((key, address))
+
+    return result
@@ -0,0 +1,449 @@
+import sys, os
+import time
+import argparse
+import sqlite3
+import threading
+from typing import Union
+from web3 import Web3
+from web3.middleware import geth_poa_middleware
+from eth_utils import decode_hex
+
+# Project modules
+import utils
+import provenance
+from TextColor.color import bcolors
+
+
+URL = "http://127.0.0.1:8545"
+
+INDEX_DB_NAME = 'index.db'
+# Number of blocks rolled back when a reorg is detected
+REORG_DEPTH = 12
+POLL_INTERVAL = 2
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS cursor ("
+    "id INTEGER PRIMARY KEY CHECK (id = 0), "
+    "start INTEGER NOT NULL, "
+    "block INTEGER NOT NULL, "
+    "hash BLOB"
+    ")",
+    "CREATE TABLE IF NOT EXISTS vendors ("
+    "id BLOB PRIMARY KEY, "
+    "owner BLOB NOT NULL, "
+    "block INTEGER NOT NULL"
+    ") WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS vendors_owner ON vendors (owner)",
+    "CREATE TABLE IF NOT EXISTS batteries ("
+    "id BLOB PRIMARY KEY, "
+    "vendor BLOB NOT NULL, "
+    "owner BLOB, "
+    "block INTEGER NOT NULL"
+    ") WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS batteries_owner ON batteries (owner)",
+    "CREATE INDEX IF NOT EXISTS batteries_vendor ON batteries (vendor)",
+    "CREATE TABLE IF NOT EXISTS transfers ("
+    "block INTEGER NOT NULL, "
+    "log_index INTEGER NOT NULL, "
+    "battery BLOB NOT NULL, "
+    "sender BLOB NOT NULL, "
+    "receiver BLOB NOT NULL, "
+    "PRIMARY KEY (block, log_index)"
+    ") WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS transfers_battery ON transfers (battery, block, log_index)",
+)
+
+# Index opened on first use
+_index = None
+
+
+class Indexer:
+    """
+    Follows Vendor, NewBattery and Transfer events into SQLite tables
+    answering ownership and inventory questions without calling the node
+    """
+
+    def __init__(self, _w3: Web3, _path: str = INDEX_DB_NAME, _from_block: int = 0):
+        """
+        :param Web3 _w3: Web3 instance
+        :param str _path: Path to the index file
+        :param int _from_block: First indexed block of a new index
+        """
+
+        self.w3 = _w3
+        self.path = _path
+        # serializes indexing within the process
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.follower = None
+
+        # readers see the last commit while new blocks are indexed
+        self.db.execute("PRAGMA journal_mode=WAL")
+
+        for statement in SCHEMA:
+            self.db.execute(statement)
+
+        self.db.execute("INSERT OR IGNORE INTO cursor (id, start, block) VALUES (0, ?, ?)", (_from_block, _from_block - 1))
+
+        self.mgmt_contract = utils.init_management_contract(_w3)
+        self.battery_mgmt_contract = utils.init_battery_management_contract(
+            _w3, utils.get_battery_managment_contract_addr(_w3))
+        self.contracts = {self.mgmt_contract.address: self.mgmt_contract,
+                          self.battery_mgmt_contract.address: self.battery_mgmt_contract}
+        self.topics = [provenance.event_topic(event) for event in
+                       (provenance.VENDOR_EVENT, provenance.NEW_BATTERY_EVENT, provenance.TRANSFER_EVENT)]
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """
+        :return: Connection of the calling thread, server threads don't share one
+        :rtype: sqlite3.Connection
+        """
+
+        db = getattr(self.local, 'db', None)
+
+        if db is None:
+            # closed by close() from another thread
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self.local.db = db
+
+            with self.connections_lock:
+                self.connections.append(db)
+
+        return db
+
+    def cursor(self) -> tuple:
+        """
+        :return: First indexed block, last indexed block and its hash
+        :rtype: tuple
+        """
+
+        return self.db.execute("SELECT start, block, hash FROM cursor WHERE id = 0").fetchone()
+
+    def _rollback(self, _block: int) -> None:
+        """
+        Remove events of the blocks after the given one and restore battery owners
+
+        :param int _block: Last kept block
+        :return: Nothing
+        :rtype: None
+        """
+
+        affected = self.db.execute("SELECT DISTINCT battery FROM transfers WHERE block > ?", (_block,)).fetchall()
+
+        self.db.execute("DELETE FROM transfers WHERE block > ?", (_block,))
+        self.db.execute("DELETE FROM batteries WHERE block > ?", (_block,))
+        self.db.execute("DELETE FROM vendors WHERE block > ?", (_block,))
+
+        # owner is the receiver of the last kept transfer or the vendor
+        self.db.executemany(
+            "UPDATE batteries SET owner = COALESCE("
+            "(SELECT receiver FROM transfers WHERE battery = batteries.id ORDER BY block DESC, log_index DESC LIMIT 1), "
+            "(SELECT owner FROM vendors WHERE vendors.id = batteries.vendor)"
+            ") WHERE id = ?",
+            affected
+        )
+
+        self.db.execute("UPDATE cursor SET block = ?, hash = NULL WHERE id = 0", (_block,))
+
+    def _apply(self, _event) -> None:
+        args = _event['args']
+        block = _event['blockNumber']
+
+        if _event['event'] == 'Vendor':
+            self.db.execute("INSERT OR REPLACE INTO vendors (id, owner, block) VALUES (?, ?, ?)",
+                            (bytes(args['tokenId']), decode_hex(args['owner']), block))
+
+        elif _event['event'] == 'NewBattery':
+            self.db.execute(
+                "INSERT OR REPLACE INTO batteries (id, vendor, owner, block) "
+                "VALUES (?, ?, (SELECT owner FROM vendors WHERE id = ?), ?)",
+                (bytes(args['batteryId']), bytes(args['tokenId']), bytes(args['tokenId']), block)
+            )
+
+        elif _event['event'] == 'Transfer':
+            battery_id = bytes(args['batteryId'])
+
+            self.db.execute("INSERT OR REPLACE INTO transfers (block, log_index, battery, sender, receiver) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (block, _event['logIndex'], battery_id, decode_hex(args['from']), decode_hex(args['to'])))
+            self.db.execute("UPDATE batteries SET owner = ? WHERE id = ?", (decode_hex(args['to']), battery_id))
+
+    def sync(self) -> int:
+        """
+        Index events of the new blocks. If the last indexed block is not
+        in the chain anymore the last REORG_DEPTH blocks are indexed again
+
+        :return: Number of indexed events
+        :rtype: int
+        """
+
+        head = self.w3.eth.blockNumber
+
+        with self.lock:
+            # other processes can't index the same blocks until commit
+            self.db.execute("BEGIN IMMEDIATE")
+
+            try:
+                start, block, block_hash = self.cursor()
+
+                if block > head or (block_hash is not None and bytes(self.w3.eth.getBlock(block).hash) != block_hash):
+                    block = max(min(block, head) - REORG_DEPTH, start - 1)
+                    self._rollback(block)
+
+                if block >= head:
+                    self.db.execute("COMMIT")
+                    return 0
+
+                logs = provenance.get_logs(self.w3, {'address': list(self.contracts.keys()), 'topics': [self.topics]},
+                                           block + 1, head)
+                logs = sorted(logs, key=lambda log: (log['blockNumber'], log['logIndex']))
+
+                for log in logs:
+                    contract = self.contracts[Web3.toChecksumAddress(log['address'])]
+
+                    for event in provenance.decode_logs(contract, [log]):
+                        self._apply(event)
+
+                self.db.execute("UPDATE cursor SET block = ?, hash = ? WHERE id = 0",
+                                (head, bytes(self.w3.eth.getBlock(head).hash)))
+                self.db.execute("COMMIT")
+            except:
+                self.db.execute("ROLLBACK")
+                raise
+
+        return len(logs)
+
+    def run(self, _poll_interval: float = POLL_INTERVAL, _verbose: bool = True) -> None:
+        """
+        Follow the chain until interrupted
+
+        :param float _poll_interval: Delay between checks for new blocks in seconds
+        :param bool _verbose: Print number of indexed events
+        :return: Nothing
+        :rtype: None
+        """
+
+        while True:
+            try:
+                indexed = self.sync()
+            except IOError:
+                # node is temporarily unreachable, retry on the next iteration
+                indexed = 0
+
+            if indexed > 0 and _verbose:
+                print(f"Indexed {indexed} events up to block {self.cursor()[1]}")
+
+            time.sleep(_poll_interval)
+
+    def follow(self, _poll_interval: float = POLL_INTERVAL) -> None:
+        """
+        Follow the chain in a background thread, so queries don't wait for indexing
+
+        :param float _poll_interval: Delay between checks for new blocks in seconds
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.connections_lock:
+            if self.follower is None:
+                self.follower = threading.Thread(target=self.run, args=(_poll_interval, False), daemon=True)
+                self.follower.start()
+
+    def behind(self) -> bool:
+        """
+        :return: True if blocks after the last indexed one exist
+        :rtype: bool
+        """
+
+        return self.cursor()[1] < self.w3.eth.blockNumber
+
+    def owner_of(self, _battery_id: str) -> Union[str, None]:
+        """
+        :param str _battery_id: Battery id
+        :return: None if battery is not indexed and owner's address if it is
+        :rtype: None/str
+        """
+
+        row = self.db.execute("SELECT owner FROM batteries WHERE id = ?", (decode_hex(_battery_id),)).fetchone()
+
+        if row is None or row[0] is None:
+            return None
+
+        return Web3.toChecksumAddress(row[0])
+
+    def battery_record(self, _battery_id: str) -> Union[tuple, None]:
+        """
+        :param str _battery_id: Battery id
+        :return: None if battery is not indexed and its vendor id with registration block if it is
+        :rtype: None/tuple
+        """
+
+        return self.db.execute("SELECT vendor, block FROM batteries WHERE id = ?", (decode_hex(_battery_id),)).fetchone()
+
+    def batteries_of(self, _owner: str) -> list:
+        """
+        :param str _owner: Owner's address
+        :return: Ids of the batteries owned by the address
+        :rtype: list
+        """
+
+        rows = self.db.execute("SELECT id FROM batteries WHERE owner = ? ORDER BY id", (decode_hex(_owner),))
+
+        return [row[0].hex() for row in rows]
+
+    def _vendor_id(self, _vendor: str) -> bytes:
+        if Web3.isAddress(_vendor):
+            row = self.db.execute("SELECT id FROM vendors WHERE owner = ?", (decode_hex(_vendor),)).fetchone()
+
+            return row[0] if row is not None else b''
+
+        return decode_hex(_vendor)
+
+    def vendor_batteries(self, _vendor: str) -> list:
+        """
+        :param str _vendor: Vendor's address or vendor id
+        :return: Ids of the batteries registered by the vendor
+        :rtype: list
+        """
+
+        rows = self.db.execute("SELECT id FROM batteries WHERE vendor = ? ORDER BY id", (self._vendor_id(_vendor),))
+
+        return [row[0].hex() for row in rows]
+
+    def vendor_battery_count(self, _vendor: str) -> int:
+        """
+        :param str _vendor: Vendor's address or vendor id
+        :return: Number of the batteries registered by the vendor
+        :rtype: int
+        """
+
+        return self.db.execute("SELECT COUNT(*) FROM batteries WHERE vendor = ?",
+                               (self._vendor_id(_vendor),)).fetchone()[0]
+
+    def close(self) -> None:
+        with self.connections_lock:
+            for db in self.connections:
+                db.close()
+
+            self.connections = []
+
+
+def get_index(_w3: Web3, _sync: bool = True) -> Union[Indexer, None]:
+    """
+    Open the index once per process and bring it up to date. New blocks
+    are not indexed in place when the index is followed in the background
+    or has no blocks to index
+
+    :param Web3 _w3: Web3 instance
+    :param bool _sync: Index new blocks before returning
+    :return: None if the index is not created and Indexer if it is
+    :rtype: None/Indexer
+    """
+
+    global _index
+
+    if _index is None:
+        if not os.path.exists(INDEX_DB_NAME):
+            return None
+
+        _index = Indexer(_w3)
+
+    if _sync and _index.follower is None and _index.behind():
+        _index.sync()
+
+    return _index
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create cli argument parser
+
+    :return: Parser
+    :rtype: argparse.ArgumentParser
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Battery events indexer'
+    )
+
+    parser.add_argument(
+        '--run', action='store_true', required=False,
+        help=f'Follow the chain and index events into {INDEX_DB_NAME}'
+    )
+
+    parser.add_argument(
+        '--from_block', type=int, default=0, required=False,
+        help='First indexed block of a new index'
+    )
+
+    parser.add_argument(
+        '--owner', type=str, required=False,
+        help='Owner of the battery <battery_id>'
+    )
+
+    parser.add_argument(
+        '--batteries', type=str, required=False,
+        help='Batteries owned by the address <address>'
+    )
+
+    parser.add_argument(
+        '--vendor', type=str, required=False,
+        help='Batteries registered by the vendor <vendor_address/vendor_id>'
+    )
+
+    return parser
+
+
+def main() -> None:
+    w3 = Web3(Web3.HTTPProvider(URL))
+
+    # configure provider to work with PoA chains
+    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    if args.run:
+        index = Indexer(w3, _from_block=args.from_block)
+
+        try:
+            index.run()
+        except KeyboardInterrupt:
+            index.close()
+
+        return
+
+    index = get_index(w3)
+
+    if index is None:
+        sys.exit(f"{bcolors.FAIL}Index is not created, run indexer.py --run{bcolors.ENDC}")
+
+    if args.owner:
+        owner = index.owner_of(args.owner)
+
+        if owner is None:
+            sys.exit(f"{bcolors.FAIL}Battery is not registered{bcolors.ENDC}")
+
+        print(owner)
+
+    elif args.batteries:
+        for battery_id in index.batteries_of(args.batteries):
+            print(battery_id)
+
+    elif args.vendor:
+        batteries = index.vendor_batteries(args.vendor)
+
+        for battery_id in batteries:
+            print(battery_id)
+
+        print(f"Total batteries: {len(batteries)}")
+
+    else:
+        sys.exit(f"{bcolors.FAIL}No parameters provided{bcolors.ENDC}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+import os
+import json
+import time
+import heapq
+import fcntl
+import threading
+from contextlib import contextmanager
+from typing import Union
+from web3 import Web3
+
+# Project modules
+import utils
+import battery_firmware
+
+
+INVENTORY_DB_NAME = 'inventory.json'
+# Heap is rebuilt when outdated entries exceed this share
+HEAP_COMPACTION_RATIO = 2
+# Snapshot is rewritten when the journal of changes is this many times longer than the inventory
+JOURNAL_COMPACTION_RATIO = 4
+JOURNAL_COMPACTION_MIN = 1000
+# Time in seconds the approved car's battery is expected to arrive
+INCOMING_TTL = 600
+# Time in seconds the selected battery is kept off the shelf for the car
+RESERVATION_TTL = 600
+# Expired entries are looked for at most once per this time in seconds
+EXPIRATION_INTERVAL = 60
+
+
+class StationInventory:
+    """
+    Verified batteries of the service center in a min-heap by charge cycles.
+    Replaced entries stay in the heap and are skipped when they reach the top.
+    Changes are appended to a journal which is merged into the snapshot
+    once it grows longer than the inventory
+    """
+
+    def __init__(self, _db_name: str = INVENTORY_DB_NAME):
+        """
+        :param str _db_name: Name of the inventory database file
+        """
+
+        self.db_name = _db_name
+        self.journal_name = f"{_db_name}.journal"
+        self.lock = threading.Lock()
+        self.journal = open(self.journal_name, 'a')
+        self.expired_at = 0
+
+        with self.lock, self._flock():
+            self._load()
+
+    @contextmanager
+    def _flock(self):
+        """
+        Hold the inventory shared with other processes of the station,
+        the car runs scenter.py when the server is not started
+        """
+
+        with open(self.db_name + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the inventory and bring it up to date
+        """
+
+        with self.lock, self._flock():
+            self._refresh()
+            yield
+
+    def _snapshot_id(self) -> Union[tuple, None]:
+        try:
+            stat = os.stat(self.db_name)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _refresh(self) -> None:
+        """
+        Read changes made by other processes since the last change of this one
+        """
+
+        size = os.fstat(self.journal.fileno()).st_size
+
+        if self.snapshot != self._snapshot_id() or size < self.journal_offset:
+            self._load()
+        elif size > self.journal_offset and not self._replay():
+            # new changes can't be appended after the interrupted one
+            self._save()
+
+    def _load(self) -> None:
+        """
+        Read the snapshot and the journal of changes written after it
+        """
+
+        data = utils.open_data_base(self.db_name) or {}
+        now = time.time()
+
+        self.snapshot = self._snapshot_id()
+        # latest verified charges of the batteries on the shelf
+        self.batteries = data.get('batteries', {})
+        # charges and expiration time of the batteries verified before they are transferred to the station
+        self.incoming = {battery_id: entry if isinstance(entry, list) else [entry, now + INCOMING_TTL]
+                         for battery_id, entry in data.get('incoming', {}).items()}
+        # charges and expiration time of the batteries taken off the shelf for the arriving cars
+        self.reserved = data.get('reserved', {})
+        self.heap = []
+        self.journal_offset = 0
+        self.journal_size = 0
+
+        complete = self._replay()
+
+        self.heap = [(charges, battery_id) for battery_id, charges in self.batteries.items()]
+        heapq.heapify(self.heap)
+
+        if not complete:
+            self._save()
+
+    def _tables(self) -> dict:
+        return {'batteries': self.batteries, 'incoming': self.incoming, 'reserved': self.reserved}
+
+    def _replay(self) -> bool:
+        """
+        Apply changes written to the journal after the read position
+
+        :return: False if the last change was interrupted and True if not
+        :rtype: bool
+        """
+
+        tables = self._tables()
+
+        with open(self.journal_name, 'rb') as journal:
+            journal.seek(self.journal_offset)
+
+            for line in journal:
+                # last change was interrupted
+                if not line.endswith(b'\n'):
+                    return False
+
+                try:
+                    table, battery_id, value = json.loads(line)
+                except ValueError:
+                    return False
+
+                if value is None:
+                    tables[table].pop(battery_id, None)
+                else:
+                    tables[table][battery_id] = value
+
+                    if table == 'batteries':
+                        heapq.heappush(self.heap, (value, battery_id))
+
+                self.journal_offset += len(line)
+                self.journal_size += 1
+
+        return True
+
+    @staticmethod
+    def _key(_battery_id: str) -> str:
+        if _battery_id[:2] == '0x':
+            _battery_id = _battery_id[2:]
+
+        return _battery_id.lower()
+
+    def _log(self, _table: str, _battery_id: str, _value) -> None:
+        """
+        Append the new value of the entry to the journal, None for the removed entry
+        """
+
+        self.journal.write(json.dumps([_table, _battery_id, _value]) + '\n')
+        self.journal.flush()
+        self.journal_offset = os.fstat(self.journal.fileno()).st_size
+        self.journal_size += 1
+
+        if self.journal_size > max(JOURNAL_COMPACTION_MIN, JOURNAL_COMPACTION_RATIO * len(self.batteries)):
+            self._save()
+
+    def _save(self) -> None:
+        """
+        Write the snapshot and start a new journal
+        """
+
+        tmp_name = f"{self.db_name}.tmp"
+
+        utils.write_data_base(self._tables(), tmp_name)
+        os.replace(tmp_name, self.db_name)
+
+        # replayed changes are the values of the snapshot, so a crash before truncation is harmless
+        self.journal.truncate(0)
+        self.snapshot = self._snapshot_id()
+        self.journal_offset = 0
+        self.journal_size = 0
+
+    def _expire(self) -> None:
+        """
+        Drop approvals of the batteries which did not arrive and put
+        the batteries reserved for the cars which did not come back on the shelf
+        """
+
+        now = time.time()
+
+        if now - self.expired_at < EXPIRATION_INTERVAL:
+            return
+
+        self.expired_at = now
+
+        for battery_id in [battery_id for battery_id, entry in self.incoming.items() if entry[1] < now]:
+            del self.incoming[battery_id]
+            self._log('incoming', battery_id, None)
+
+        for battery_id in [battery_id for battery_id, entry in self.reserved.items() if entry[1] < now]:
+            self._add(battery_id, self.reserved.pop(battery_id)[0])
+            self._log('reserved', battery_id, None)
+
+    def _add(self, _battery_id: str, _charges: int) -> None:
+        self.batteries[_battery_id] = _charges
+        self._log('batteries', _battery_id, _charges)
+        heapq.heappush(self.heap, (_charges, _battery_id))
+
+        if len(self.heap) > HEAP_COMPACTION_RATIO * len(self.batteries) + 1:
+            self.heap = [(charges, battery_id) for battery_id, charges in self.batteries.items()]
+            heapq.heapify(self.heap)
+
+    def add(self, _battery_id: str, _charges: int) -> None:
+        """
+        Put verified battery on the shelf or update its charges
+
+        :param str _battery_id: Battery id
+        :param int _charges: Verified charge cycles
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self._locked():
+            self._add(self._key(_battery_id), _charges)
+
+    def remove(self, _battery_id: str) -> bool:
+        """
+        Take battery off the shelf or out of the reserve when it is issued
+
+        :param str _battery_id: Battery id
+        :return: False if battery is not in the inventory and True if it is
+        :rtype: bool
+        """
+
+        key = self._key(_battery_id)
+
+        with self._locked():
+            for table in ('batteries', 'reserved'):
+                if self._tables()[table].pop(key, None) is not None:
+                    self._log(table, key, None)
+                    return True
+
+            return False
+
+    def release(self, _battery_id: str) -> bool:
+        """
+        Put the reserved battery back on the shelf when it was not issued
+
+        :param str _battery_id: Battery id
+        :return: False if battery is not reserved and True if it is
+        :rtype: bool
+        """
+
+        key = self._key(_battery_id)
+
+        with self._locked():
+            entry = self.reserved.pop(key, None)
+
+            if entry is None:
+                return False
+
+            self._add(key, entry[0])
+            self._log('reserved', key, None)
+
+            return True
+
+    def expect(self, _battery_id: str, _charges: int) -> None:
+        """
+        Remember charges of the verified battery which is going to arrive
+
+        :param str _battery_id: Battery id
+        :param int _charges: Verified charge cycles
+        :return: Nothing
+        :rtype: None
+        """
+
+        key = self._key(_battery_id)
+
+        with self._locked():
+            self._expire()
+            self.incoming[key] = [_charges, time.time() + INCOMING_TTL]
+            self._log('incoming', key, self.incoming[key])
+
+    def arrive(self, _battery_id: str) -> bool:
+        """
+        Put the expected battery on the shelf
+
+        :param str _battery_id: Battery id
+        :return: False if battery was not verified before and True if it was
+        :rtype: bool
+        """
+
+        key = self._key(_battery_id)
+
+        with self._locked():
+            entry = self.incoming.pop(key, None)
+
+            if entry is not None:
+                self._log('incoming', key, None)
+                self._add(key, entry[0])
+
+            return entry is not None
+
+    def charges_of(self, _battery_id: str) -> Union[int, None]:
+        """
+        :param str _battery_id: Battery id
+        :return: None if battery was not verified and its charge cycles if it was
+        :rtype: None/int
+        """
+
+        key = self._key(_battery_id)
+
+        with self._locked():
+            if key in self.batteries:
+                return self.batteries[key]
+
+            entry = self.reserved.get(key, self.incoming.get(key))
+
+            return entry[0] if entry is not None else None
+
+    def _top(self) -> Union[tuple, None]:
+        # drop entries of removed batteries and outdated charges
+        while len(self.heap) > 0:
+            charges, battery_id = self.heap[0]
+
+            if self.batteries.get(battery_id) == charges:
+                return charges, battery_id
+
+            heapq.heappop(self.heap)
+
+        return None
+
+    def best(self) -> Union[str, None]:
+        """
+        :return: None if the shelf is empty and id of the battery with the least charge cycles if not
+        :rtype: None/str
+        """
+
+        with self._locked():
+            self._expire()
+            top = self._top()
+
+            return top[1] if top is not None else None
+
+    def reserve(self) -> Union[str, None]:
+        """
+        Take the battery with the least charge cycles off the shelf for
+        the arriving car. It is put back on the shelf if it is not issued in time
+
+        :return: None if the shelf is empty and battery id if not
+        :rtype: None/str
+        """
+
+        with self._locked():
+            self._expire()
+            top = self._top()
+
+            if top is None:
+                return None
+
+            charges, battery_id = heapq.heappop(self.heap)
+            del self.batteries[battery_id]
+            self.reserved[battery_id] = [charges, time.time() + RESERVATION_TTL]
+            self._log('batteries', battery_id, None)
+            self._log('reserved', battery_id, self.reserved[battery_id])
+
+            return battery_id
+
+    def restock(self, _w3: Web3, _battery_ids: list) -> int:
+        """
+        Replace the shelf with the batteries which pass verification
+
+        :param Web3 _w3: Web3 instance
+        :param list _battery_ids: Ids of the batteries owned by the station
+        :return: Number of verified batteries
+        :rtype: int
+        """
+
+        keystore = battery_firmware.get_keystore()
+        battery_ids = []
+
+        for battery_id in map(self._key, _battery_ids):
+            # batteries without firmware on this station can't be verified
+            if keystore.resolve(battery_id) is not None or os.path.exists(utils.firmware_path(battery_id)):
+                battery_ids.append(battery_id)
+
+        results = utils.verify_batteries(_w3, battery_ids) if len(battery_ids) > 0 else {}
+
+        with self._locked():
+            self.batteries.clear()
+
+            for battery_id, result in results.items():
+                # reserved batteries are still waiting for their cars
+                if result.error is None and result.result[0] and battery_id not in self.reserved:
+                    self.batteries[battery_id] = result.result[1]
+
+            self.heap = [(charges, battery_id) for battery_id, charges in self.batteries.items()]
+            heapq.heapify(self.heap)
+            self._save()
+
+            return len(self.batteries)
+
+    def __len__(self) -> int:
+        with self._locked():
+            return len(self.batteries)
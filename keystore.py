@@ -0,0 +1,157 @@
+import os
+import re
+import glob
+import json
+import sqlite3
+import threading
+from typing import Union
+
+
+KEYSTORE_PATH = "firmware/keystore.db"
+FIRMWARE_DIR = "firmware"
+PRIVATE_KEY_RE = re.compile(r'''^private_key\s*=\s*["'](0x[0-9a-fA-F]+)["']''', re.MULTILINE)
+
+
+def _to_bytes(_hex: str) -> bytes:
+    if _hex[:2] == '0x':
+        _hex = _hex[2:]
+
+    if len(_hex) % 2 == 1:
+        _hex = '0' + _hex
+
+    return bytes.fromhex(_hex)
+
+
+class Keystore:
+    """
+    Battery keys and charge counters in a single SQLite file indexed by battery id
+    """
+
+    def __init__(self, _path: str = KEYSTORE_PATH):
+        """
+        :param str _path: Path to the keystore file
+        """
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(_path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS batteries ("
+            "id BLOB PRIMARY KEY, "
+            "private_key BLOB NOT NULL, "
+            "charges INTEGER NOT NULL DEFAULT 0"
+            ") WITHOUT ROWID"
+        )
+        self.db.commit()
+
+    def add(self, _batteries: list) -> None:
+        """
+        Add batteries to the keystore
+
+        :param list _batteries: Pairs of private key (hex) and battery address
+        :return: Nothing
+        :rtype: None
+        """
+
+        rows = [(_to_bytes(address), _to_bytes(key).rjust(32, b'\0')) for key, address in _batteries]
+
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO batteries (id, private_key) VALUES (?, ?)", rows)
+            self.db.commit()
+
+    def resolve(self, _battery_id: str) -> Union[bytes, None]:
+        """
+        Find battery by full id or by its prefix typed in the command line
+
+        :param str _battery_id: Battery id or its prefix in hex
+        :return: None if there is no such battery or the prefix is ambiguous and full battery id if not
+        :rtype: None/bytes
+        """
+
+        if _battery_id[:2] == '0x':
+            _battery_id = _battery_id[2:]
+
+        if len(_battery_id) == 40:
+            query, params = "SELECT id FROM batteries WHERE id = ?", (bytes.fromhex(_battery_id),)
+        else:
+            # odd prefix is a range of ids starting with its last nibble: abc -> [ab c0, ab d0)
+            pad = '0' * (len(_battery_id) % 2)
+            low = bytes.fromhex(_battery_id + pad)
+            high = int(_battery_id, 16) + 1
+
+            if high == 16 ** len(_battery_id):
+                query, params = "SELECT id FROM batteries WHERE id >= ? LIMIT 2", (low,)
+            else:
+                high = bytes.fromhex(f"{high:0{len(_battery_id)}x}" + pad)
+                query, params = "SELECT id FROM batteries WHERE id >= ? AND id < ? LIMIT 2", (low, high)
+
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+
+        if len(rows) != 1:
+            return None
+
+        return rows[0][0]
+
+    def get(self, _battery_id: bytes) -> Union[tuple, None]:
+        """
+        :param bytes _battery_id: Battery id
+        :return: None if battery does not exist and private key with charge cycles if it does
+        :rtype: None/tuple
+        """
+
+        with self.lock:
+            return self.db.execute("SELECT private_key, charges FROM batteries WHERE id = ?",
+                                   (_battery_id,)).fetchone()
+
+    def charge(self, _battery_id: bytes) -> None:
+        """
+        Increase battery's charge cycles
+
+        :param bytes _battery_id: Battery id
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            self.db.execute("UPDATE batteries SET charges = charges + 1 WHERE id = ?", (_battery_id,))
+            self.db.commit()
+
+    def migrate_firmware(self, _dir: str = FIRMWARE_DIR) -> int:
+        """
+        Move keys and charge counters of per-file firmware to the keystore.
+        Firmware files are kept and still work
+
+        :param str _dir: Firmware directory
+        :return: Number of migrated batteries
+        :rtype: int
+        """
+
+        from eth_keys import keys
+
+        rows = []
+
+        for path in glob.glob(os.path.join(_dir, "*.py")):
+            with open(path) as fw:
+                match = PRIVATE_KEY_RE.search(fw.read())
+
+            if match is None:
+                continue
+
+            private_key = _to_bytes(match.group(1)).rjust(32, b'\0')
+            battery_id = keys.PrivateKey(private_key).public_key.to_canonical_address()
+            charges = 0
+
+            if os.path.exists(path[:-3] + ".json"):
+                with open(path[:-3] + ".json") as db:
+                    charges = json.load(db)['Charge cycles']
+
+            rows.append((battery_id, private_key, charges))
+
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO batteries (id, private_key, charges) VALUES (?, ?, ?)", rows)
+            self.db.commit()
+
+        return len(rows)
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from typing import Callable
+from web3 import Web3
+
+
+NONCE_DB_NAME = 'nonces.json'
+# Minimal delay in seconds between checks of the node for dropped transactions
+GAP_CHECK_INTERVAL = 15
+
+# Node errors meaning the nonce is already taken by another transaction
+USED_NONCE_ERRORS = ('nonce too low', 'already known', 'replacement transaction underpriced')
+
+# Nonce managers created in the process, one per account
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def _open_nonce_db(_file_name: str) -> dict:
+    if os.path.exists(_file_name):
+        with open(_file_name) as file:
+            return json.load(file)
+
+    return {}
+
+
+class NonceManager:
+    """
+    Allocates nonces for transactions of one account locally, so several
+    transactions can be in flight at the same time
+    """
+
+    def __init__(self, _w3: Web3, _account: str, _db_name: str = NONCE_DB_NAME):
+        """
+        :param Web3 _w3: Web3 instance
+        :param str _account: Account address
+        :param str _db_name: Name of the file with high-water marks
+        """
+
+        self.w3 = _w3
+        self.account = Web3.toChecksumAddress(_account)
+        self.db_name = _db_name
+        self.lock = threading.Lock()
+        self.gaps = set()
+        # nonces reserved but not sent yet
+        self.reserved = set()
+        self.next_nonce = 0
+        self.checked = time.monotonic()
+
+        self.resync()
+
+    @contextmanager
+    def _db(self):
+        """
+        Lock the file with high-water marks against other processes
+        using the same accounts
+
+        :return: High-water marks of all accounts
+        :rtype: dict
+        """
+
+        with open(self.db_name + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                yield _open_nonce_db(self.db_name)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _save(self, _data: dict) -> None:
+        _data[self.account] = max(_data.get(self.account, 0), self.next_nonce)
+
+        with open(self.db_name + '.tmp', 'w') as out:
+            json.dump(_data, out)
+
+        os.replace(self.db_name + '.tmp', self.db_name)
+
+    def resync(self) -> None:
+        """
+        Synchronize with the node. Nonces between the pending transaction
+        count and the stored high-water mark belong to dropped transactions
+        and are reused first
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.lock, self._db() as data:
+            pending = self.w3.eth.getTransactionCount(self.account, 'pending')
+            stored = data.get(self.account, 0)
+
+            self.gaps = {n for n in self.gaps if n >= pending}
+            self.gaps.update(range(pending, stored))
+            self.next_nonce = max(self.next_nonce, pending, stored)
+            self._save(data)
+
+    def reserve(self) -> int:
+        """
+        Reserve nonce for a new transaction
+
+        :return: Nonce
+        :rtype: int
+        """
+
+        with self.lock:
+            if len(self.gaps) > 0:
+                nonce = min(self.gaps)
+                self.gaps.remove(nonce)
+            else:
+                with self._db() as data:
+                    # other processes of the account may have moved the mark
+                    nonce = max(self.next_nonce, data.get(self.account, 0))
+                    self.next_nonce = nonce + 1
+                    self._save(data)
+
+            self.reserved.add(nonce)
+
+            return nonce
+
+    def release(self, _nonce: int) -> None:
+        """
+        Return nonce of a transaction which was not sent
+
+        :param int _nonce: Nonce
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            self.reserved.discard(_nonce)
+            self.gaps.add(_nonce)
+
+    def find_gaps(self) -> set:
+        """
+        Detect a dropped transaction: the pending count of the node stops
+        at the first nonce missing from the transaction pool
+
+        :return: Nonces to reuse
+        :rtype: set
+        """
+
+        pending = self.w3.eth.getTransactionCount(self.account, 'pending')
+
+        with self.lock:
+            self.checked = time.monotonic()
+
+            # reserved nonces are not in the pool only because they are being sent
+            if pending < self.next_nonce and pending not in self.reserved:
+                self.gaps.add(pending)
+
+            return set(self.gaps)
+
+    def send(self, _send: Callable[[int], bytes]) -> bytes:
+        """
+        Send transaction with a reserved nonce. If the nonce turns out
+        to be taken, the next one is used. Long-running processes check
+        the node for dropped transactions every GAP_CHECK_INTERVAL seconds,
+        so later transactions do not get stuck behind a missing nonce
+
+        :param callable _send: Function sending transaction with the given nonce
+        :return: Transaction hash
+        :rtype: bytes
+        """
+
+        if time.monotonic() - self.checked > GAP_CHECK_INTERVAL:
+            self.find_gaps()
+
+        while True:
+            nonce = self.reserve()
+
+            try:
+                tx_hash = _send(nonce)
+            except ValueError as error:
+                if any(msg in str(error) for msg in USED_NONCE_ERRORS):
+                    with self.lock:
+                        self.reserved.discard(nonce)
+                    continue
+
+                self.release(nonce)
+                self.find_gaps()
+                raise
+            except Exception:
+                self.release(nonce)
+                raise
+
+            with self.lock:
+                self.reserved.discard(nonce)
+
+            return tx_hash
+
+
+def get_nonce_manager(_w3: Web3, _account: str) -> NonceManager:
+    """
+    Get nonce manager of the account shared within the process
+
+    :param Web3 _w3: Web3 instance
+    :param str _account: Account address
+    :return: Nonce manager
+    :rtype: NonceManager
+    """
+
+    account = Web3.toChecksumAddress(_account)
+
+    with _managers_lock:
+        if account not in _managers:
+            _managers[account] = NonceManager(_w3, account)
+
+        return _managers[account]
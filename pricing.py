@@ -0,0 +1,209 @@
+import sys
+import csv
+import argparse
+import numpy as np
+
+# Project modules
+import utils
+from TextColor.color import bcolors
+
+
+TARIFF_DB_NAME = 'tariff.json'
+# Prices in eth
+DEFAULT_TARIFF = {
+    'base': 0.005,
+    # for every charge cycle the car's battery has more than the new one
+    'per_charge': 0.00001,
+    # for every day the new battery is younger than the car's one
+    'per_day': 0.000002,
+    'min': 0.001,
+    'max': 0.05,
+    # price multipliers of the new battery's vendor by vendor id
+    'vendors': {},
+}
+SECONDS_PER_DAY = 86400
+FLEET_COLUMNS = ['car_battery_charges', 'sc_battery_charges', 'sc_battery_vendor',
+                 'car_battery_registered', 'sc_battery_registered']
+
+
+def load_tariff(_db_name: str = TARIFF_DB_NAME) -> dict:
+    """
+    Load tariff table, missing values are taken from the default tariff
+
+    :param str _db_name: Name of the tariff database file
+    :return: Tariff
+    :rtype: dict
+    """
+
+    tariff = dict(DEFAULT_TARIFF)
+    tariff.update(utils.open_data_base(_db_name) or {})
+    tariff['vendors'] = {vendor_id.lower().replace('0x', ''): factor for vendor_id, factor in tariff['vendors'].items()}
+
+    return tariff
+
+
+def vendor_factors(_tariff: dict, _vendors) -> np.ndarray:
+    """
+    Look up price multipliers of the vendors, each distinct vendor once
+
+    :param dict _tariff: Tariff
+    :param array _vendors: Vendor ids in hex, empty for unknown vendors
+    :return: Multipliers
+    :rtype: np.ndarray
+    """
+
+    vendors = np.char.lower(np.char.replace(np.asarray(_vendors, dtype=str), '0x', ''))
+    unique, inverse = np.unique(vendors, return_inverse=True)
+    factors = np.array([_tariff['vendors'].get(vendor_id, 1.0) for vendor_id in unique], dtype=np.float64)
+
+    return factors[inverse.reshape(-1)]
+
+
+def quote(_tariff: dict, _car_charges, _sc_charges, _sc_vendors, _car_registered, _sc_registered) -> np.ndarray:
+    """
+    Calculate costs of replacements in one vectorized pass
+
+    :param dict _tariff: Tariff
+    :param array _car_charges: Charge cycles of the cars' batteries
+    :param array _sc_charges: Charge cycles of the service center's batteries
+    :param array _sc_vendors: Vendor ids of the service center's batteries
+    :param array _car_registered: Registration timestamps of the cars' batteries, NaN if unknown
+    :param array _sc_registered: Registration timestamps of the service center's batteries, NaN if unknown
+    :return: Costs in eth
+    :rtype: np.ndarray
+    """
+
+    car_charges = np.asarray(_car_charges, dtype=np.float64)
+
+    # string operations on vendor ids fail on an empty fleet
+    if car_charges.size == 0:
+        return np.empty(0)
+
+    sc_charges = np.asarray(_sc_charges, dtype=np.float64)
+    car_registered = np.asarray(_car_registered, dtype=np.float64)
+    sc_registered = np.asarray(_sc_registered, dtype=np.float64)
+
+    cycles = np.clip(car_charges - sc_charges, 0, None)
+    # unknown age does not change the price
+    days = np.clip(np.nan_to_num((sc_registered - car_registered) / SECONDS_PER_DAY), 0, None)
+
+    cost = _tariff['base'] + _tariff['per_charge'] * cycles + _tariff['per_day'] * days
+    cost *= vendor_factors(_tariff, _sc_vendors)
+
+    return np.clip(cost, _tariff['min'], _tariff['max'])
+
+
+def quote_one(_tariff: dict, _car_charges: int, _sc_charges: int, _sc_vendor: str = '',
+              _car_registered: float = None, _sc_registered: float = None) -> float:
+    """
+    Calculate cost of one replacement
+
+    :param dict _tariff: Tariff
+    :param int _car_charges: Charge cycles of the car's battery
+    :param int _sc_charges: Charge cycles of the service center's battery
+    :param str _sc_vendor: Vendor id of the service center's battery
+    :param float _car_registered: Registration timestamp of the car's battery
+    :param float _sc_registered: Registration timestamp of the service center's battery
+    :return: Cost in eth
+    :rtype: float
+    """
+
+    registered = [np.nan if value is None else value for value in (_car_registered, _sc_registered)]
+
+    return float(quote(_tariff, [_car_charges], [_sc_charges], [_sc_vendor or ''], [registered[0]], [registered[1]])[0])
+
+
+def read_fleet(_path: str) -> dict:
+    """
+    Read fleet CSV file with FLEET_COLUMNS header, empty timestamps are unknown
+
+    :param str _path: Path to the file
+    :return: Pairs of column names and arrays
+    :rtype: dict
+    """
+
+    with open(_path, newline='') as file:
+        rows = list(csv.DictReader(file))
+
+    if len(rows) > 0 and not set(FLEET_COLUMNS).issubset(rows[0].keys()):
+        sys.exit(f"{bcolors.FAIL}Fleet file must have columns: {', '.join(FLEET_COLUMNS)}{bcolors.ENDC}")
+
+    columns = {column: [row[column] or '' for row in rows] for column in FLEET_COLUMNS}
+
+    for column in ('car_battery_registered', 'sc_battery_registered'):
+        columns[column] = [value if value != '' else 'nan' for value in columns[column]]
+
+    return {
+        'car_battery_charges': np.array(columns['car_battery_charges'], dtype=np.float64),
+        'sc_battery_charges': np.array(columns['sc_battery_charges'], dtype=np.float64),
+        'sc_battery_vendor': np.array(columns['sc_battery_vendor'], dtype=str),
+        'car_battery_registered': np.array(columns['car_battery_registered'], dtype=np.float64),
+        'sc_battery_registered': np.array(columns['sc_battery_registered'], dtype=np.float64),
+    }
+
+
+def quote_fleet(_path: str, _tariff: dict) -> np.ndarray:
+    """
+    :param str _path: Path to the fleet CSV file
+    :param dict _tariff: Tariff
+    :return: Costs in eth in the order of the file rows
+    :rtype: np.ndarray
+    """
+
+    fleet = read_fleet(_path)
+
+    return quote(_tariff, fleet['car_battery_charges'], fleet['sc_battery_charges'], fleet['sc_battery_vendor'],
+                 fleet['car_battery_registered'], fleet['sc_battery_registered'])
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create cli argument parser
+
+    :return: Parser
+    :rtype: argparse.ArgumentParser
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Battery replacement quotes'
+    )
+
+    parser.add_argument(
+        '--fleet', type=str, required=False,
+        help=f'Quote replacements for the fleet CSV file with columns {", ".join(FLEET_COLUMNS)}'
+    )
+
+    parser.add_argument(
+        '--tariff', type=str, default=TARIFF_DB_NAME, required=False,
+        help=f'Tariff file, {TARIFF_DB_NAME} by default'
+    )
+
+    parser.add_argument(
+        '--out', type=str, required=False,
+        help='Write quotes to the CSV file instead of stdout'
+    )
+
+    return parser
+
+
+def main() -> None:
+    parser = create_parser()
+    args = parser.parse_args()
+
+    if not args.fleet:
+        sys.exit(f"{bcolors.FAIL}No parameters provided{bcolors.ENDC}")
+
+    costs = quote_fleet(args.fleet, load_tariff(args.tariff))
+
+    if args.out:
+        np.savetxt(args.out, costs, fmt='%.8f', header='cost', comments='')
+    else:
+        for cost in costs:
+            print(f"{cost:.8f}")
+
+    print(f"Vehicles: {len(costs)}")
+    print(f"Total cost: {bcolors.HEADER}{costs.sum():.8f}{bcolors.ENDC} eth")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import sys
+import argparse
+from web3 import Web3
+from web3.middleware import geth_poa_middleware
+from eth_utils import decode_hex
+
+# Project modules
+import utils
+from TextColor.color import bcolors
+
+
+URL = "http://127.0.0.1:8545"
+
+TRANSFER_EVENT = "Transfer(address,address,bytes20)"
+NEW_BATTERY_EVENT = "NewBattery(bytes4,bytes20)"
+VENDOR_EVENT = "Vendor(address,bytes4)"
+# Block range of the first request, None to request the whole range at once
+LOG_SCAN_RANGE = None
+# Ranges are not split below this size
+LOG_SCAN_MIN_RANGE = 1
+
+
+def event_topic(_event: str) -> str:
+    """
+    :param str _event: Event signature
+    :return: Topic of the event
+    :rtype: str
+    """
+
+    return Web3.keccak(text=_event).hex()
+
+
+def address_topic(_address: str) -> str:
+    """
+    :param str _address: Address
+    :return: Topic of the indexed address parameter
+    :rtype: str
+    """
+
+    return '0x' + decode_hex(_address).rjust(32, b'\0').hex()
+
+
+def bytes_topic(_value: str) -> str:
+    """
+    :param str _value: Fixed size bytes (battery id or vendor id) in hex
+    :return: Topic of the indexed bytes parameter
+    :rtype: str
+    """
+
+    return '0x' + decode_hex(_value).ljust(32, b'\0').hex()
+
+
+def get_logs(_w3: Web3, _filter: dict, _from_block: int = 0, _to_block: int = None,
+             _range: int = LOG_SCAN_RANGE) -> list:
+    """
+    Get logs matching the filter scanning the blocks in chunks. A chunk is split
+    in halves if the node refuses to return it (too many results or timeout)
+    and the chunk size grows back after successful requests
+
+    :param Web3 _w3: Web3 instance
+    :param dict _filter: Filter parameters without block range
+    :param int _from_block: First block
+    :param int _to_block: Last block, the latest block if not specified
+    :param int _range: Blocks in the first request, the whole range if not specified
+    :return: Logs
+    :rtype: list
+    """
+
+    if _to_block is None:
+        _to_block = _w3.eth.blockNumber
+
+    size = _to_block - _from_block + 1
+
+    if _range is not None:
+        size = min(size, _range)
+
+    logs = []
+    start = _from_block
+
+    while start <= _to_block:
+        end = min(start + size - 1, _to_block)
+
+        try:
+            logs.extend(_w3.eth.getLogs(dict(_filter, fromBlock=start, toBlock=end)))
+        except (ValueError, IOError):
+            if size <= LOG_SCAN_MIN_RANGE:
+                raise
+
+            size = max(size // 2, LOG_SCAN_MIN_RANGE)
+            continue
+
+        start = end + 1
+        size *= 2
+
+    return logs
+
+
+def decode_logs(_contract, _logs: list) -> list:
+    """
+    Decode logs of the contract's events
+
+    :param Contract _contract: Contract emitted the logs
+    :param list _logs: Raw logs
+    :return: Decoded events
+    :rtype: list
+    """
+
+    events = {event_topic(event): event.split('(')[0] for event in (TRANSFER_EVENT, NEW_BATTERY_EVENT, VENDOR_EVENT)}
+    result = []
+
+    for log in _logs:
+        name = events.get(Web3.toHex(log['topics'][0]))
+
+        if name is not None:
+            result.append(getattr(_contract.events, name)().processLog(log))
+
+    return result
+
+
+def _sorted(_events: list) -> list:
+    # the same log may match several filters, e.g. transfer to itself
+    unique = {(event['blockNumber'], event['logIndex']): event for event in _events}
+
+    return [unique[key] for key in sorted(unique)]
+
+
+def battery_history(_w3: Web3, _battery_id: str, _from_block: int = 0) -> list:
+    """
+    Registration and all ownership changes of the battery
+
+    :param Web3 _w3: Web3 instance
+    :param str _battery_id: Battery id
+    :param int _from_block: First block to scan
+    :return: NewBattery and Transfer events in chain order
+    :rtype: list
+    """
+
+    mgmt_contract = utils.init_management_contract(_w3)
+    battery_mgmt_contract = utils.init_battery_management_contract(_w3, utils.get_battery_managment_contract_addr(_w3))
+    to_block = _w3.eth.blockNumber
+
+    registration = get_logs(_w3, {'address': mgmt_contract.address,
+                                  'topics': [event_topic(NEW_BATTERY_EVENT), None, bytes_topic(_battery_id)]},
+                            _from_block, to_block)
+    transfers = get_logs(_w3, {'address': battery_mgmt_contract.address,
+                               'topics': [event_topic(TRANSFER_EVENT), None, None, bytes_topic(_battery_id)]},
+                         _from_block, to_block)
+
+    return _sorted(decode_logs(mgmt_contract, registration) + decode_logs(battery_mgmt_contract, transfers))
+
+
+def vendor_batteries(_w3: Web3, _vendor: str, _from_block: int = 0) -> list:
+    """
+    Batteries registered by the vendor
+
+    :param Web3 _w3: Web3 instance
+    :param str _vendor: Vendor's address or vendor id
+    :param int _from_block: First block to scan
+    :return: NewBattery events in chain order
+    :rtype: list
+    """
+
+    mgmt_contract = utils.init_management_contract(_w3)
+
+    if Web3.isAddress(_vendor):
+        vendor_id = utils.get_call_cache(_w3).call(mgmt_contract.functions.vendorId(Web3.toChecksumAddress(_vendor)))
+        _vendor = Web3.toHex(vendor_id)
+
+    logs = get_logs(_w3, {'address': mgmt_contract.address,
+                          'topics': [event_topic(NEW_BATTERY_EVENT), bytes_topic(_vendor)]},
+                    _from_block)
+
+    return _sorted(decode_logs(mgmt_contract, logs))
+
+
+def owner_transfers(_w3: Web3, _owner: str, _from_block: int = 0) -> list:
+    """
+    Batteries received and sent by the owner
+
+    :param Web3 _w3: Web3 instance
+    :param str _owner: Owner's address
+    :param int _from_block: First block to scan
+    :return: Transfer events in chain order
+    :rtype: list
+    """
+
+    battery_mgmt_contract = utils.init_battery_management_contract(_w3, utils.get_battery_managment_contract_addr(_w3))
+    to_block = _w3.eth.blockNumber
+    topic = address_topic(_owner)
+
+    sent = get_logs(_w3, {'address': battery_mgmt_contract.address,
+                          'topics': [event_topic(TRANSFER_EVENT), topic]},
+                    _from_block, to_block)
+    received = get_logs(_w3, {'address': battery_mgmt_contract.address,
+                              'topics': [event_topic(TRANSFER_EVENT), None, topic]},
+                        _from_block, to_block)
+
+    return _sorted(decode_logs(battery_mgmt_contract, sent + received))
+
+
+def format_event(_event) -> str:
+    """
+    :param AttributeDict _event: Decoded event
+    :return: Event description
+    :rtype: str
+    """
+
+    args = _event['args']
+
+    if _event['event'] == 'NewBattery':
+        details = f"battery {args['batteryId'].hex()} registered by vendor {args['tokenId'].hex()}"
+    elif _event['event'] == 'Transfer':
+        details = f"battery {args['batteryId'].hex()} {args['from']} -> {args['to']}"
+    else:
+        details = f"vendor {args['tokenId'].hex()} registered by {args['owner']}"
+
+    return f"{_event['blockNumber']:>10} {_event['event']:<10} {details}"
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create cli argument parser
+
+    :return: Parser
+    :rtype: argparse.ArgumentParser
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Battery provenance queries'
+    )
+
+    parser.add_argument(
+        '--battery', type=str, required=False,
+        help='Registration and ownership history of the battery <battery_id>'
+    )
+
+    parser.add_argument(
+        '--vendor', type=str, required=False,
+        help='Batteries registered by the vendor <vendor_address/vendor_id>'
+    )
+
+    parser.add_argument(
+        '--owner', type=str, required=False,
+        help='Batteries received and sent by the owner <address>'
+    )
+
+    parser.add_argument(
+        '--from_block', type=int, default=0, required=False,
+        help='First block to scan'
+    )
+
+    return parser
+
+
+def main() -> None:
+    w3 = Web3(Web3.HTTPProvider(URL))
+
+    # configure provider to work with PoA chains
+    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+
+    parser = create_parser()
+    args = parser.parse_args()
+
+    if args.battery:
+        events = battery_history(w3, args.battery, args.from_block)
+
+    elif args.vendor:
+        events = vendor_batteries(w3, args.vendor, args.from_block)
+
+    elif args.owner:
+        events = owner_transfers(w3, args.owner, args.from_block)
+
+    else:
+        sys.exit(f"{bcolors.FAIL}No parameters provided{bcolors.ENDC}")
+
+    for event in events:
+        print(format_event(event))
+
+    print(f"Total events: {len(events)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from eth_keys import keys
+from eth_utils import keccak
+
+# Project modules
+from hdkeys import derive_keys_range
+
+
+KEYS_BATCH_SIZE = 1000
+
+
+def derive_keys(_count: int) -> list:
+    """
+    Generate battery keys and derive their addresses
+
+    :param int _count: Number of keys
+    :return: Pairs of private key (hex) and battery address
+    :rtype: list
+    """
+
+    result = []
+
+    for _ in range(_count):
+        priv_key = keccak(os.urandom(20))
+        address = keys.PrivateKey(priv_key).public_key.to_checksum_address()
+        result.append((hex(int.from_bytes(priv_key, byteorder='big')), address))
+
+    return result
+
+
+class Provisioner:
+    """
+    Bulk battery provisioning: keys are derived across a process pool
+    and added to the keystore in batches
+    """
+
+    def __init__(self, _keystore, _workers: int = None, _batch_size: int = KEYS_BATCH_SIZE):
+        """
+        :param Keystore _keystore: Keystore for batteries
+        :param int _workers: Maximal number of worker processes, number of cores if not specified
+        :param int _batch_size: Number of keys derived by a worker at once
+        """
+
+        self.workers = _workers or os.cpu_count()
+        self.batch_size = _batch_size
+        self.keystore = _keystore
+        self.pool = None
+        self.batches = deque()
+        self.started = time.monotonic()
+        self.keys_derived = 0
+        self.firmware_written = 0
+
+    def _executor(self, _tasks: int) -> ProcessPoolExecutor:
+        # processes are started only for the work actually requested
+        if self.pool is None:
+            self.pool_size = max(1, min(self.workers, _tasks))
+            self.pool = ProcessPoolExecutor(self.pool_size)
+
+        return self.pool
+
+    def iter_keys(self, _count: int):
+        """
+        Derive keys in the background and yield them as they are ready.
+        No more than two batches per worker are derived ahead
+
+        :param int _count: Number of keys
+        :return: Pairs of private key (hex) and battery address
+        :rtype: generator
+        """
+
+        sizes = deque(min(self.batch_size, _count - start) for start in range(0, _count, self.batch_size))
+        pool = self._executor(len(sizes))
+
+        def prefetch() -> None:
+            while len(sizes) > 0 and len(self.batches) < 2 * self.pool_size:
+                self.batches.append(pool.submit(derive_keys, sizes.popleft()))
+
+        prefetch()
+
+        while len(self.batches) > 0:
+            batch = self.batches.popleft().result()
+            prefetch()
+            self.keys_derived += len(batch)
+
+            yield from batch
+
+    def derive_range(self, _seed: str, _start: int, _count: int) -> list:
+        """
+        Derive keys of the batteries from vendor master seed, sharding
+        the serial index range across the process pool
+
+        :param str _seed: Vendor master seed in hex
+        :param int _start: First serial index
+        :param int _count: Number of keys
+        :return: Pairs of private key (hex) and battery address
+        :rtype: list
+        """
+
+        shards = max(1, min(self.workers, -(-_count // self.batch_size)))
+        shard = max(1, -(-_count // shards))
+        pool = self._executor(shards)
+        shards = [pool.submit(derive_keys_range, _seed, start, min(shard, _start + _count - start))
+                  for start in range(_start, _start + _count, shard)]
+
+        result = []
+
+        for future in shards:
+            result.extend(future.result())
+
+        self.keys_derived += len(result)
+
+        return result
+
+    def write_firmware(self, _batteries: list) -> None:
+        """
+        Add batteries to the keystore in one transaction
+
+        :param list _batteries: Pairs of private key (hex) and battery address
+        :return: Nothing
+        :rtype: None
+        """
+
+        self.keystore.add(_batteries)
+        self.firmware_written += len(_batteries)
+
+    def throughput(self) -> str:
+        """
+        :return: Report of keys and firmware produced per second
+        :rtype: str
+        """
+
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+
+        return (f"{self.keys_derived} keys ({self.keys_derived / elapsed:.0f}/s), "
+                f"{self.firmware_written} firmware ({self.firmware_written / elapsed:.0f}/s)")
+
+    def close(self) -> None:
+        for batch in self.batches:
+            batch.cancel()
+
+        self.batches.clear()
+
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
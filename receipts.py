@@ -0,0 +1,174 @@
+import time
+import threading
+from concurrent.futures import Future
+from web3 import Web3
+from web3.exceptions import TimeExhausted, TransactionNotFound
+from hexbytes import HexBytes
+
+
+class ReceiptTracker:
+    """
+    Waits for transaction receipts by following new blocks: receipts are
+    requested only for the tracked transactions included in a new block
+    """
+
+    def __init__(self, _w3: Web3, _poll_interval: float = 0.1):
+        """
+        :param Web3 _w3: Web3 instance
+        :param float _poll_interval: Delay between checks for a new block in seconds
+        """
+
+        self.w3 = _w3
+        self.poll_interval = _poll_interval
+        self.pending = {}
+        self.unchecked = set()
+        self.lock = threading.Lock()
+        self.block_filter = None
+        self.last_block = None
+
+    def track(self, _tx_hash) -> Future:
+        """
+        Start tracking of the transaction
+
+        :param _tx_hash: Transaction hash
+        :return: Future resolved with the transaction receipt
+        :rtype: concurrent.futures.Future
+        """
+
+        tx_hash = bytes(HexBytes(_tx_hash))
+
+        with self.lock:
+            if tx_hash not in self.pending:
+                self.pending[tx_hash] = Future()
+                # transaction could be included before the tracking started
+                self.unchecked.add(tx_hash)
+
+            return self.pending[tx_hash]
+
+    def _resolve(self, _tx_hash: bytes) -> None:
+        try:
+            receipt = self.w3.eth.getTransactionReceipt(_tx_hash)
+        except TransactionNotFound:
+            # not mined yet, the receipt is requested again when the transaction appears in a new block
+            return
+
+        if receipt is not None:
+            with self.lock:
+                future = self.pending.pop(_tx_hash, None)
+
+            if future is not None:
+                future.set_result(receipt)
+
+    def _new_blocks(self) -> list:
+        """
+        Get blocks appeared since the previous check. New block filter
+        is used if the node supports it, block number polling if not
+
+        :return: Block hashes or numbers
+        :rtype: list
+        """
+
+        if self.block_filter is None and self.last_block is None:
+            try:
+                self.block_filter = self.w3.eth.filter('latest')
+            except ValueError:
+                self.last_block = self.w3.eth.blockNumber
+
+        if self.block_filter is not None:
+            return self.block_filter.get_new_entries()
+
+        block_number = self.w3.eth.blockNumber
+        blocks = list(range(self.last_block + 1, block_number + 1))
+        self.last_block = block_number
+
+        return blocks
+
+    def poll(self) -> None:
+        """
+        Check new blocks once and resolve receipts of included transactions
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        blocks = self._new_blocks()
+
+        with self.lock:
+            unchecked = self.unchecked
+            self.unchecked = set()
+
+        try:
+            for tx_hash in unchecked:
+                self._resolve(tx_hash)
+
+            for block_id in blocks:
+                block = self.w3.eth.getBlock(block_id)
+
+                for tx_hash in block['transactions']:
+                    if bytes(tx_hash) in self.pending:
+                        self._resolve(bytes(tx_hash))
+        except Exception:
+            # new blocks are not returned again, so receipts are requested directly on the next check
+            with self.lock:
+                self.unchecked.update(self.pending)
+
+            raise
+
+    def expire(self, _tx_hashes: list = None, _error: Exception = None) -> None:
+        """
+        Fail pending transactions with the timeout error
+
+        :param list _tx_hashes: Transactions to fail, all pending if not specified
+        :param Exception _error: Error to fail them with instead of the timeout
+        :return: Nothing
+        :rtype: None
+        """
+
+        with self.lock:
+            if _tx_hashes is None:
+                pending = self.pending
+                self.pending = {}
+            else:
+                hashes = [bytes(HexBytes(tx_hash)) for tx_hash in _tx_hashes]
+                pending = {h: self.pending.pop(h) for h in hashes if h in self.pending}
+
+        for tx_hash, future in pending.items():
+            future.set_exception(_error or TimeExhausted(f"Transaction {HexBytes(tx_hash).hex()} is not in the chain"))
+
+    def close(self) -> None:
+        """
+        Remove the block filter from the node
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        if self.block_filter is not None:
+            self.w3.eth.uninstallFilter(self.block_filter.filter_id)
+            self.block_filter = None
+
+    def wait(self, _tmout: float = 120) -> None:
+        """
+        Wait until all tracked transactions are included to blocks
+
+        :param float _tmout: Shared deadline for all transactions in seconds
+        :return: Nothing
+        :rtype: None
+        """
+
+        deadline = time.monotonic() + _tmout
+
+        try:
+            while len(self.pending) > 0:
+                self.poll()
+
+                if len(self.pending) == 0:
+                    break
+
+                if time.monotonic() > deadline:
+                    self.expire()
+                    break
+
+                time.sleep(self.poll_interval)
+        finally:
+            self.close()
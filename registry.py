@@ -0,0 +1,362 @@
+import os
+import mmap
+import struct
+from typing import Union
+from web3 import Web3
+from eth_utils import decode_hex
+
+# Project modules
+import utils
+import provenance
+
+
+REGISTRY_SNAPSHOT_NAME = 'registry.bin'
+REGISTRY_MAGIC = b'BREG'
+REGISTRY_VERSION = 1
+# magic, version, count, capacity, table size, owners, vendors, last block
+HEADER = struct.Struct('<4sIIIIIIq')
+VENDOR_ENTRY = struct.Struct('<4sI')
+ID_SIZE = 20
+VENDOR_ID_SIZE = 4
+INDEX_SIZE = 4
+# Only events of the blocks with this number of confirmations are applied
+CONFIRMATIONS = 12
+EMPTY = -1
+
+
+def _id(_value: Union[str, bytes]) -> bytes:
+    if isinstance(_value, str):
+        return decode_hex(_value)
+
+    return bytes(_value)
+
+
+class BatteryRegistry:
+    """
+    Battery ids, vendor ids and owners in packed arrays with an open addressing
+    hash index. Owners are stored once in a table and referenced by index.
+    A snapshot is mapped into memory without parsing and the arrays are copied
+    only when the registry outgrows the snapshot
+    """
+
+    def __init__(self, _capacity: int = 1024):
+        """
+        :param int _capacity: Number of batteries stored without reallocation
+        """
+
+        self.count = 0
+        self.block = -1
+        self.owners = [bytes(ID_SIZE)]
+        self.owner_index = {self.owners[0]: 0}
+        self.vendor_owners = {}
+        self.mmap = None
+        self._allocate(max(_capacity, 1))
+
+    @staticmethod
+    def _table_size(_capacity: int) -> int:
+        # load factor of the index is kept below 1/2
+        size = 1
+
+        while size < 2 * _capacity:
+            size *= 2
+
+        return size
+
+    def _layout(self, _buffer, _offset: int = HEADER.size) -> None:
+        """
+        Create array views over the buffer
+
+        :param _buffer: bytearray or mmap
+        :param int _offset: Offset of the first array
+        :return: Nothing
+        :rtype: None
+        """
+
+        view = memoryview(_buffer)
+        sizes = [ID_SIZE * self.capacity, VENDOR_ID_SIZE * self.capacity, INDEX_SIZE * self.capacity,
+                 INDEX_SIZE * self.table_size]
+        sections = []
+
+        for size in sizes:
+            sections.append(view[_offset:_offset + size])
+            _offset += size
+
+        self.buffer = _buffer
+        self.ids, self.vendors, self.owner_bytes, self.table_bytes = sections
+        self.owner_refs = self.owner_bytes.cast('I')
+        self.table = self.table_bytes.cast('i')
+        # views are released before the buffer is unmapped
+        self.views = [view] + sections + [self.owner_refs, self.table]
+
+    def _allocate(self, _capacity: int) -> None:
+        self.capacity = _capacity
+        self.table_size = self._table_size(_capacity)
+
+        # empty slots of the index are -1
+        buffer = bytearray((ID_SIZE + VENDOR_ID_SIZE + INDEX_SIZE) * _capacity) + b'\xff' * INDEX_SIZE * self.table_size
+        self._layout(buffer, 0)
+
+    def _grow(self) -> None:
+        count = self.count
+        ids = bytes(self.ids[:ID_SIZE * count])
+        vendors = bytes(self.vendors[:VENDOR_ID_SIZE * count])
+        owner_refs = bytes(self.owner_bytes[:INDEX_SIZE * count])
+
+        self.release()
+        self._allocate(2 * self.capacity)
+
+        self.ids[:len(ids)] = ids
+        self.vendors[:len(vendors)] = vendors
+        self.owner_bytes[:len(owner_refs)] = owner_refs
+
+        for row in range(count):
+            self.table[self._slot(ids[ID_SIZE * row:ID_SIZE * (row + 1)])] = row
+
+    def _slot(self, _battery_id: bytes) -> int:
+        """
+        Find slot of the battery id or the empty slot where it has to be
+
+        :param bytes _battery_id: Battery id
+        :return: Slot index
+        :rtype: int
+        """
+
+        mask = self.table_size - 1
+        slot = int.from_bytes(_battery_id[:8], 'little') & mask
+
+        while True:
+            row = self.table[slot]
+
+            if row == EMPTY or self.ids[ID_SIZE * row:ID_SIZE * (row + 1)] == _battery_id:
+                return slot
+
+            slot = (slot + 1) & mask
+
+    def _row(self, _battery_id: bytes) -> int:
+        return self.table[self._slot(_battery_id)]
+
+    def _owner_ref(self, _owner: bytes) -> int:
+        ref = self.owner_index.get(_owner)
+
+        if ref is None:
+            ref = len(self.owners)
+            self.owners.append(_owner)
+            self.owner_index[_owner] = ref
+
+        return ref
+
+    def add(self, _battery_id: Union[str, bytes], _vendor_id: Union[str, bytes], _owner: Union[str, bytes] = None) -> None:
+        """
+        Add battery or update its vendor and owner
+
+        :param str/bytes _battery_id: Battery id
+        :param str/bytes _vendor_id: Vendor id
+        :param str/bytes _owner: Owner's address, vendor's address if not specified
+        :return: Nothing
+        :rtype: None
+        """
+
+        battery_id, vendor_id = _id(_battery_id), _id(_vendor_id)
+        owner = _id(_owner) if _owner is not None else self.vendor_owners.get(vendor_id, self.owners[0])
+
+        if self.count == self.capacity:
+            self._grow()
+
+        slot = self._slot(battery_id)
+        row = self.table[slot]
+
+        if row == EMPTY:
+            row = self.count
+            self.count += 1
+            self.table[slot] = row
+            self.ids[ID_SIZE * row:ID_SIZE * (row + 1)] = battery_id
+
+        self.vendors[VENDOR_ID_SIZE * row:VENDOR_ID_SIZE * (row + 1)] = vendor_id
+        self.owner_refs[row] = self._owner_ref(owner)
+
+    def set_owner(self, _battery_id: Union[str, bytes], _owner: Union[str, bytes]) -> bool:
+        """
+        :param str/bytes _battery_id: Battery id
+        :param str/bytes _owner: New owner's address
+        :return: False if battery is not registered and True if it is
+        :rtype: bool
+        """
+
+        row = self._row(_id(_battery_id))
+
+        if row == EMPTY:
+            return False
+
+        self.owner_refs[row] = self._owner_ref(_id(_owner))
+
+        return True
+
+    def owner_of(self, _battery_id: Union[str, bytes]) -> Union[str, None]:
+        """
+        :param str/bytes _battery_id: Battery id
+        :return: None if battery is not registered or its owner is unknown and owner's address if not
+        :rtype: None/str
+        """
+
+        row = self._row(_id(_battery_id))
+
+        if row == EMPTY or self.owner_refs[row] == 0:
+            return None
+
+        return Web3.toChecksumAddress(self.owners[self.owner_refs[row]])
+
+    def vendor_of(self, _battery_id: Union[str, bytes]) -> Union[bytes, None]:
+        """
+        :param str/bytes _battery_id: Battery id
+        :return: None if battery is not registered and vendor id if it is
+        :rtype: None/bytes
+        """
+
+        row = self._row(_id(_battery_id))
+
+        if row == EMPTY:
+            return None
+
+        return bytes(self.vendors[VENDOR_ID_SIZE * row:VENDOR_ID_SIZE * (row + 1)])
+
+    def __contains__(self, _battery_id) -> bool:
+        return self._row(_id(_battery_id)) != EMPTY
+
+    def __len__(self) -> int:
+        return self.count
+
+    def apply(self, _event) -> None:
+        """
+        Apply decoded Vendor, NewBattery or Transfer event
+
+        :param AttributeDict _event: Decoded event
+        :return: Nothing
+        :rtype: None
+        """
+
+        args = _event['args']
+
+        if _event['event'] == 'Vendor':
+            self.vendor_owners[bytes(args['tokenId'])] = decode_hex(args['owner'])
+        elif _event['event'] == 'NewBattery':
+            self.add(args['batteryId'], args['tokenId'])
+        elif _event['event'] == 'Transfer':
+            self.set_owner(args['batteryId'], args['to'])
+
+        self.block = max(self.block, _event['blockNumber'])
+
+    def update(self, _w3: Web3) -> int:
+        """
+        Apply events of the confirmed blocks after the last applied one
+
+        :param Web3 _w3: Web3 instance
+        :return: Number of applied events
+        :rtype: int
+        """
+
+        to_block = _w3.eth.blockNumber - CONFIRMATIONS
+
+        if to_block <= self.block:
+            return 0
+
+        mgmt_contract = utils.init_management_contract(_w3)
+        battery_mgmt_contract = utils.init_battery_management_contract(_w3, utils.get_battery_managment_contract_addr(_w3))
+        contracts = {mgmt_contract.address: mgmt_contract, battery_mgmt_contract.address: battery_mgmt_contract}
+        topics = [provenance.event_topic(event) for event in
+                  (provenance.VENDOR_EVENT, provenance.NEW_BATTERY_EVENT, provenance.TRANSFER_EVENT)]
+
+        logs = provenance.get_logs(_w3, {'address': list(contracts.keys()), 'topics': [topics]}, self.block + 1, to_block)
+        logs = sorted(logs, key=lambda log: (log['blockNumber'], log['logIndex']))
+
+        for log in logs:
+            for event in provenance.decode_logs(contracts[Web3.toChecksumAddress(log['address'])], [log]):
+                self.apply(event)
+
+        self.block = to_block
+
+        return len(logs)
+
+    def save(self, _path: str = REGISTRY_SNAPSHOT_NAME) -> None:
+        """
+        Write snapshot: header, arrays as they are in memory, owners and vendors
+
+        :param str _path: Path to the snapshot
+        :return: Nothing
+        :rtype: None
+        """
+
+        owners = {owner: self._owner_ref(owner) for owner in self.vendor_owners.values()}
+
+        with open(_path + '.tmp', 'wb') as out:
+            out.write(HEADER.pack(REGISTRY_MAGIC, REGISTRY_VERSION, self.count, self.capacity, self.table_size,
+                                  len(self.owners), len(self.vendor_owners), self.block))
+            out.write(self.ids)
+            out.write(self.vendors)
+            out.write(self.owner_refs)
+            out.write(self.table)
+
+            for owner in self.owners:
+                out.write(owner)
+
+            for vendor_id, owner in self.vendor_owners.items():
+                out.write(VENDOR_ENTRY.pack(vendor_id, owners[owner]))
+
+        os.replace(_path + '.tmp', _path)
+
+    @classmethod
+    def load(cls, _path: str = REGISTRY_SNAPSHOT_NAME) -> 'BatteryRegistry':
+        """
+        Map snapshot into memory. Pages are read on first access and
+        changes stay private to the process
+
+        :param str _path: Path to the snapshot
+        :return: Registry
+        :rtype: BatteryRegistry
+        """
+
+        registry = cls.__new__(cls)
+
+        with open(_path, 'rb') as file:
+            registry.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        magic, version, count, capacity, table_size, owners, vendors, block = HEADER.unpack_from(registry.mmap)
+
+        if magic != REGISTRY_MAGIC or version != REGISTRY_VERSION:
+            raise ValueError("Unsupported registry snapshot")
+
+        registry.count = count
+        registry.capacity = capacity
+        registry.table_size = table_size
+        registry.block = block
+        registry._layout(registry.mmap)
+
+        offset = HEADER.size + (ID_SIZE + VENDOR_ID_SIZE + INDEX_SIZE) * capacity + INDEX_SIZE * table_size
+        registry.owners = [registry.mmap[offset + ID_SIZE * i:offset + ID_SIZE * (i + 1)] for i in range(owners)]
+        registry.owner_index = {owner: i for i, owner in enumerate(registry.owners)}
+
+        offset += ID_SIZE * owners
+        registry.vendor_owners = {}
+
+        for i in range(vendors):
+            vendor_id, ref = VENDOR_ENTRY.unpack_from(registry.mmap, offset + VENDOR_ENTRY.size * i)
+            registry.vendor_owners[vendor_id] = registry.owners[ref]
+
+        return registry
+
+    def release(self) -> None:
+        """
+        Unmap the snapshot
+
+        :return: Nothing
+        :rtype: None
+        """
+
+        for view in reversed(self.views):
+            view.release()
+
+        self.views = []
+        self.buffer = None
+
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
@@ -0,0 +1,186 @@
+import itertools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from web3 import Web3
+from web3.providers.rpc import HTTPProvider
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from eth_abi import decode_abi
+from eth_utils import decode_hex
+
+
+# Result of one call in the batch: decoded value or an exception
+CallResult = namedtuple('CallResult', ['result', 'error'])
+
+# Key of the latest block number in the results of the batch
+BLOCK_NUMBER = object()
+
+_request_ids = itertools.count()
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def _decode_output(_function, _data: str):
+    """
+    Decode eth_call output the same way ContractFunction.call does
+
+    :param ContractFunction _function: Called contract function
+    :param str _data: Hex encoded output
+    :return: Decoded value (single value is unwrapped)
+    """
+
+    output_types = get_abi_output_types(_function.abi)
+    output = decode_hex(_data)
+
+    if len(output) == 0 and len(output_types) > 0:
+        raise ValueError(f"Could not decode output of {_function.fn_name}: empty result")
+
+    decoded = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decode_abi(output_types, output))
+
+    if len(decoded) == 1:
+        return decoded[0]
+
+    return decoded
+
+
+class BatchCall:
+    """
+    Collects read-only contract calls and sends them to the node
+    as a single JSON-RPC batch request
+    """
+
+    def __init__(self, _w3: Web3, _block='latest'):
+        """
+        :param Web3 _w3: Web3 instance
+        :param str/int _block: Block identifier all calls are evaluated at
+        """
+
+        self.w3 = _w3
+        self.block = _block if isinstance(_block, str) else hex(_block)
+        self.calls = {}
+        self.block_number = False
+
+    def add(self, _key, _function, _tx: dict = None) -> 'BatchCall':
+        """
+        Add contract function call to the batch
+
+        :param _key: Key of the call in the result mapping
+        :param ContractFunction _function: Contract function with arguments
+        :param dict _tx: Additional call parameters (e.g. 'from')
+        :return: The batch itself
+        :rtype: BatchCall
+        """
+
+        self.calls[_key] = (_function, _tx or {})
+
+        return self
+
+    def add_block_number(self) -> 'BatchCall':
+        """
+        Request the latest block number before the calls of the batch,
+        it is returned under the BLOCK_NUMBER key
+
+        :return: The batch itself
+        :rtype: BatchCall
+        """
+
+        self.block_number = True
+
+        return self
+
+    def _request(self, _function, _tx: dict) -> dict:
+        params = dict(_tx)
+        params['to'] = _function.address
+        params['data'] = _function._encode_transaction_data()
+
+        return {'jsonrpc': '2.0', 'id': next(_request_ids), 'method': 'eth_call', 'params': [params, self.block]}
+
+    def _execute_sequentially(self) -> dict:
+        results = {}
+
+        if self.block_number:
+            try:
+                results[BLOCK_NUMBER] = CallResult(self.w3.eth.blockNumber, None)
+            except Exception as error:
+                results[BLOCK_NUMBER] = CallResult(None, error)
+
+        for key, (function, tx) in self.calls.items():
+            try:
+                results[key] = CallResult(function.call(tx, block_identifier=self.block), None)
+            except Exception as error:
+                results[key] = CallResult(None, error)
+
+        return results
+
+    def execute(self) -> dict:
+        """
+        Send all collected calls in one request
+
+        :return: Pairs of call keys and their results
+        :rtype: dict
+        """
+
+        if len(self.calls) == 0 and not self.block_number:
+            return {}
+
+        provider = self.w3.provider
+
+        # batch requests are only supported over HTTP
+        if not isinstance(provider, HTTPProvider):
+            return self._execute_sequentially()
+
+        requests_by_id = {}
+        payload = []
+
+        if self.block_number:
+            request = {'jsonrpc': '2.0', 'id': next(_request_ids), 'method': 'eth_blockNumber', 'params': []}
+            requests_by_id[request['id']] = (BLOCK_NUMBER, None)
+            payload.append(request)
+
+        for key, (function, tx) in self.calls.items():
+            request = self._request(function, tx)
+            requests_by_id[request['id']] = (key, function)
+            payload.append(request)
+
+        response = requests.post(provider.endpoint_uri, json=payload, **provider.get_request_kwargs())
+        response.raise_for_status()
+        responses = response.json()
+
+        # node does not support batches and answered with a single error
+        if not isinstance(responses, list):
+            return self._execute_sequentially()
+
+        results = {}
+
+        for item in responses:
+            key, function = requests_by_id.pop(item['id'])
+
+            if 'error' in item:
+                results[key] = CallResult(None, ValueError(item['error']))
+                continue
+
+            if key is BLOCK_NUMBER:
+                results[key] = CallResult(int(item['result'], 16), None)
+                continue
+
+            try:
+                results[key] = CallResult(_decode_output(function, item['result']), None)
+            except Exception as error:
+                results[key] = CallResult(None, error)
+
+        for key, function in requests_by_id.values():
+            name = function.fn_name if function is not None else 'eth_blockNumber'
+            results[key] = CallResult(None, ValueError(f"No response for {name}"))
+
+        return results
+
+    def execute_async(self):
+        """
+        Send collected calls in the background, so dependent work
+        can proceed while the request is in flight
+
+        :return: Future with the result of execute()
+        :rtype: concurrent.futures.Future
+        """
+
+        return _executor.submit(self.execute)
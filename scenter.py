@@ -1,11 +1,17 @@
 import sys, os
 import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import web3
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
 
 # Project modules
 import utils
+import indexer
+import pricing
+from inventory import StationInventory
 from TextColor.color import bcolors
 
 
@@ -16,6 +22,17 @@ MGMT_CONTRACT_SRC_PATH = utils.MGMT_CONTRACT_SRC_PATH
 MGMT_CONTRACT_NAME = utils.MGMT_CONTRACT_NAME
 REGISTRATION_REQUIRED_GAS = utils.REGISTRATION_REQUIRED_GAS
 ACCOUNT_DB_NAME = 'scenter.json'
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8600
+# Server unlocks the account for this time in seconds and renews
+# the unlock at half of it, so the account is locked soon after the server stops
+SERVER_UNLOCK_DURATION = 300
+
+# Station inventory opened on first use
+_station_inventory = None
+
+# Tariff loaded on first use
+_tariff = None
 
 def create_parser() -> argparse.ArgumentParser:
     """
@@ -65,6 +82,31 @@ def create_parser() -> argparse.ArgumentParser:
         help='Transfer battery to the car <car_account> <car_battery_id> <sc_battery_id>'
     )
 
+    parser.add_argument(
+        '--swap', nargs=5, required=False,
+        help='Swap batteries with the car in one transaction <car_account> <car_battery_id> <sc_battery_id> <deadline> <car_signature>'
+    )
+
+    parser.add_argument(
+        '--inventory', action='store_true', required=False,
+        help='List batteries owned by the service center'
+    )
+
+    parser.add_argument(
+        '--restock', action='store_true', required=False,
+        help='Verify batteries owned by the service center and put them on the shelf'
+    )
+
+    parser.add_argument(
+        '--select_battery', action='store_true', required=False,
+        help='Get the battery with the least charge cycles on the shelf'
+    )
+
+    parser.add_argument(
+        '--serve', nargs='?', const=SERVER_PORT, type=int, required=False,
+        help=f'Serve car requests on localhost [<port>], {SERVER_PORT} by default'
+    )
+
     return parser
 
 
@@ -106,34 +148,84 @@ def register_scenter(_w3: Web3):
         return f"{bcolors.FAIL}Registration failed{bcolors.ENDC}"
 
 
-def approve_replacement(w3: Web3, car_battery_id: str, sc_battery_id: str, car_address: str) -> None:
+def approve_replacement(w3: Web3, car_battery_id: str, sc_battery_id: str, car_address: str) -> dict:
     """
     Approve battery replacement if battery is successfully verified
-    Create a json file with approval stutus and maybe error
 
     :param Web3 w3: Web3 instance
     :param str car_battery_id: Car's battery id
     :param str sc_battery_id: Service center's battery id
     :param str car_address: Car's address
 
-    :return: Nothing
-    :rtype: None
+    :return: Approval status and maybe error
+    :rtype: dict
     """
 
-    sc_battery_id_path = f"firmware/{car_battery_id[:8]}.py"
-    car_battery_id_path = f"firmware/{sc_battery_id[:8]}.py"
-
-    data = utils.verify_battery(w3, car_battery_id_path)
+    data = utils.verify_battery(w3, car_battery_id)
     message = {'approved': False}
 
     if data[0]:
         message['approved'] = True
+        # car's battery is put on the shelf when it is transferred
+        get_station_inventory().expect(car_battery_id, data[1])
     
     message['error'] = "Car's battery probably is fake"
 
-    utils.write_data_base(message, 'replacement.json')
+    return message
         
 
+def get_station_inventory() -> StationInventory:
+    """
+    Open station inventory once per process
+
+    :return: Station inventory
+    :rtype: StationInventory
+    """
+
+    global _station_inventory
+
+    if _station_inventory is None:
+        _station_inventory = StationInventory()
+
+    return _station_inventory
+
+
+def restock(w3: Web3) -> int:
+    """
+    Verify batteries owned by the service center and put them on the shelf
+
+    :param Web3 w3: Web3 instance
+    :return: Number of batteries on the shelf
+    :rtype: int
+    """
+
+    return get_station_inventory().restock(w3, get_inventory(w3))
+
+
+def select_battery() -> str:
+    """
+    Reserve battery with the least charge cycles for the arriving car, so
+    concurrent cars get different batteries
+
+    :return: Battery id
+    :rtype: str
+    """
+
+    battery_id = get_station_inventory().reserve()
+
+    if battery_id is None:
+        sys.exit(f"{bcolors.FAIL}No verified batteries on the shelf{bcolors.ENDC}")
+
+    return battery_id
+
+
+def _exchange_done(car_battery_id: str, sc_battery_id: str) -> None:
+    inventory = get_station_inventory()
+
+    inventory.remove(sc_battery_id)
+    inventory.arrive(car_battery_id)
+
+
 def get_addr() -> str:
     """
     Get service center's address
@@ -146,10 +238,59 @@ def get_addr() -> str:
     return data['account']
 
 
-def get_work_cost(car_battery_id: str, sc_battery_id: str) -> float:
+def get_inventory(w3: Web3) -> list:
     """
-    Calculate the cost of battery replacement based on its characteristics
+    Get batteries owned by the service center from the local index
 
+    :param Web3 w3: Web3 instance
+    :return: Battery ids
+    :rtype: list
+    """
+
+    index = indexer.get_index(w3)
+
+    if index is None:
+        sys.exit(f"{bcolors.FAIL}Index is not created, run indexer.py --run{bcolors.ENDC}")
+
+    return index.batteries_of(get_addr())
+
+
+def get_tariff() -> dict:
+    """
+    Load tariff once per process
+
+    :return: Tariff
+    :rtype: dict
+    """
+
+    global _tariff
+
+    if _tariff is None:
+        _tariff = pricing.load_tariff()
+
+    return _tariff
+
+
+def _battery_record(w3: Web3, index, battery_id: str) -> tuple:
+    """
+    :return: Vendor id and registration timestamp of the battery, empty and None if it is not indexed
+    :rtype: tuple
+    """
+
+    record = index.battery_record(battery_id) if index is not None else None
+
+    if record is None:
+        return '', None
+
+    return record[0].hex(), w3.eth.getBlock(record[1]).timestamp
+
+
+def get_work_cost(w3: Web3, car_battery_id: str, sc_battery_id: str) -> float:
+    """
+    Calculate the cost of battery replacement based on the charge cycles,
+    vendor and age of the batteries
+
+    :param Web3 w3: Web3 instance
     :param str car_battery_id: Car's battery id
     :param str sc_battery_id: Service center's battery id
 
@@ -157,10 +298,38 @@ def get_work_cost(car_battery_id: str, sc_battery_id: str) -> float:
     rtype: float
     """
 
-    return 0.005
+    inventory = get_station_inventory()
+    sc_charges = inventory.charges_of(sc_battery_id) or 0
+    car_charges = inventory.charges_of(car_battery_id)
+
+    if car_charges is None:
+        car_charges = sc_charges
+
+    index = indexer.get_index(w3, _sync=False)
+    _, car_registered = _battery_record(w3, index, car_battery_id)
+    sc_vendor, sc_registered = _battery_record(w3, index, sc_battery_id)
+
+    return pricing.quote_one(get_tariff(), car_charges, sc_charges, sc_vendor, car_registered, sc_registered)
 
 
-def transfer_battery_to_car(w3: Web3, car_account: str, car_battery_id: str, sc_battery_id) -> float:
+def _check_owners(w3: Web3, owners: dict) -> None:
+    """
+    Exit if the batteries do not belong to the expected owners on-chain
+
+    :param Web3 w3: Web3 instance
+    :param dict owners: Pairs of battery ids and expected owner addresses
+    :return: Nothing
+    :rtype: None
+    """
+
+    actual = utils.get_battery_owners(w3, list(owners))
+
+    for battery_id, owner in owners.items():
+        if actual[battery_id] is None or actual[battery_id].lower() != owner.lower():
+            sys.exit(f"{bcolors.FAIL}Battery {battery_id} does not belong to {owner}{bcolors.ENDC}")
+
+
+def transfer_battery_to_car(w3: Web3, car_account: str, car_battery_id: str, sc_battery_id, _unlock: bool = True) -> float:
     """
     Transfer battery to car
 
@@ -168,17 +337,170 @@ def transfer_battery_to_car(w3: Web3, car_account: str, car_battery_id: str, sc_
     :param str car_account: Car's address
     :param str car_battery_id: Car's battery id
     :param str sc_battery_id: Service centers's battery id
+    :param bool _unlock: Unlock account before the transfer
 
     return: Cost of battery replacement
     rtype: float
     """
 
-    result = utils.change_owner(w3, sc_battery_id, car_account, ACCOUNT_DB_NAME)
+    try:
+        # car's battery has to be transferred to the station before it gets a new one
+        _check_owners(w3, {car_battery_id: get_addr()})
+
+        result = utils.change_owner(w3, sc_battery_id, car_account, ACCOUNT_DB_NAME, _unlock)
+
+        if 'failed' in result:
+            sys.exit(f"{bcolors.FAIL}Service center does not own this battery!{bcolors.ENDC}")
+    except SystemExit:
+        # battery selected for the car is not issued
+        get_station_inventory().release(sc_battery_id)
+        raise
+
+    cost = get_work_cost(w3, car_battery_id, sc_battery_id)
+    _exchange_done(car_battery_id, sc_battery_id)
+
+    return cost
+
+
+def swap_batteries(w3: Web3, car_account: str, car_battery_id: str, sc_battery_id: str, deadline: int,
+                   car_signature: str, _unlock: bool = True) -> float:
+    """
+    Exchange car's battery and service center's battery in one transaction
+
+    :param Web3 w3: Web3 instance
+    :param str car_account: Car's address
+    :param str car_battery_id: Car's battery id
+    :param str sc_battery_id: Service centers's battery id
+    :param int deadline: Time until which the signatures are valid
+    :param str car_signature: Car's signature of the swap
+    :param bool _unlock: Unlock account before the swap
+
+    return: Cost of battery replacement
+    rtype: float
+    """
+
+    try:
+        _check_owners(w3, {car_battery_id: car_account, sc_battery_id: get_addr()})
+
+        if not utils.swap_batteries(w3, car_account, car_battery_id, sc_battery_id, deadline, car_signature,
+                                    ACCOUNT_DB_NAME, _unlock):
+            sys.exit(f"{bcolors.FAIL}Swap failed{bcolors.ENDC}")
+    except SystemExit:
+        # battery selected for the car is not issued
+        get_station_inventory().release(sc_battery_id)
+        raise
+
+    cost = get_work_cost(w3, car_battery_id, sc_battery_id)
+    _exchange_done(car_battery_id, sc_battery_id)
+
+    return cost
+
+
+def create_request_handler(w3: Web3):
+    """
+    Create handler of car requests sharing Web3 connection, contract
+    objects and unlocked account of the server
+
+    :param Web3 w3: Web3 instance
+    :return: Request handler class
+    :rtype: type
+    """
+
+    routes = {
+        '/approve_replacement': lambda r: approve_replacement(w3, r['car_battery_id'], r['sc_battery_id'], r['car_address']),
+        '/get_address': lambda r: {'address': get_addr()},
+        '/inventory': lambda r: {'batteries': get_inventory(w3)},
+        '/select_battery': lambda r: {'battery_id': select_battery()},
+        '/transfer_battery_to_car': lambda r: {'cost': transfer_battery_to_car(w3, r['car_account'], r['car_battery_id'],
+                                                                               r['sc_battery_id'], _unlock=False)},
+        '/swap': lambda r: {'cost': swap_batteries(w3, r['car_account'], r['car_battery_id'], r['sc_battery_id'],
+                                                   r['deadline'], r['car_signature'], _unlock=False)},
+        '/verify': lambda r: dict(zip(('verified', 'charges', 'vendor_id', 'vendor_name'),
+                                      utils.verify_battery(w3, r['battery_id']))),
+    }
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            route = routes.get(self.path)
+
+            if route is None:
+                self.send_error(404)
+                return
+
+            length = int(self.headers.get('Content-Length', 0))
 
-    if 'failed' in result:
-        sys.exit(f"{bcolors.FAIL}Service center does not own this battery!{bcolors.ENDC}")
+            try:
+                response = route(json.loads(self.rfile.read(length) or b'{}'))
+            except SystemExit as error:
+                # helpers report failures via sys.exit
+                response = {'error': str(error.code)}
+            except Exception as error:
+                response = {'error': str(error)}
 
-    return get_work_cost(car_battery_id, sc_battery_id)
+            body = json.dumps(response).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return RequestHandler
+
+
+def serve(w3: Web3, port: int) -> None:
+    """
+    Serve car requests on localhost until interrupted
+
+    :param Web3 w3: Web3 instance
+    :param int port: Port to listen
+    :return: Nothing
+    :rtype: None
+    """
+
+    data = utils.open_data_base(ACCOUNT_DB_NAME)
+
+    if data is None:
+        sys.exit(f"{bcolors.FAIL}Cannot access account database{bcolors.ENDC}")
+
+    stopped = threading.Event()
+
+    def keep_unlocked() -> None:
+        while not stopped.wait(SERVER_UNLOCK_DURATION / 2):
+            try:
+                w3.geth.personal.unlockAccount(data['account'], data['password'], SERVER_UNLOCK_DURATION)
+            except IOError:
+                # node is temporarily unreachable, retry at the next renewal
+                pass
+
+    w3.geth.personal.unlockAccount(data['account'], data['password'], SERVER_UNLOCK_DURATION)
+    threading.Thread(target=keep_unlocked, daemon=True).start()
+
+    # warm up contract objects and address resolution
+    utils.get_battery_managment_contract_addr(w3)
+    # cached calls are reused until a new block appears
+    utils.get_call_cache(w3).follow()
+
+    index = indexer.get_index(w3)
+
+    # inventory requests read the index without indexing new blocks themselves
+    if index is not None:
+        index.follow()
+
+    server = ThreadingHTTPServer((SERVER_HOST, port), create_request_handler(w3))
+    print(f"{bcolors.OKGREEN}Serving on {SERVER_HOST}:{port}{bcolors.ENDC}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        w3.geth.personal.lockAccount(data['account'])
 
 
 def main() -> None:
@@ -204,7 +526,8 @@ def main() -> None:
         print(f"Vendor name: {data[3]}")
 
     elif args.approve_replacement:
-        approve_replacement(w3, args.approve_replacement[0], args.approve_replacement[1], args.approve_replacement[2])
+        message = approve_replacement(w3, args.approve_replacement[0], args.approve_replacement[1], args.approve_replacement[2])
+        utils.write_data_base(message, 'replacement.json')
     
     elif args.get_address:
         print(get_addr())
@@ -212,6 +535,26 @@ def main() -> None:
     elif args.transfer_battery_to_car:
         print(transfer_battery_to_car(w3, args.transfer_battery_to_car[0], args.transfer_battery_to_car[1], args.transfer_battery_to_car[2]))
 
+    elif args.swap:
+        print(swap_batteries(w3, args.swap[0], args.swap[1], args.swap[2], int(args.swap[3]), args.swap[4]))
+
+    elif args.inventory:
+        batteries = get_inventory(w3)
+
+        for battery_id in batteries:
+            print(battery_id)
+
+        print(f"Total batteries: {len(batteries)}")
+
+    elif args.restock:
+        print(f"Batteries on the shelf: {restock(w3)}")
+
+    elif args.select_battery:
+        print(select_battery())
+
+    elif args.serve:
+        serve(w3, args.serve)
+
     else:
         sys.exit(f"{bcolors.FAIL}No parameters provided{bcolors.ENDC}")
 
@@ -18,7 +18,8 @@ MGMT_CONTRACT_DB_NAME = utils.MGMT_CONTRACT_DB_NAME
 CONTRACTS = {'token':  ('contracts/ERC20Token.sol', 'ERC20Token'),
              'wallet': ('contracts/ServiceProviderWallet.sol', 'ServiceProviderWallet'),
              'mgmt':   ('contracts/ManagementContract.sol', 'ManagementContract'),
-             'battery': ('contracts/BatteryManagement.sol', 'BatteryManagement')}
+             'battery': ('contracts/BatteryManagement.sol', 'BatteryManagement'),
+             'multicall': ('contracts/Multicall.sol', 'Multicall')}
 
 
 def create_parser() -> argparse.ArgumentParser:
@@ -100,6 +101,9 @@ def setup(_w3: Web3, _service_fee: float) -> Union[dict, None]:
 
     actor = data['account']
 
+    # emit ABI/bytecode bundle for the runtime tools
+    utils.create_artifacts_bundle(CONTRACTS.values())
+
     utils.unlock_account(_w3, actor, data['password'])
 
     tx_dict = {}
@@ -123,26 +127,36 @@ def setup(_w3: Web3, _service_fee: float) -> Union[dict, None]:
                                                            service_provider_wallet_addr, service_fee)
             
             if mgmt_contract_addr is not None:
-                utils._create_mgmt_contract_db(mgmt_contract_addr)
-
                 # deploy battery managment
                 battery_mgmt_contract_addr = utils._deploy_contract_and_wait(_w3, actor, CONTRACTS['battery'][0], CONTRACTS['battery'][1],
                                                                        mgmt_contract_addr, currency_token_contract_addr)
                 
                 if battery_mgmt_contract_addr is not None:
-                    compiled_contract = utils.compile_contracts(CONTRACTS['mgmt'][0])
-                    mgmt_contract = utils.initialize_contract_factory(_w3, compiled_contract,
-                                                                      CONTRACTS['mgmt'][0] + ':' + CONTRACTS['mgmt'][1],
-                                                                      mgmt_contract_addr)
+                    mgmt_contract = utils.init_contract(_w3, CONTRACTS['mgmt'][0], CONTRACTS['mgmt'][1],
+                                                        mgmt_contract_addr)
 
                     tx_hash = mgmt_contract.functions.setBatteryManagementContract(battery_mgmt_contract_addr).transact({'from': actor, 'gasPrice': utils.get_actual_gas_price(_w3)})
                     receipt = web3.eth.wait_for_transaction_receipt(_w3, tx_hash, 120, 0.1)
 
                     if receipt.status == 1:
+                        # deploy optional aggregator for read-only queries
+                        multicall_contract_addr = utils._deploy_contract_and_wait(_w3, actor, CONTRACTS['multicall'][0],
+                                                                                  CONTRACTS['multicall'][1], mgmt_contract_addr)
+
+                        addresses = {'token': currency_token_contract_addr, 'wallet': service_provider_wallet_addr,
+                                     'mgmt': mgmt_contract_addr, 'battery': battery_mgmt_contract_addr}
+
+                        if multicall_contract_addr is not None:
+                            addresses['multicall'] = multicall_contract_addr
+
+                        utils._create_deployment_db(_w3, addresses)
+
                         contract_addresses = {
                             'Management contract': mgmt_contract_addr,
                             'Wallet contract'    : service_provider_wallet_addr,
-                            'Currency contract:' : currency_token_contract_addr
+                            'Currency contract:' : currency_token_contract_addr,
+                            'Battery contract'   : battery_mgmt_contract_addr,
+                            'Multicall contract' : multicall_contract_addr
                         }
 
                         return contract_addresses
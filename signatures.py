@@ -0,0 +1,87 @@
+import os
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from eth_keys import keys
+from eth_keys.exceptions import BadSignature, ValidationError
+from eth_utils import keccak
+
+
+# Maximum difference between signature time and current time in seconds
+MAX_SIGNATURE_AGE = 300
+RECOVERY_CHUNK_SIZE = 256
+# Smaller batches are recovered in the process, starting workers costs more
+PARALLEL_RECOVERY_THRESHOLD = 2 * RECOVERY_CHUNK_SIZE
+
+
+class InvalidBatterySignature(ValueError):
+    pass
+
+
+def battery_message_hash(_charges: int, _time: int) -> bytes:
+    """
+    Hash of the message signed by battery firmware,
+    keccak256(abi.encode(2**32 * charges + time)) in BatteryManagement
+
+    :param int _charges: Charge cycles
+    :param int _time: Timestamp
+    :return: Message hash
+    :rtype: bytes
+    """
+
+    message = ((_charges << 32) + _time) % (1 << 256)
+
+    return keccak(message.to_bytes(32, byteorder='big'))
+
+
+def recover_battery_id(_info: dict, _max_age: int = MAX_SIGNATURE_AGE) -> str:
+    """
+    Recover battery id from the signed battery info without calling the node
+
+    :param dict _info: Battery's info (v, r, s, charges, time)
+    :param int _max_age: Maximum signature age in seconds, not checked if None
+    :return: Battery id
+    :rtype: str
+    """
+
+    # firmware takes time the same way
+    now = int(dt.datetime.utcnow().timestamp())
+
+    if _max_age is not None and abs(now - _info['time']) > _max_age:
+        raise InvalidBatterySignature("Battery info is stale")
+
+    if _info['v'] not in (27, 28):
+        raise InvalidBatterySignature("Invalid v")
+
+    try:
+        signature = keys.Signature(vrs=(_info['v'] - 27, int(_info['r'], 16), int(_info['s'], 16)))
+        public_key = signature.recover_public_key_from_msg_hash(battery_message_hash(_info['charges'], _info['time']))
+    except (ValueError, TypeError, BadSignature, ValidationError) as error:
+        raise InvalidBatterySignature(str(error))
+
+    return public_key.to_checksum_address()
+
+
+def _recover_or_error(_info: dict):
+    try:
+        return recover_battery_id(_info)
+    except InvalidBatterySignature as error:
+        return error
+
+
+def recover_battery_ids(_infos: list, _workers: int = None) -> list:
+    """
+    Recover battery ids of many signatures across a process pool
+
+    :param list _infos: Batteries' info
+    :param int _workers: Maximal number of worker processes, number of cores if not specified
+    :return: Battery ids or InvalidBatterySignature errors in the same order
+    :rtype: list
+    """
+
+    if len(_infos) < PARALLEL_RECOVERY_THRESHOLD:
+        return [_recover_or_error(info) for info in _infos]
+
+    workers = min(_workers or os.cpu_count(), -(-len(_infos) // RECOVERY_CHUNK_SIZE))
+
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_recover_or_error, _infos, chunksize=RECOVERY_CHUNK_SIZE))
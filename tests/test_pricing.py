@@ -0,0 +1,85 @@
+import sys, os
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project modules
+import pricing
+
+
+TARIFF = {
+    'base': 0.005,
+    'per_charge': 0.00001,
+    'per_day': 0.000002,
+    'min': 0.001,
+    'max': 0.05,
+    'vendors': {'aa' * 4: 1.5, 'bb' * 4: 0.5},
+}
+DAY = pricing.SECONDS_PER_DAY
+
+
+class QuoteTest(unittest.TestCase):
+    def test_cost_of_cycles_and_age(self):
+        cost = pricing.quote_one(TARIFF, 300, 100, '', 0, 10 * DAY)
+
+        self.assertAlmostEqual(cost, 0.005 + 0.00001 * 200 + 0.000002 * 10)
+
+    def test_newer_car_battery_is_not_discounted(self):
+        # fewer cycles and a younger car battery don't make the price lower than the base
+        cost = pricing.quote_one(TARIFF, 100, 300, '', 10 * DAY, 0)
+
+        self.assertAlmostEqual(cost, 0.005)
+
+    def test_cost_is_clipped(self):
+        self.assertAlmostEqual(pricing.quote_one(TARIFF, 10 ** 6, 0), TARIFF['max'])
+        self.assertAlmostEqual(pricing.quote_one(dict(TARIFF, base=0), 0, 0), TARIFF['min'])
+
+    def test_unknown_registration_does_not_change_cost(self):
+        expected = pricing.quote_one(TARIFF, 300, 100)
+
+        self.assertAlmostEqual(pricing.quote_one(TARIFF, 300, 100, '', None, 10 * DAY), expected)
+        self.assertAlmostEqual(pricing.quote_one(TARIFF, 300, 100, '', 0, None), expected)
+
+        costs = pricing.quote(TARIFF, [300, 300], [100, 100], ['', ''], [np.nan, 0], [10 * DAY, np.nan])
+
+        np.testing.assert_allclose(costs, [expected, expected])
+
+    def test_vendor_multipliers(self):
+        vendors = ['0x' + 'AA' * 4, 'bb' * 4, 'cc' * 4, '', 'aa' * 4]
+        costs = pricing.quote(TARIFF, [100] * 5, [100] * 5, vendors, [np.nan] * 5, [np.nan] * 5)
+
+        np.testing.assert_allclose(costs, [0.0075, 0.0025, 0.005, 0.005, 0.0075])
+        self.assertAlmostEqual(pricing.quote_one(TARIFF, 100, 100, '0x' + 'bb' * 4), 0.0025)
+
+    def test_batch_matches_single_quotes(self):
+        rng = np.random.default_rng(1)
+        car_charges = rng.integers(0, 3000, 50)
+        sc_charges = rng.integers(0, 3000, 50)
+        vendors = rng.choice(['aa' * 4, 'bb' * 4, ''], 50)
+        car_registered = rng.choice([np.nan, 0, 100 * DAY], 50)
+        sc_registered = rng.choice([np.nan, 50 * DAY, 400 * DAY], 50)
+
+        costs = pricing.quote(TARIFF, car_charges, sc_charges, vendors, car_registered, sc_registered)
+        single = [pricing.quote_one(TARIFF, int(car_charges[i]), int(sc_charges[i]), str(vendors[i]),
+                                    None if np.isnan(car_registered[i]) else car_registered[i],
+                                    None if np.isnan(sc_registered[i]) else sc_registered[i])
+                  for i in range(50)]
+
+        np.testing.assert_allclose(costs, single)
+
+    def test_empty_fleet(self):
+        self.assertEqual(pricing.quote(TARIFF, [], [], [], [], []).shape, (0,))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'fleet.csv')
+
+            with open(path, 'w') as fleet:
+                fleet.write(','.join(pricing.FLEET_COLUMNS) + '\n')
+
+            self.assertEqual(len(pricing.quote_fleet(path, TARIFF)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import sys, os
+import unittest
+from types import SimpleNamespace
+from web3.exceptions import TransactionNotFound
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project modules
+from receipts import ReceiptTracker
+
+
+TX_HASH = b'\x01' * 32
+
+
+class StubEth:
+    """
+    Node without block filters where transactions are mined on demand
+    """
+
+    def __init__(self):
+        self.blockNumber = 0
+        self.blocks = {}
+        self.receipts = {}
+        self.receipt_requests = 0
+
+    def mine(self, *_tx_hashes) -> None:
+        self.blockNumber += 1
+        self.blocks[self.blockNumber] = {'transactions': list(_tx_hashes)}
+
+        for tx_hash in _tx_hashes:
+            self.receipts[tx_hash] = SimpleNamespace(status=1, blockNumber=self.blockNumber)
+
+    def filter(self, _filter_params):
+        raise ValueError("filters are not supported")
+
+    def getBlock(self, _block_id):
+        return self.blocks[_block_id]
+
+    def getTransactionReceipt(self, _tx_hash):
+        self.receipt_requests += 1
+
+        if _tx_hash not in self.receipts:
+            raise TransactionNotFound(f"Transaction {_tx_hash.hex()} not found")
+
+        return self.receipts[_tx_hash]
+
+
+class ReceiptTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.w3 = SimpleNamespace(eth=StubEth())
+        self.tracker = ReceiptTracker(self.w3, 0)
+
+    def test_unmined_transaction_stays_pending(self):
+        future = self.tracker.track(TX_HASH)
+
+        self.tracker.poll()
+        self.tracker.poll()
+
+        self.assertFalse(future.done())
+        self.assertIn(TX_HASH, self.tracker.pending)
+        # only the first check asks for the receipt, then new blocks are followed
+        self.assertEqual(self.w3.eth.receipt_requests, 1)
+
+        self.w3.eth.mine(TX_HASH)
+        self.tracker.poll()
+
+        self.assertEqual(future.result(0).blockNumber, 1)
+        self.assertEqual(len(self.tracker.pending), 0)
+
+    def test_wait_resolves_transaction_mined_later(self):
+        future = self.tracker.track(TX_HASH)
+        poll = self.tracker.poll
+
+        def poll_and_mine():
+            poll()
+
+            if self.w3.eth.blockNumber == 0:
+                self.w3.eth.mine(b'\x02' * 32, TX_HASH)
+
+        self.tracker.poll = poll_and_mine
+        self.tracker.wait(5)
+
+        self.assertEqual(future.result(0).status, 1)
+
+    def test_already_mined_transaction_is_resolved_at_once(self):
+        self.w3.eth.mine(TX_HASH)
+        future = self.tracker.track(TX_HASH)
+
+        self.tracker.poll()
+
+        self.assertTrue(future.done())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import sys, os
+import tempfile
+import unittest
+import importlib.util
+import datetime as dt
+from eth_keys import keys
+from eth_utils import keccak
+from py_ecc.secp256k1 import ecdsa_raw_recover
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project modules
+import battery_firmware
+from signatures import (battery_message_hash, recover_battery_id, recover_battery_ids, InvalidBatterySignature,
+                        MAX_SIGNATURE_AGE, PARALLEL_RECOVERY_THRESHOLD)
+
+
+PRIVATE_KEY = bytes.fromhex("4c0883a69102937d6231471b5dbb6204fe5129617082792ae468d01a3f362318")
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "batteryTemplate.py")
+
+
+def abi_encode_uint256(_value: int) -> bytes:
+    # abi.encode of a single uint256 is one big-endian 32-byte word
+    return (_value % 2 ** 256).to_bytes(32, 'big')
+
+
+def now() -> int:
+    # firmware takes time the same way
+    return int(dt.datetime.utcnow().timestamp())
+
+
+def ecrecover(_info: dict) -> str:
+    """
+    Recover the signer the way BatteryManagement.getBatteryIdFromSignature does:
+    keccak256(abi.encode(2**32 * charges + time)) and ecrecover with v of 27/28
+    """
+
+    message = abi_encode_uint256(2 ** 32 * _info['charges'] + _info['time'])
+    public_key = ecdsa_raw_recover(keccak(message), (_info['v'], int(_info['r'], 16), int(_info['s'], 16)))
+    x, y = public_key
+
+    return keys.PublicKey(x.to_bytes(32, 'big') + y.to_bytes(32, 'big')).to_checksum_address()
+
+
+class RecoverBatteryIdTest(unittest.TestCase):
+    def setUp(self):
+        self.battery_id = keys.PrivateKey(PRIVATE_KEY).public_key.to_checksum_address()
+
+    def test_message_hash_matches_contract_encoding(self):
+        for charges, time in ((0, 0), (7, 1600000000), (2 ** 40, 2 ** 32 - 1)):
+            self.assertEqual(battery_message_hash(charges, time),
+                             keccak(abi_encode_uint256(2 ** 32 * charges + time)))
+
+    def test_recovers_key_of_keystore_signing(self):
+        info = battery_firmware.sign_battery_info(PRIVATE_KEY, 12, now())
+
+        self.assertEqual(recover_battery_id(info), self.battery_id)
+        self.assertEqual(recover_battery_id(info), ecrecover(info))
+
+    def test_recovers_key_of_template_firmware(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.mkdir(os.path.join(tmp, "firmware"))
+            path = os.path.join(tmp, "firmware", "template.py")
+
+            with open(TEMPLATE_PATH) as tmpl, open(path, 'w') as fw:
+                fw.write(tmpl.read().replace(
+                    'private_key = "0xd016ad062dceb73f7587e25bdfc4d665f8eb6e4f37f2c2c526c25633a63d96ed"',
+                    f'private_key = "0x{PRIVATE_KEY.hex()}"'
+                ))
+
+            with open(os.path.join(tmp, "firmware", "template.json"), 'w') as db:
+                db.write('{"Charge cycles": 3}')
+
+            spec = importlib.util.spec_from_file_location("firmware_template", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+
+            cwd = os.getcwd()
+            os.chdir(tmp)
+
+            try:
+                info = module.get_battery_info()
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(info['charges'], 3)
+        self.assertEqual(recover_battery_id(info), self.battery_id)
+        self.assertEqual(recover_battery_id(info), ecrecover(info))
+
+    def test_rejects_stale_info(self):
+        info = battery_firmware.sign_battery_info(PRIVATE_KEY, 1, now() - MAX_SIGNATURE_AGE - 60)
+
+        with self.assertRaises(InvalidBatterySignature):
+            recover_battery_id(info)
+
+        self.assertEqual(recover_battery_id(info, None), self.battery_id)
+
+    def test_rejects_info_from_the_future(self):
+        info = battery_firmware.sign_battery_info(PRIVATE_KEY, 1, now() + MAX_SIGNATURE_AGE + 60)
+
+        with self.assertRaises(InvalidBatterySignature):
+            recover_battery_id(info)
+
+    def test_rejects_bad_v(self):
+        info = battery_firmware.sign_battery_info(PRIVATE_KEY, 1, now())
+
+        for v in (0, 1, 26, 29):
+            with self.assertRaises(InvalidBatterySignature):
+                recover_battery_id(dict(info, v=v))
+
+    def test_other_v_recovers_other_key(self):
+        info = battery_firmware.sign_battery_info(PRIVATE_KEY, 1, now())
+        flipped = dict(info, v=55 - info['v'])
+
+        try:
+            self.assertNotEqual(recover_battery_id(flipped), self.battery_id)
+        except InvalidBatterySignature:
+            pass
+
+    def test_rejects_malformed_signature(self):
+        info = battery_firmware.sign_battery_info(PRIVATE_KEY, 1, now())
+
+        with self.assertRaises(InvalidBatterySignature):
+            recover_battery_id(dict(info, r='0' * 64))
+
+        with self.assertRaises(InvalidBatterySignature):
+            recover_battery_id(dict(info, s='zz'))
+
+    def test_batch_matches_single(self):
+        infos = [battery_firmware.sign_battery_info(keccak(i.to_bytes(4, 'big')), i, now()) for i in range(8)]
+        infos[3] = dict(infos[3], v=30)
+
+        results = recover_battery_ids(infos)
+
+        self.assertIsInstance(results[3], InvalidBatterySignature)
+
+        for i, result in enumerate(results):
+            if i != 3:
+                self.assertEqual(result, recover_battery_id(infos[i]))
+
+    def test_batch_in_process_pool(self):
+        info = battery_firmware.sign_battery_info(PRIVATE_KEY, 5, now())
+        results = recover_battery_ids([info] * PARALLEL_RECOVERY_THRESHOLD, 2)
+
+        self.assertEqual(results, [self.battery_id] * PARALLEL_RECOVERY_THRESHOLD)
+
+
+if __name__ == "__main__":
+    unittest.main()
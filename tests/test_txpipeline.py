@@ -0,0 +1,84 @@
+import sys, os
+import unittest
+import threading
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project modules
+from txpipeline import TxPipeline
+
+
+class StubEth:
+    """
+    Node which includes every sent transaction in the next block, its
+    receipt requests fail with the given errors first
+    """
+
+    def __init__(self, _errors: list):
+        self.blockNumber = 0
+        self.blocks = {}
+        self.sent = []
+        self.errors = list(_errors)
+        self.lock = threading.Lock()
+
+    def send(self) -> bytes:
+        with self.lock:
+            tx_hash = len(self.sent).to_bytes(32, 'big')
+            self.sent.append(tx_hash)
+            self.blockNumber += 1
+            self.blocks[self.blockNumber] = {'transactions': [tx_hash]}
+
+            return tx_hash
+
+    def filter(self, _filter_params):
+        raise ValueError("filters are not supported")
+
+    def getBlock(self, _block_id):
+        return self.blocks[_block_id]
+
+    def getTransactionReceipt(self, _tx_hash):
+        with self.lock:
+            if len(self.errors) > 0:
+                raise self.errors.pop(0)
+
+        return SimpleNamespace(status=1)
+
+
+class TxPipelineTest(unittest.TestCase):
+    def test_unexpected_error_fails_pending_transactions(self):
+        eth = StubEth([RuntimeError("unexpected response")] * 1000)
+
+        with TxPipeline(SimpleNamespace(eth=eth), _max_in_flight=2, _poll_interval=0.001) as pipeline:
+            # more transactions than slots, so submit waits for the failed ones
+            handles = [pipeline.submit(eth.send) for _ in range(5)]
+
+        for handle in handles:
+            self.assertTrue(handle.done())
+            self.assertIsNone(handle.status)
+            self.assertIsInstance(handle.future.exception(), RuntimeError)
+
+    def test_collector_outlives_error_and_collects_later_transactions(self):
+        eth = StubEth([RuntimeError("unexpected response")])
+        done = []
+
+        with TxPipeline(SimpleNamespace(eth=eth), _poll_interval=0.001) as pipeline:
+            failed = pipeline.submit(eth.send)
+            failed.future.exception(5)
+            succeeded = pipeline.submit(eth.send, lambda handle: done.append(handle.status))
+
+        self.assertIsInstance(failed.future.exception(), RuntimeError)
+        self.assertEqual(succeeded.status, 1)
+        self.assertEqual(done, [1])
+
+    def test_node_outage_is_retried(self):
+        eth = StubEth([IOError("connection refused")] * 3)
+
+        with TxPipeline(SimpleNamespace(eth=eth), _poll_interval=0.001) as pipeline:
+            handle = pipeline.submit(eth.send)
+
+        self.assertEqual(handle.status, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
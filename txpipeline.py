@@ -0,0 +1,152 @@
+import time
+import threading
+from typing import Callable
+from web3 import Web3
+from hexbytes import HexBytes
+
+# Project modules
+from receipts import ReceiptTracker
+
+
+class TxHandle:
+    """
+    Handle of the submitted transaction
+    """
+
+    def __init__(self, _tx_hash, _future):
+        self.tx_hash = HexBytes(_tx_hash)
+        self.future = _future
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def receipt(self, _tmout: float = None):
+        """
+        Wait for the transaction receipt
+
+        :param float _tmout: Timeout in seconds
+        :return: Receipt
+        :rtype: AttributeDict
+        """
+
+        return self.future.result(_tmout)
+
+    @property
+    def status(self):
+        """
+        :return: None if transaction is not in the chain yet, 0 if it failed
+                 and 1 if it succeeded
+        :rtype: None/int
+        """
+
+        if not self.future.done() or self.future.exception() is not None:
+            return None
+
+        return self.future.result().status
+
+
+class TxPipeline:
+    """
+    Broadcasts transactions without waiting for their inclusion and
+    collects receipts in the background
+    """
+
+    def __init__(self, _w3: Web3, _max_in_flight: int = 64, _tmout: float = 120, _poll_interval: float = 0.1):
+        """
+        :param Web3 _w3: Web3 instance
+        :param int _max_in_flight: Maximum number of transactions waiting for receipts
+        :param float _tmout: Timeout for inclusion of each transaction in seconds
+        :param float _poll_interval: Delay between checks for a new block in seconds
+        """
+
+        self.tracker = ReceiptTracker(_w3, _poll_interval)
+        self.tmout = _tmout
+        self.slots = threading.BoundedSemaphore(_max_in_flight)
+        self.deadlines = {}
+        self.handles = []
+        self.closed = threading.Event()
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def _collect(self) -> None:
+        while not (self.closed.is_set() and len(self.deadlines) == 0):
+            if len(self.deadlines) > 0:
+                try:
+                    self._poll()
+                except Exception as error:
+                    # collector has to outlive the submitted transactions, so they fail with the error
+                    self.tracker.expire(list(self.deadlines), error)
+
+            time.sleep(self.tracker.poll_interval)
+
+        self.tracker.close()
+
+    def _poll(self) -> None:
+        try:
+            self.tracker.poll()
+        except IOError:
+            # node is temporarily unreachable, retry on the next iteration
+            pass
+
+        now = time.monotonic()
+        expired = [tx_hash for tx_hash, deadline in list(self.deadlines.items()) if deadline < now]
+
+        if len(expired) > 0:
+            self.tracker.expire(expired)
+
+    def _on_done(self, _tx_hash: bytes, _callback, _handle: TxHandle) -> None:
+        self.deadlines.pop(_tx_hash, None)
+        self.slots.release()
+
+        if _callback is not None:
+            _callback(_handle)
+
+    def submit(self, _send: Callable[[], bytes], _callback: Callable[[TxHandle], None] = None) -> TxHandle:
+        """
+        Broadcast transaction. Blocks only if too many transactions are in flight
+
+        :param callable _send: Function sending transaction and returning its hash
+        :param callable _callback: Function called with the handle when transaction is done
+        :return: Transaction handle
+        :rtype: TxHandle
+        """
+
+        if self.closed.is_set():
+            raise RuntimeError("Pipeline is closed")
+
+        self.slots.acquire()
+
+        try:
+            tx_hash = _send()
+        except Exception:
+            self.slots.release()
+            raise
+
+        key = bytes(HexBytes(tx_hash))
+        self.deadlines[key] = time.monotonic() + self.tmout
+
+        future = self.tracker.track(tx_hash)
+        handle = TxHandle(tx_hash, future)
+        future.add_done_callback(lambda _: self._on_done(key, _callback, handle))
+        self.handles.append(handle)
+
+        return handle
+
+    def close(self) -> list:
+        """
+        Wait for all submitted transactions and stop the pipeline
+
+        :return: Handles of all submitted transactions
+        :rtype: list
+        """
+
+        self.closed.set()
+        self.collector.join()
+
+        return self.handles
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
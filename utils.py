@@ -1,16 +1,24 @@
 import sys, os
-import subprocess
+import re
 import json
+import hashlib
+import importlib.util
 from typing import Union
-from random import random
 import web3
 from web3 import Web3
-from web3._utils.threads import Timeout
-from solcx import compile_files
 from eth_utils import decode_hex
+from eth_account.messages import encode_defunct
+from web3.logs import DISCARD
 
 # Project modules
 from TextColor.color import bcolors
+from rpc_batch import BatchCall, CallResult
+from receipts import ReceiptTracker
+from nonces import get_nonce_manager
+from txpipeline import TxPipeline
+import battery_firmware
+from signatures import recover_battery_ids, InvalidBatterySignature
+from call_cache import CallCache
 
 
 MGMT_CONTRACT_DB_NAME = 'database.json'
@@ -18,7 +26,38 @@ MGMT_CONTRACT_SRC_PATH = r"./contracts/ManagementContract.sol"
 MGMT_CONTRACT_NAME = "ManagementContract"
 BATTERY_MGMT_CONTRACT_SRC_PATH = r"./contracts/BatteryManagement.sol"
 BATTERY_MGMT_CONTRACT_NAME = "BatteryManagement"
+MULTICALL_CONTRACT_SRC_PATH = r"./contracts/Multicall.sol"
+MULTICALL_CONTRACT_NAME = "Multicall"
 REGISTRATION_REQUIRED_GAS = 50000
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+CALL_CACHE_SIZE = 1024
+# Part of the block gas limit used by one batch transfer
+TRANSFER_BLOCK_GAS_USAGE = 0.9
+TRANSFER_GAS_ESTIMATION_SAMPLE = 5
+# Used to size the chunks when the gas of batch transfer can't be estimated from a sample
+BATTERY_TRANSFER_BASE_GAS = 30000
+BATTERY_TRANSFER_GAS = 15000
+# Time in seconds the parties have to send the signed swap
+SWAP_SIGNATURE_TTL = 600
+ARTIFACTS_CACHE_DIR = '.solc_cache'
+ARTIFACTS_BUNDLE_NAME = 'artifacts.json'
+ARTIFACTS_BUNDLE_VERSION = 1
+SOL_IMPORT_RE = re.compile(r'^\s*import\s+(?:[^;]*?\s+from\s+)?["\']([^"\']+)["\']', re.MULTILINE)
+
+# Artifacts bundle loaded on first use
+_artifacts_bundle = None
+
+# Battery firmware modules loaded into the process
+_firmware_modules = {}
+
+# Cache of read-only contract calls shared within the process
+_call_cache = None
+
+# Contract objects created in the process
+_contracts = {}
+
+# Contracts database was checked against the chain
+_deployment_validated = False
 
 
 def _deploy_contract_and_wait(_w3: Web3, _actor: str, _contract_src_file: str, _contract_name: str, *args):
@@ -71,41 +110,73 @@ def _wait_for_validation(_w3: Web3, _tx_dict: dict, _tmout: int = 120) -> dict:
     :rtype: dict
     """
 
-    receipts_list = {}
-    
-    for i in _tx_dict.keys():
-        receipts_list[i] = [_tx_dict[i], None]
-    
-    confirmations = len(list(_tx_dict))
-
-    with Timeout(_tmout) as tm:
-        while(confirmations > 0):
-            for i in _tx_dict.keys():
-                if receipts_list[i][1] is None:
-                    tx_reciept = _w3.eth.getTransactionReceipt(receipts_list[i][0])
-
-                    if tx_reciept is not None:
-                        receipts_list[i][1] = tx_reciept
-                        confirmations -= 1
-                
-                tm.sleep(random())
-    
-    return receipts_list
+    tracker = ReceiptTracker(_w3)
+    futures = {i: tracker.track(_tx_dict[i]) for i in _tx_dict.keys()}
+
+    tracker.wait(_tmout)
 
+    return {i: [_tx_dict[i], futures[i].result()] for i in _tx_dict.keys()}
 
-def _create_mgmt_contract_db(_contract_address: str) -> None:
+
+def _create_deployment_db(_w3: Web3, _addresses: dict) -> None:
     """
-    Create json file with Management contract address
+    Create json file with addresses of all deployed contracts, chain id
+    and hashes of contracts' code used to validate the file
 
-    :params str _contract_address: Managment contract address in blockchain
+    :params Web3 _w3: Web3 instance
+    :params dict _addresses: Pairs of contract keys and their addresses
     :return: Nothing
     :rtype: None
     """
 
-    data = {'mgmt_contract': _contract_address}
+    contracts = {}
+
+    for key, address in _addresses.items():
+        contracts[key] = {'address': address, 'code_hash': _w3.keccak(_w3.eth.getCode(address)).hex()}
+
+    data = {
+        'mgmt_contract': _addresses['mgmt'],
+        'chain_id': _w3.eth.chainId,
+        'contracts': contracts,
+    }
     write_data_base(data, MGMT_CONTRACT_DB_NAME)
 
 
+def get_deployed_address(_w3: Web3, _key: str) -> Union[str, None]:
+    """
+    Get address of the deployed contract from the database. The database
+    is validated once per process by the chain id and the code hash
+    of Management contract
+
+    :params Web3 _w3: Web3 instance
+    :params str _key: Contract key (token, wallet, mgmt, battery, multicall)
+    :return: None if the database has no such contract and its address if it has
+    :rtype: None/str
+    """
+
+    global _deployment_validated
+
+    data = open_data_base(MGMT_CONTRACT_DB_NAME) or {}
+    contracts = data.get('contracts')
+
+    if contracts is None or _key not in contracts:
+        return None
+
+    if not _deployment_validated:
+        mgmt = contracts['mgmt']
+        chain_id = data.get('chain_id')
+
+        # the same contracts may be deployed at the same addresses on another chain
+        if (chain_id is not None and chain_id != _w3.eth.chainId) or \
+                _w3.keccak(_w3.eth.getCode(mgmt['address'])).hex() != mgmt['code_hash']:
+            sys.exit(f"{bcolors.FAIL}Contracts database does not match the chain. "
+                     f"Setup has to be done again{bcolors.ENDC}")
+
+        _deployment_validated = True
+
+    return contracts[_key]['address']
+
+
 def get_actual_gas_price(_w3: Web3) -> float:
     """
     Get actual gas price
@@ -183,24 +254,188 @@ def open_data_base(_file_name: str) -> Union[dict, None]:
         return None
 
 
+def _collect_sources(_file: str, _visited: set = None) -> set:
+    """
+    Collect contract source file and all its transitive imports
+
+    :param str _file: Path to contract source code
+    :param set _visited: Already collected files
+    :return: Normalized paths of the file and its imports
+    :rtype: set
+    """
+
+    if _visited is None:
+        _visited = set()
+
+    path = os.path.normpath(_file)
+
+    if path in _visited:
+        return _visited
+
+    _visited.add(path)
+
+    with open(path) as src:
+        imports = SOL_IMPORT_RE.findall(src.read())
+
+    for imported in imports:
+        _collect_sources(os.path.join(os.path.dirname(path), imported), _visited)
+
+    return _visited
+
+
+def _artifacts_cache_key(_files: list) -> str:
+    """
+    Calculate cache key of compiled artifacts: hash of the requested files,
+    contents of all their transitive imports and the compiler version
+
+    :param list _files: Files to compile
+    :return: Hex digest
+    :rtype: str
+    """
+
+    from solcx import get_solc_version
+
+    sources = set()
+
+    for file in _files:
+        _collect_sources(file, sources)
+
+    digest = hashlib.sha256()
+    digest.update(str(get_solc_version()).encode())
+    digest.update(json.dumps(_files).encode())
+
+    for path in sorted(sources):
+        with open(path, 'rb') as src:
+            digest.update(path.encode())
+            digest.update(hashlib.sha256(src.read()).digest())
+
+    return digest.hexdigest()
+
+
 def compile_contracts(_files: Union[str, list]):
     """
-    Compile contract file/files
+    Compile contract file/files. Compiled artifacts are cached on disk
+    and reused until any of the sources or the compiler version changes
 
     :param str/list _files: Files to compile
     :return: Compiled files
     :rtype: dict
     """
 
+    from solcx import compile_files
+
     if isinstance(_files, str):
-        contracts = compile_files([_files])
+        _files = [_files]
+
+    cache_file = os.path.join(ARTIFACTS_CACHE_DIR, _artifacts_cache_key(_files) + '.json')
 
-    if isinstance(_files, list):
+    try:
+        contracts = open_data_base(cache_file)
+    except ValueError:
+        # damaged cache entry is compiled again and replaced
+        contracts = None
+
+    if contracts is None:
         contracts = compile_files(_files)
 
+        # entry is renamed into place, so parallel runs never read a half-written file
+        os.makedirs(ARTIFACTS_CACHE_DIR, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        write_data_base(contracts, tmp_file)
+        os.replace(tmp_file, cache_file)
+
     return contracts
 
 
+def create_artifacts_bundle(_contracts: list) -> dict:
+    """
+    Compile contracts and write their ABI and bytecode to the artifacts bundle,
+    so the runtime tools do not need the compiler
+
+    :param list _contracts: Pairs of contract source path and contract name
+    :return: Bundle data
+    :rtype: dict
+    """
+
+    global _artifacts_bundle
+
+    from solcx import get_solc_version
+
+    bundle = {'version': ARTIFACTS_BUNDLE_VERSION, 'compiler': str(get_solc_version()), 'contracts': {}}
+
+    for src_path, name in _contracts:
+        compiled = compile_contracts(src_path)
+        artifact = compiled[src_path + ":" + name]
+        bundle['contracts'][name] = {'abi': artifact['abi'], 'bin': artifact['bin']}
+
+    write_data_base(bundle, ARTIFACTS_BUNDLE_NAME)
+    _artifacts_bundle = bundle['contracts']
+
+    return bundle
+
+
+def load_artifacts_bundle() -> Union[dict, None]:
+    """
+    Load contracts' artifacts from the bundle once per process
+
+    :return: None if bundle does not exist or has unsupported version
+             and pairs of contract names and their artifacts if not
+    :rtype: None/dict
+    """
+
+    global _artifacts_bundle
+
+    if _artifacts_bundle is None:
+        bundle = open_data_base(ARTIFACTS_BUNDLE_NAME)
+
+        if bundle is None or bundle.get('version') != ARTIFACTS_BUNDLE_VERSION:
+            return None
+
+        _artifacts_bundle = bundle['contracts']
+
+    return _artifacts_bundle
+
+
+def get_contract_artifact(_src_path: str, _name: str) -> dict:
+    """
+    Get contract's ABI and bytecode from the artifacts bundle
+    or compile contract if it is not bundled
+
+    :param str _src_path: Path to contract source code
+    :param str _name: Contract name
+    :return: Contract's artifact with 'abi' and 'bin' keys
+    :rtype: dict
+    """
+
+    bundle = load_artifacts_bundle()
+
+    if bundle is not None and _name in bundle:
+        return bundle[_name]
+
+    return compile_contracts(_src_path)[_src_path + ":" + _name]
+
+
+def init_contract(_w3: Web3, _src_path: str, _name: str, _address: str):
+    """
+    Create contract object for already deployed contract
+
+    :param Web3 _w3: Web3 instance
+    :param str _src_path: Path to contract source code
+    :param str _name: Contract name
+    :param str _address: Contract's address
+    :return: Contract instance
+    :rtype: Contract
+    """
+
+    key = (id(_w3), _name, _address)
+
+    if key not in _contracts:
+        artifact = get_contract_artifact(_src_path, _name)
+        _contracts[key] = initialize_contract_factory(_w3, {_name: artifact}, _name, _address)
+
+    return _contracts[key]
+
+
 def get_data_from_db(_file_name: str,_key: str) -> Union[str, None]:
     """
     Get data from database
@@ -229,13 +464,62 @@ def init_management_contract(_w3: Web3):
     :rtype: Contract instance
     """
 
-    compiled = compile_contracts(MGMT_CONTRACT_SRC_PATH)
-    mgmt_contract = initialize_contract_factory(_w3, compiled, MGMT_CONTRACT_SRC_PATH + ":" + MGMT_CONTRACT_NAME,
-                                                      open_data_base(MGMT_CONTRACT_DB_NAME)["mgmt_contract"])
+    addr = get_deployed_address(_w3, 'mgmt')
+
+    if addr is None:
+        addr = open_data_base(MGMT_CONTRACT_DB_NAME)["mgmt_contract"]
+
+    mgmt_contract = init_contract(_w3, MGMT_CONTRACT_SRC_PATH, MGMT_CONTRACT_NAME, addr)
     
     return mgmt_contract
 
 
+def init_multicall_contract(_w3: Web3):
+    """
+    Creates aggregator contract object if the contract was deployed
+
+    :param Web3 _w3: Web3 instance
+    :return: None if aggregator is not deployed and contract object if it is
+    :rtype: None/Contract instance
+    """
+
+    addr = get_deployed_address(_w3, 'multicall')
+
+    if addr is None:
+        return None
+
+    return init_contract(_w3, MULTICALL_CONTRACT_SRC_PATH, MULTICALL_CONTRACT_NAME, addr)
+
+
+def get_vendor_info(_w3: Web3, _vendor: str) -> tuple:
+    """
+    Get battery registration fee and vendor's deposit in one request
+
+    :param Web3 _w3: Web3 instance
+    :param str _vendor: Vendor's address
+    :return: Fee and deposit in wei
+    :rtype: tuple
+    """
+
+    multicall_contract = init_multicall_contract(_w3)
+
+    if multicall_contract is not None:
+        fee, deposit = multicall_contract.functions.vendorInfo(_vendor).call()
+        return fee, deposit
+
+    mgmt_contract = init_management_contract(_w3)
+    results = BatchCall(_w3) \
+        .add('fee', mgmt_contract.functions.getFee()) \
+        .add('deposit', mgmt_contract.functions.getDeposit(), {'from': _vendor}) \
+        .execute()
+
+    for result in results.values():
+        if result.error is not None:
+            raise result.error
+
+    return results['fee'].result, results['deposit'].result
+
+
 def initialize_contract_factory(_w3: Web3, _compiled_contracts, _key: str, _address: str = None):
     """
     Initialize contract
@@ -262,6 +546,38 @@ def initialize_contract_factory(_w3: Web3, _compiled_contracts, _key: str, _addr
     return contract
 
 
+def get_call_cache(_w3: Web3) -> CallCache:
+    """
+    Get cache of read-only contract calls shared within the process.
+    Results are reused within one block
+
+    :param Web3 _w3: Web3 instance
+    :return: Call cache
+    :rtype: CallCache
+    """
+
+    global _call_cache
+
+    if _call_cache is None:
+        _call_cache = CallCache(_w3, CALL_CACHE_SIZE)
+
+    return _call_cache
+
+
+def call_batch_cached(_w3: Web3, _calls: dict) -> dict:
+    """
+    Take results of read-only calls from the call cache and send
+    the rest of them in one batch request
+
+    :param Web3 _w3: Web3 instance
+    :param dict _calls: Pairs of call keys and contract functions
+    :return: Pairs of call keys and their results
+    :rtype: dict
+    """
+
+    return get_call_cache(_w3).call_many(_calls)
+
+
 def get_battery_managment_contract_addr(_w3: Web3) -> str:
     """
     :params Web3 _w3: Web3 instance
@@ -269,9 +585,15 @@ def get_battery_managment_contract_addr(_w3: Web3) -> str:
     :rtype: str
     """
 
+    addr = get_deployed_address(_w3, 'battery')
+
+    if addr is not None:
+        return addr
+
+    # database created by the previous version of setup
     try:
         mgmt_contract = init_management_contract(_w3)
-        addr = mgmt_contract.functions.getBatteryManagmentAddr().call()
+        addr = get_call_cache(_w3).call(mgmt_contract.functions.getBatteryManagmentAddr())
     except:
         sys.exit(f"{bcolors.FAIL}Failed{bcolors.ENDC}")
 
@@ -288,80 +610,288 @@ def init_battery_management_contract(_w3: Web3, addr: str):
     :rtype: Contract instance
     """
 
-    compiled = compile_contracts(BATTERY_MGMT_CONTRACT_SRC_PATH)
-    battery_mgmt_contract = initialize_contract_factory(_w3, compiled, BATTERY_MGMT_CONTRACT_SRC_PATH + ":" + BATTERY_MGMT_CONTRACT_NAME,
-                                                        addr)
+    battery_mgmt_contract = init_contract(_w3, BATTERY_MGMT_CONTRACT_SRC_PATH, BATTERY_MGMT_CONTRACT_NAME, addr)
     
     return battery_mgmt_contract
 
 
-def create_script_from_tmpl(private_key, address: str):
-    with open("batteryTemplate.py", 'r') as tmpl:
-        lines = tmpl.readlines()
-    
-    lines[11] = f"private_key = '{private_key}'\n"
+def load_firmware(_path: str):
+    """
+    Load battery firmware into the process once
+
+    :param str _path: Path to battery's firmware
+    :return: Firmware module
+    :rtype: module
+    """
 
-    with open(f"firmware/{address[2:10]}.py", 'w') as fw:
-        fw.writelines(lines)
+    path = os.path.abspath(_path)
 
+    if path not in _firmware_modules:
+        name = "firmware_" + os.path.basename(path)[:-3]
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _firmware_modules[path] = module
 
-def get_battery_info(_path: str) -> dict:
+    return _firmware_modules[path]
+
+
+def firmware_path(_battery_id: str) -> str:
+    """
+    :param str _battery_id: Battery id
+    :return: Path to per-file firmware created before the keystore
+    :rtype: str
+    """
+
+    if _battery_id[:2] == '0x':
+        _battery_id = _battery_id[2:]
+
+    return f"firmware/{_battery_id[:8]}.py"
+
+
+def get_battery_info(_battery: str) -> dict:
     """
     Get battery info(v, r, s, charges, time)
 
-    :param str _path: Path to battery's firmware
+    :param str _battery: Battery id or path to battery's per-file firmware
     :return: Battery's info
     :rtype: dict
     """
 
-    if os.path.exists(f"{_path}"):
-        subprocess.run(["python", f"{_path}", "--get"])
+    if not os.path.exists(_battery):
+        battery_id = os.path.basename(_battery)
+
+        if battery_id[-3:] == '.py':
+            battery_id = battery_id[:-3]
+
+        # batteries in the keystore are looked up by the full id
+        try:
+            battery_info = battery_firmware.get_battery_info(battery_id)
+        except ValueError:
+            battery_info = None
+
+        if battery_info is not None:
+            return battery_info
+
+        _battery = firmware_path(battery_id)
+
+        if not os.path.exists(_battery):
+            sys.exit(f"{bcolors.FAIL}Battery does not exist{bcolors.ENDC}")
+
+    battery_info = load_firmware(_battery).get_battery_info()
+
+    if battery_info is None:
+        # firmware created from the previous template writes info to the file
+        battery_info = open_data_base(f"{_battery[:-3]}_data.json")
+
+    return battery_info
+
+
+def _verify_batteries_with_multicall(_w3: Web3, _multicall_contract, _battery_ids: dict) -> dict:
+    """
+    Check batteries existence and resolve their vendors via aggregator
+    contract, one eth_call per battery, all sent in one batch
+
+    :param Web3 _w3: Web3 instance
+    :param Contract _multicall_contract: Aggregator contract
+    :param dict _battery_ids: Pairs of batteries and recovered battery ids
+    :return: Pairs of batteries and results (verified, vendor id, vendor name)
+    :rtype: dict
+    """
+
+    calls = {}
+
+    for battery, battery_id in _battery_ids.items():
+        calls[battery] = _multicall_contract.functions.batteryVendor(_w3.toBytes(hexstr=battery_id))
+
+    results = {}
+
+    for battery, result in call_batch_cached(_w3, calls).items():
+        if result.error is not None:
+            results[battery] = result
+            continue
+
+        vendor_address, vendor_id, vendor_name = result.result
+        results[battery] = CallResult((vendor_address != ZERO_ADDRESS, _w3.toHex(vendor_id), vendor_name.decode()), None)
+
+    return results
+
+
+def _verify_batteries_by_steps(_w3: Web3, _mgmt_contract, _battery_mgmt_addr: str, _battery_ids: dict) -> dict:
+    """
+    Check batteries existence and resolve their vendors. Calls of the same
+    step for all batteries are sent to the node as one batch request
+
+    :param Web3 _w3: Web3 instance
+    :param Contract _mgmt_contract: Management contract
+    :param str _battery_mgmt_addr: Battery management contract's address
+    :param dict _battery_ids: Pairs of batteries and recovered battery ids
+    :return: Pairs of batteries and results (verified, vendor id, vendor name)
+    :rtype: dict
+    """
+
+    battery_mgmt_contract = init_battery_management_contract(_w3, _battery_mgmt_addr)
+
+    vendors = call_batch_cached(_w3, {
+        battery: battery_mgmt_contract.functions.vendorOf(_w3.toBytes(hexstr=battery_id))
+        for battery, battery_id in _battery_ids.items()
+    })
+
+    vendor_ids = call_batch_cached(_w3, {
+        result.result: _mgmt_contract.functions.vendorId(result.result)
+        for result in vendors.values() if result.error is None
+    })
+
+    vendor_names = call_batch_cached(_w3, {
+        result.result: _mgmt_contract.functions.vendorNames(result.result)
+        for result in vendor_ids.values() if result.error is None
+    })
+
+    results = {}
+
+    for battery, vendor in vendors.items():
+        if vendor.error is not None:
+            results[battery] = vendor
+            continue
+
+        vendor_id = vendor_ids[vendor.result]
+
+        if vendor_id.error is not None:
+            results[battery] = vendor_id
+            continue
+
+        vendor_name = vendor_names[vendor_id.result]
+
+        if vendor_name.error is not None:
+            results[battery] = vendor_name
+            continue
+
+        results[battery] = CallResult((vendor.result != ZERO_ADDRESS, _w3.toHex(vendor_id.result),
+                                    vendor_name.result.decode()), None)
+
+    return results
+
+
+def verify_batteries(_w3: Web3, _batteries: list) -> dict:
+    """
+    Verify batteries firmware. Battery ids are recovered from signatures
+    locally, malformed and stale signatures are rejected without calling
+    the node, and only existence of the recovered ids is checked in the chain
+
+    :param Web3 _w3: Web3 instance
+    :param list _batteries: Battery ids or paths to per-file firmware
+    :return: Pairs of batteries and results (verified, charges, vendor id, vendor name)
+    :rtype: dict
+    """
+
+    multicall_contract = init_multicall_contract(_w3)
+    mgmt_contract = init_management_contract(_w3)
+
+    battery_mgmt_addr = get_deployed_address(_w3, 'battery')
+
+    if multicall_contract is None and battery_mgmt_addr is None:
+        # request battery management address while firmware signs battery info
+        addr_request = BatchCall(_w3).add('addr', mgmt_contract.functions.getBatteryManagmentAddr()).execute_async()
+
+    battery_infos = {}
+    battery_ids = {}
+    results = {}
+
+    for battery in _batteries:
+        battery_infos[battery] = get_battery_info(battery)
+
+        if battery_infos[battery] is None:
+            sys.exit(f"{bcolors.FAIL}The battery does not exist{bcolors.ENDC}")
+
+    # large batches are recovered across a process pool
+    recovered = recover_battery_ids(list(battery_infos.values()))
+
+    for battery, battery_id in zip(battery_infos.keys(), recovered):
+        if isinstance(battery_id, InvalidBatterySignature):
+            results[battery] = CallResult((False, battery_infos[battery]['charges'], None, None), None)
+        else:
+            battery_ids[battery] = battery_id
+
+    if len(battery_ids) == 0:
+        return results
+
+    if multicall_contract is not None:
+        lookups = _verify_batteries_with_multicall(_w3, multicall_contract, battery_ids)
     else:
-        sys.exit(f"{bcolors.FAIL}Battery does not exist{bcolors.ENDC}")
+        if battery_mgmt_addr is None:
+            addr = addr_request.result()['addr']
+
+            if addr.error is not None:
+                sys.exit(f"{bcolors.FAIL}Failed{bcolors.ENDC}")
 
-    return open_data_base(f"{_path[:-3]}_data.json")
+            battery_mgmt_addr = addr.result
 
+        lookups = _verify_batteries_by_steps(_w3, mgmt_contract, battery_mgmt_addr, battery_ids)
 
-def verify_battery(_w3: Web3, _path: str):
+    for battery, lookup in lookups.items():
+        if lookup.error is not None:
+            results[battery] = lookup
+            continue
+
+        verified, vendor_id, vendor_name = lookup.result
+        results[battery] = CallResult((verified, battery_infos[battery]['charges'], vendor_id, vendor_name), None)
+
+    return results
+
+
+def verify_battery(_w3: Web3, _battery: str):
     """
     Verify battery firmware
 
     :param Web3 _w3: Web3 instance
-    :param str _path: Path to firmware
-    :return:
-    :rtype:
+    :param str _battery: Battery id or path to per-file firmware
+    :return: Verification status, charges, vendor id and vendor name
+    :rtype: tuple
     """
 
-    verified = False
-    battery_info = get_battery_info(_path)
+    result = verify_batteries(_w3, [_battery])[_battery]
 
-    if battery_info is None:
-        sys.exit(f"{bcolors.FAIL}The battery does not exist{bcolors.ENDC}")
+    if result.error is not None:
+        sys.exit(f"{bcolors.FAIL}Failed{bcolors.ENDC}")
 
-    battery_mgmt_addr = get_battery_managment_contract_addr(_w3)
-    battery_mgmt_contract = init_battery_management_contract(_w3, battery_mgmt_addr)
+    return result.result
 
-    verified, vendor_address = battery_mgmt_contract.functions.verifyBattery(battery_info['v'], _w3.toBytes(hexstr=battery_info['r']),
-                                                             _w3.toBytes(hexstr=battery_info['s']), battery_info['charges'],
-                                                             battery_info['time']).call()
 
-    mgmt_contract = init_management_contract(_w3)
-    vendor_id = _w3.toHex(mgmt_contract.functions.vendorId(vendor_address).call())
-    vendor_name = (mgmt_contract.functions.vendorNames(vendor_id).call()).decode()
+def get_battery_owners(_w3: Web3, _battery_ids: list) -> dict:
+    """
+    Read current owners of the batteries from the contract in one batch
+    request, bypassing the call cache
+
+    :param Web3 _w3: Web3 instance
+    :param list _battery_ids: Battery IDs
+    :return: Pairs of battery IDs and owner addresses, None if the owner can't be read
+    :rtype: dict
+    """
+
+    battery_mgmt_contract = init_battery_management_contract(_w3, get_battery_managment_contract_addr(_w3))
+    batch = BatchCall(_w3)
 
-    return verified, battery_info['charges'], vendor_id, vendor_name
+    for battery_id in _battery_ids:
+        batch.add(battery_id, battery_mgmt_contract.functions.tokenIdToOwner(decode_hex(battery_id)))
 
+    return {battery_id: result.result if result.error is None else None
+            for battery_id, result in batch.execute().items()}
 
-def change_owner(_w3: Web3, _battery_id: str, _new_owner: str, account_db_name: str) -> str:
+
+def change_owners(_w3: Web3, _battery_ids: list, _new_owner: str, account_db_name: str, _callback=None,
+                  _unlock: bool = True) -> dict:
     """
-    Change the owner of battery
+    Change the owner of several batteries. Transactions are broadcast
+    one after another without waiting for receipts
 
     :param Web3 _w3: Web3 instance
-    :param str _battery_id: battery ID
+    :param list _battery_ids: Battery IDs
     :param str _new_owner: New owner address
-    :return: Status message
-    :rtype: str    
-
+    :param str account_db_name: Name of the database file with the actor's account
+    :param callable _callback: Function called with battery ID and status when transfer is done
+    :param bool _unlock: Unlock account before sending transactions
+    :return: Pairs of battery IDs and transfer statuses
+    :rtype: dict
     """
 
     data = open_data_base(account_db_name)
@@ -371,16 +901,252 @@ def change_owner(_w3: Web3, _battery_id: str, _new_owner: str, account_db_name:
 
     battery_mgmt_contract_addr = get_battery_managment_contract_addr(_w3)
     battery_mgmt_contract = init_battery_management_contract(_w3, battery_mgmt_contract_addr)
+    nonce_manager = get_nonce_manager(_w3, actor)
 
-    unlock_account(_w3, actor, data['password'])
+    if _unlock:
+        unlock_account(_w3, actor, data['password'])
 
-    
-    tx_hash = battery_mgmt_contract.functions.transfer(_new_owner, decode_hex(_battery_id)).transact(tx)
-    receipt = web3.eth.wait_for_transaction_receipt(_w3, tx_hash, 120, 0.1)
-    result = receipt.status
+    handles = {}
+
+    with TxPipeline(_w3) as pipeline:
+        for battery_id in _battery_ids:
+            transfer = battery_mgmt_contract.functions.transfer(_new_owner, decode_hex(battery_id))
+            send = lambda nonce, transfer=transfer: transfer.transact(dict(tx, nonce=nonce))
+            callback = None
+
+            if _callback is not None:
+                callback = lambda handle, battery_id=battery_id: _callback(battery_id, handle.status == 1)
+
+            handles[battery_id] = pipeline.submit(lambda send=send: nonce_manager.send(send), callback)
+
+    return {battery_id: handle.status == 1 for battery_id, handle in handles.items()}
 
-    if result == 1:
+
+def estimate_transfer_gas(_w3: Web3, _battery_mgmt_contract, _battery_ids: list, _new_owner: str, _tx: dict) -> tuple:
+    """
+    Estimate gas of batch transfer as base cost and cost per battery
+    to size the chunks of the transfer
+
+    :param Web3 _w3: Web3 instance
+    :param Contract _battery_mgmt_contract: Battery management contract
+    :param list _battery_ids: Battery IDs as bytes
+    :param str _new_owner: New owner address
+    :param dict _tx: Transaction template
+    :return: Base gas and gas per battery
+    :rtype: tuple
+    """
+
+    sample = _battery_ids[:TRANSFER_GAS_ESTIMATION_SAMPLE]
+
+    if len(sample) < 2:
+        return BATTERY_TRANSFER_BASE_GAS, BATTERY_TRANSFER_GAS
+
+    try:
+        single = _battery_mgmt_contract.functions.transferBatch(_new_owner, sample[:1]).estimateGas(_tx)
+        several = _battery_mgmt_contract.functions.transferBatch(_new_owner, sample).estimateGas(_tx)
+    except ValueError:
+        return BATTERY_TRANSFER_BASE_GAS, BATTERY_TRANSFER_GAS
+
+    # skipped batteries are cheaper, so the estimation is not trusted below the default
+    per_battery = max((several - single) // (len(sample) - 1), BATTERY_TRANSFER_GAS)
+
+    return single - per_battery, per_battery
+
+
+def transfer_batteries(_w3: Web3, _battery_ids: list, _new_owner: str, account_db_name: str, _callback=None,
+                       _unlock: bool = True) -> dict:
+    """
+    Change the owner of many batteries with BatteryManagement.transferBatch
+    in chunks fitting the block gas limit. Batteries not owned by the actor
+    are skipped by the contract
+
+    :param Web3 _w3: Web3 instance
+    :param list _battery_ids: Battery IDs
+    :param str _new_owner: New owner address
+    :param str account_db_name: Name of the database file with the actor's account
+    :param callable _callback: Function called with battery ID and status when its chunk is done
+    :param bool _unlock: Unlock account before sending transactions
+    :return: Pairs of battery IDs and transfer statuses
+    :rtype: dict
+    """
+
+    data = open_data_base(account_db_name)
+    actor = data['account']
+    new_owner = Web3.toChecksumAddress(_new_owner)
+
+    tx = {'from': actor, 'gasPrice': get_actual_gas_price(_w3)}
+
+    battery_mgmt_contract_addr = get_battery_managment_contract_addr(_w3)
+    battery_mgmt_contract = init_battery_management_contract(_w3, battery_mgmt_contract_addr)
+    nonce_manager = get_nonce_manager(_w3, actor)
+
+    if _unlock:
+        unlock_account(_w3, actor, data['password'])
+
+    ids = {battery_id: decode_hex(battery_id) for battery_id in _battery_ids}
+    base_gas, per_battery = estimate_transfer_gas(_w3, battery_mgmt_contract, list(ids.values()), new_owner, tx)
+    block_gas_limit = _w3.eth.getBlock('latest').gasLimit
+    chunk_gas_limit = block_gas_limit * TRANSFER_BLOCK_GAS_USAGE
+    chunk_size = max(1, int((chunk_gas_limit - base_gas) // per_battery))
+
+    battery_ids = list(ids.keys())
+    results = {}
+
+    def on_done(chunk: list, handle) -> None:
+        transferred = set()
+
+        if handle.status == 1:
+            events = battery_mgmt_contract.events.Transfer().processReceipt(handle.receipt(), errors=DISCARD)
+            transferred = {bytes(event['args']['batteryId']) for event in events}
+
+        for battery_id in chunk:
+            results[battery_id] = ids[battery_id] in transferred
+
+            if _callback is not None:
+                _callback(battery_id, results[battery_id])
+
+    # chunks in reverse order, so the next one is popped from the end
+    chunks = [battery_ids[i:i + chunk_size] for i in range(0, len(battery_ids), chunk_size)][::-1]
+
+    with TxPipeline(_w3) as pipeline:
+        while len(chunks) > 0:
+            chunk = chunks.pop()
+            transfer = battery_mgmt_contract.functions.transferBatch(new_owner, [ids[battery_id] for battery_id in chunk])
+
+            # chunk size is only a guess from the sample, the gas of the chunk itself is estimated
+            try:
+                gas = transfer.estimateGas(tx)
+            except ValueError:
+                gas = base_gas + per_battery * len(chunk)
+
+            if gas > chunk_gas_limit and len(chunk) > 1:
+                chunks += [chunk[len(chunk) // 2:], chunk[:len(chunk) // 2]]
+                continue
+
+            chunk_tx = dict(tx, gas=min(int(gas * 1.2), block_gas_limit))
+            send = lambda nonce, transfer=transfer, chunk_tx=chunk_tx: transfer.transact(dict(chunk_tx, nonce=nonce))
+
+            pipeline.submit(lambda send=send: nonce_manager.send(send), lambda handle, chunk=chunk: on_done(chunk, handle))
+
+    return {battery_id: results.get(battery_id, False) for battery_id in battery_ids}
+
+
+def change_owner(_w3: Web3, _battery_id: str, _new_owner: str, account_db_name: str, _unlock: bool = True) -> str:
+    """
+    Change the owner of battery
+
+    :param Web3 _w3: Web3 instance
+    :param str _battery_id: battery ID
+    :param str _new_owner: New owner address
+    :param bool _unlock: Unlock account before sending transaction
+    :return: Status message
+    :rtype: str    
+
+    """
+
+    result = change_owners(_w3, [_battery_id], _new_owner, account_db_name, _unlock=_unlock)[_battery_id]
+
+    if result:
         return "Ownership change was successfull"
     else:
         return "Ownership change failed"
 
+
+def swap_hash(_w3: Web3, _car: str, _sc: str, _car_battery_id: str, _sc_battery_id: str, _deadline: int) -> bytes:
+    """
+    Hash of the swap signed by the car and the service center,
+    the same as BatteryManagement.swapHash
+
+    :param Web3 _w3: Web3 instance
+    :param str _car: Car's address
+    :param str _sc: Service center's address
+    :param str _car_battery_id: Car's battery ID
+    :param str _sc_battery_id: Service center's battery ID
+    :param int _deadline: Time until which the signatures are valid
+    :return: Swap hash
+    :rtype: bytes
+    """
+
+    return Web3.solidityKeccak(
+        ['address', 'address', 'address', 'bytes20', 'bytes20', 'uint256'],
+        [get_battery_managment_contract_addr(_w3), Web3.toChecksumAddress(_car), Web3.toChecksumAddress(_sc),
+         decode_hex(_car_battery_id), decode_hex(_sc_battery_id), _deadline]
+    )
+
+
+def sign_swap(_w3: Web3, _hash: bytes, _private_key: str = None, _account: str = None) -> str:
+    """
+    Sign swap hash as an Ethereum signed message either with
+    the private key or with the unlocked account of the node
+
+    :param Web3 _w3: Web3 instance
+    :param bytes _hash: Swap hash
+    :param str _private_key: Private key of the signer
+    :param str _account: Unlocked account of the signer
+    :return: Signature in hex
+    :rtype: str
+    """
+
+    if _private_key is not None:
+        return _w3.eth.account.sign_message(encode_defunct(primitive=_hash), _private_key).signature.hex()
+
+    return _w3.eth.sign(_account, _hash).hex()
+
+
+def _split_signature(_signature: str) -> tuple:
+    signature = decode_hex(_signature)
+    v = signature[64]
+
+    # some nodes return v as 0/1
+    if v < 27:
+        v += 27
+
+    return v, signature[:32], signature[32:64]
+
+
+def swap_batteries(_w3: Web3, _car: str, _car_battery_id: str, _sc_battery_id: str, _deadline: int,
+                   _car_signature: str, account_db_name: str, _unlock: bool = True) -> bool:
+    """
+    Exchange the car's battery and the battery of the actor in one transaction.
+    The car gives its consent by signing the swap hash
+
+    :param Web3 _w3: Web3 instance
+    :param str _car: Car's address
+    :param str _car_battery_id: Car's battery ID
+    :param str _sc_battery_id: Actor's battery ID
+    :param int _deadline: Time until which the signatures are valid
+    :param str _car_signature: Car's signature of the swap hash
+    :param str account_db_name: Name of the database file with the actor's account
+    :param bool _unlock: Unlock account before sending transaction
+    :return: True if batteries were exchanged and False if not
+    :rtype: bool
+    """
+
+    data = open_data_base(account_db_name)
+    actor = data['account']
+    car = Web3.toChecksumAddress(_car)
+
+    battery_mgmt_contract_addr = get_battery_managment_contract_addr(_w3)
+    battery_mgmt_contract = init_battery_management_contract(_w3, battery_mgmt_contract_addr)
+
+    if _unlock:
+        unlock_account(_w3, actor, data['password'])
+
+    h = swap_hash(_w3, car, actor, _car_battery_id, _sc_battery_id, _deadline)
+    signatures = [_split_signature(_car_signature), _split_signature(sign_swap(_w3, h, _account=actor))]
+    v, r, s = (list(component) for component in zip(*signatures))
+
+    swap = battery_mgmt_contract.functions.swap(car, actor, decode_hex(_car_battery_id), decode_hex(_sc_battery_id),
+                                                _deadline, v, r, s)
+    tx = {'from': actor, 'gasPrice': get_actual_gas_price(_w3)}
+
+    # estimation fails if the swap would be reverted
+    try:
+        tx['gas'] = swap.estimateGas(tx)
+    except ValueError:
+        return False
+
+    tx_hash = get_nonce_manager(_w3, actor).send(lambda nonce: swap.transact(dict(tx, nonce=nonce)))
+    receipt = web3.eth.wait_for_transaction_receipt(_w3, tx_hash, 120, 0.1)
+
+    return receipt.status == 1
@@ -1,13 +1,21 @@
 import sys, os
 import argparse
+import itertools
+import threading
 import web3
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
 from web3.logs import DISCARD
-from eth_utils import decode_hex
+from web3.exceptions import TransactionNotFound
 
 # Project modules
 import utils
+from nonces import get_nonce_manager
+from txpipeline import TxPipeline
+from provisioning import Provisioner, derive_keys
+import battery_firmware
+import indexer
+from hdkeys import new_seed
 from TextColor.color import bcolors
 
 
@@ -17,6 +25,14 @@ ACCOUNT_DB_NAME = 'account.json'
 MGMT_CONTRACT_DB_NAME = utils.MGMT_CONTRACT_DB_NAME
 MGMT_CONTRACT_SRC_PATH = r"./contracts/ManagementContract.sol"
 MGMT_CONTRACT_NAME = "ManagementContract"
+REGISTRATION_JOURNAL_NAME = 'registration.json'
+REGISTRATION_CHUNKS_IN_FLIGHT = 4
+# Part of the block gas limit used by one registration transaction
+BLOCK_GAS_USAGE = 0.9
+GAS_ESTIMATION_SAMPLE = 5
+# Used when the gas can't be estimated
+BATTERY_REGISTRATION_BASE_GAS = 60000
+BATTERY_REGISTRATION_GAS = 70000
 
 
 CONFIG = utils.open_data_base(ACCOUNT_DB_NAME)
@@ -60,44 +76,218 @@ def register_vendor(_w3: Web3, _name: str, _deposit: float):
             return "Failed. The vendor name is not unique."
 
 
-def register_battery(_w3: Web3, _count: int, _value: float=0):
+def estimate_registration_gas(_w3: Web3, _mgmt_contract, _tx: dict) -> tuple:
     """
-    Register battery
+    Estimate gas of batteries registration as base cost and cost per battery
+
+    :param Web3 _w3: Web3 instance
+    :param Contract _mgmt_contract: Management contract
+    :param dict _tx: Transaction template
+    :return: Base gas and gas per battery
+    :rtype: tuple
+    """
+
+    sample = [_w3.toBytes(hexstr=address) for _, address in derive_keys(GAS_ESTIMATION_SAMPLE)]
+
+    try:
+        single = _mgmt_contract.functions.registerBatteries(sample[:1]).estimateGas(_tx)
+        several = _mgmt_contract.functions.registerBatteries(sample).estimateGas(_tx)
+    except ValueError:
+        return BATTERY_REGISTRATION_BASE_GAS, BATTERY_REGISTRATION_GAS
+
+    per_battery = (several - single) // (len(sample) - 1)
+
+    return single - per_battery, per_battery
+
+
+def _save_journal(_journal: dict) -> None:
+    utils.write_data_base(_journal, REGISTRATION_JOURNAL_NAME)
+
+
+def _chunk_size(_entry) -> int:
+    if isinstance(_entry, dict):
+        return _entry['count']
+
+    return len(_entry)
+
+
+def register_battery(_w3: Web3, _count: int, _value: float=0, _callback=None, _hd: bool=False):
+    """
+    Register batteries in chunks fitting the block gas limit.
+    Keys of the chunks waiting for inclusion and hashes of their
+    transactions are kept in the journal, so an interrupted registration
+    is resumed by the next call without sending a chunk twice.
+    In HD mode keys are derived from vendor master seed and the journal
+    keeps only serial index ranges
 
     :param Web3 _w3: Web3 instance
     :param int _count: Number of batteries
-    :param float _value: Deposit in eth
-    :return: Batteries ids or error message
-    :rtype: str
+    :param float _value: Deposit in wei
+    :param callable _callback: Function called with battery ids of each registered chunk
+    :param bool _hd: Derive keys from vendor master seed
+    :return: Number of registered batteries
+    :rtype: int
     """
 
-    tx = TX_TEMPLATE
-    tx['value'] = _value
-    bat_keys = []
-    args = []
-    
-    for i in range(_count):
-        priv_key = _w3.sha3(os.urandom(20))
-        bat_keys.append((priv_key, _w3.eth.account.privateKeyToAccount(priv_key).address))
+    config = utils.open_data_base(ACCOUNT_DB_NAME)
+    journal = utils.open_data_base(REGISTRATION_JOURNAL_NAME)
+
+    if journal is None:
+        journal = {'count': _count, 'registered': 0, 'value': _value, 'next_chunk': 0, 'pending': {}, 'sent': {},
+                   'hd': _hd}
+    else:
+        journal.setdefault('sent', {})
+        print(f"{bcolors.WARNING}Resuming registration: {journal['registered']} of {journal['count']} batteries registered{bcolors.ENDC}")
+
+    if journal['hd'] and 'seed' not in config:
+        sys.exit(f"{bcolors.FAIL}Vendor master seed is not created{bcolors.ENDC}")
 
-    for i in range(len(bat_keys)):
-        args.append(_w3.toBytes(hexstr=bat_keys[i][1]))
+    tx = dict(TX_TEMPLATE)
+    tx.pop('value', None)
 
     mgmt_contract = utils.init_management_contract(_w3)
-    txHash = mgmt_contract.functions.registerBatteries(args).transact(tx)
-    receipt = web3.eth.wait_for_transaction_receipt(_w3, txHash, 120, 0.1)
-    result = receipt.status
+    battery_mgmt_contract = utils.init_battery_management_contract(_w3, utils.get_battery_managment_contract_addr(_w3))
+    nonce_manager = get_nonce_manager(_w3, tx['from'])
+    provisioner = Provisioner(battery_firmware.get_keystore())
+    lock = threading.Lock()
+    failed = []
+    derived = {}
+
+    def chunk_batteries(chunk_id: str) -> list:
+        entry = journal['pending'][chunk_id]
+
+        if not isinstance(entry, dict):
+            return entry
+
+        if chunk_id not in derived:
+            derived[chunk_id] = provisioner.derive_range(config['seed'], entry['start'], entry['count'])
+
+        return derived[chunk_id]
+
+    def complete(chunk_id: str) -> None:
+        batteries = chunk_batteries(chunk_id)
+        provisioner.write_firmware(batteries)
+
+        journal['pending'].pop(chunk_id)
+        journal['sent'].pop(chunk_id, None)
+        derived.pop(chunk_id, None)
+        journal['registered'] += len(batteries)
+        _save_journal(journal)
+
+        if _callback is not None:
+            _callback([address for _, address in batteries])
+
+    def registered(chunk_id: str) -> bool:
+        first_address = chunk_batteries(chunk_id)[0][1]
+
+        return battery_mgmt_contract.functions.vendorOf(_w3.toBytes(hexstr=first_address)).call() != utils.ZERO_ADDRESS
+
+    def on_done(chunk_id: str, handle) -> None:
+        with lock:
+            # a copy of the chunk sent before interruption may have registered it
+            if handle.status == 1 or (handle.status == 0 and registered(chunk_id)):
+                complete(chunk_id)
+            else:
+                failed.append(chunk_id)
+
+    def track(pipeline: TxPipeline, chunk_id: str, tx_hash: str) -> None:
+        pipeline.submit(lambda: tx_hash, lambda handle: on_done(chunk_id, handle))
+
+    def submit(pipeline: TxPipeline, chunk_id: str, base_gas: int, per_battery: int) -> None:
+        batteries = chunk_batteries(chunk_id)
+        ids = [_w3.toBytes(hexstr=address) for _, address in batteries]
+        chunk_tx = dict(tx, gas=min(int((base_gas + per_battery * len(ids)) * 1.2), block_gas_limit))
+
+        with lock:
+            # deposit goes with one chunk and again only if that chunk is not registered
+            if journal['value'] and journal.get('value_chunk') in (None, chunk_id):
+                chunk_tx['value'] = journal['value']
+                journal['value_chunk'] = chunk_id
+                _save_journal(journal)
+
+        def send() -> bytes:
+            tx_hash = nonce_manager.send(
+                lambda nonce: mgmt_contract.functions.registerBatteries(ids).transact(dict(chunk_tx, nonce=nonce)))
+
+            with lock:
+                journal['sent'][chunk_id] = Web3.toHex(tx_hash)
+                _save_journal(journal)
+
+            return tx_hash
+
+        pipeline.submit(send, lambda handle: on_done(chunk_id, handle))
+
+    def new_chunk(size: int):
+        if not journal['hd']:
+            return list(itertools.islice(keys, size))
+
+        # serial indexes are reserved before the transaction is sent
+        start = config.get('next_index', 0)
+        config['next_index'] = start + size
+        utils.write_data_base(config, ACCOUNT_DB_NAME)
+
+        return {'start': start, 'count': size}
+
+    # chunks sent before interruption: still in the pool, registered or lost
+    in_flight = {}
+
+    for chunk_id in list(journal['pending'].keys()):
+        tx_hash = journal['sent'].get(chunk_id)
+
+        if tx_hash is not None:
+            try:
+                _w3.eth.getTransactionReceipt(tx_hash)
+            except TransactionNotFound:
+                try:
+                    _w3.eth.getTransaction(tx_hash)
+                    in_flight[chunk_id] = tx_hash
+                    continue
+                except TransactionNotFound:
+                    pass
+
+        if registered(chunk_id):
+            complete(chunk_id)
+        else:
+            journal['sent'].pop(chunk_id, None)
 
-    if result >= 1:
-        for battery in bat_keys:
-            utils.create_script_from_tmpl(hex(int.from_bytes(battery[0], byteorder='big')),
-                                          battery[1])
+    base_gas, per_battery = estimate_registration_gas(_w3, mgmt_contract, tx)
+    block_gas_limit = _w3.eth.getBlock('latest').gasLimit
+    chunk_size = max(1, int((block_gas_limit * BLOCK_GAS_USAGE - base_gas) // per_battery))
+    left = journal['count'] - journal['registered'] - sum(_chunk_size(e) for e in journal['pending'].values())
+    keys = provisioner.iter_keys(max(left, 0)) if not journal['hd'] else None
 
+    with TxPipeline(_w3, _max_in_flight=REGISTRATION_CHUNKS_IN_FLIGHT) as pipeline:
+        for chunk_id in list(journal['pending'].keys()):
+            if chunk_id in in_flight:
+                track(pipeline, chunk_id, in_flight[chunk_id])
+            else:
+                submit(pipeline, chunk_id, base_gas, per_battery)
 
-        return [x[1] for x in bat_keys]
-        
-    else:
-        sys.exit('Batteries registration failed')
+        while True:
+            with lock:
+                left = journal['count'] - journal['registered'] - sum(_chunk_size(e) for e in journal['pending'].values())
+
+                if left <= 0 or len(failed) > 0:
+                    break
+
+                chunk_id = str(journal['next_chunk'])
+                journal['next_chunk'] += 1
+                journal['pending'][chunk_id] = new_chunk(min(chunk_size, left))
+                # keys must be on disk before the transaction is sent
+                _save_journal(journal)
+
+            submit(pipeline, chunk_id, base_gas, per_battery)
+
+    provisioner.close()
+    print(provisioner.throughput())
+
+    if len(failed) > 0 or len(journal['pending']) > 0:
+        sys.exit(f"{bcolors.FAIL}Batteries registration failed. "
+                 f"Run the command again to resume{bcolors.ENDC}")
+
+    os.remove(REGISTRATION_JOURNAL_NAME)
+
+    return journal['registered']
 
 
 def create_parser() -> argparse.ArgumentParser:
@@ -133,6 +323,16 @@ def create_parser() -> argparse.ArgumentParser:
         help='Register batteries'
     )
 
+    parser.add_argument(
+        '--hd', action='store_true', required=False,
+        help='Derive keys of registered batteries from vendor master seed'
+    )
+
+    parser.add_argument(
+        '--seed', action='store_true', required=False,
+        help='Create vendor master seed for battery keys derivation'
+    )
+
     parser.add_argument(
         '--regfee', action='store_true', required=False,
         help='Show registration fee for vendor'
@@ -149,8 +349,18 @@ def create_parser() -> argparse.ArgumentParser:
     )
 
     parser.add_argument(
-        '--owner', nargs=2, required=False,
-        help='Change battery owner'
+        '--owner', nargs='+', required=False,
+        help='Change batteries owner <battery_id> [<battery_id> ...] <new_owner>'
+    )
+
+    parser.add_argument(
+        '--inventory', action='store_true', required=False,
+        help='Show registered batteries and batteries still owned by the vendor'
+    )
+
+    parser.add_argument(
+        '--lot', nargs='+', required=False,
+        help='Change owner of the batteries listed in the file or stdin <new_owner> [<file>]'
     )
 
     return parser
@@ -167,7 +377,7 @@ def get_fee(_w3: Web3) -> float:
 
     mgmt_contract = utils.init_management_contract(_w3)
 
-    fee = mgmt_contract.functions.getFee().call()
+    fee = utils.get_call_cache(_w3).call(mgmt_contract.functions.getFee())
 
     return _w3.fromWei(fee, 'ether')
 
@@ -184,10 +394,8 @@ def get_deposit(_w3: Web3):
     data = utils.open_data_base(ACCOUNT_DB_NAME)
     actor = data['account']
 
-    mgmt_contract = utils.init_management_contract(_w3)
-
     try:
-        deposit = mgmt_contract.functions.getDeposit().call({'from': actor})
+        _, deposit = utils.get_vendor_info(_w3, actor)
 
         return _w3.fromWei(deposit, 'ether')
 
@@ -209,36 +417,83 @@ def del_hex_prefix(_str: str) -> str:
     return _str
 
 
-def change_owner(_w3: Web3, _battery_id: str, _new_owner: str) -> str:
+def change_owner(_w3: Web3, _battery_ids: list, _new_owner: str) -> str:
     """
-    Change the owner of battery
+    Change the owner of batteries
 
     :param Web3 _w3: Web3 instance
-    :param str _battery_id: battery ID
+    :param list _battery_ids: battery IDs
     :param str _new_owner: New owner address
     :return: Status message
     :rtype: str    
 
     """
 
-    data = utils.open_data_base(ACCOUNT_DB_NAME)
-    actor = data['account']
+    def report(battery_id: str, success: bool) -> None:
+        if len(_battery_ids) > 1:
+            status = f"{bcolors.OKGREEN}Success{bcolors.ENDC}" if success else f"{bcolors.FAIL}Failed{bcolors.ENDC}"
+            print(f"{battery_id}: {status}")
 
-    tx = {'from': actor, 'gasPrice': utils.get_actual_gas_price(_w3), 'gas': 2204 * 68 + 21000}
+    results = utils.change_owners(_w3, _battery_ids, _new_owner, ACCOUNT_DB_NAME, report)
 
-    battery_mgmt_contract_addr = utils.get_battery_managment_contract_addr(_w3)
-    battery_mgmt_contract = utils.init_battery_management_contract(_w3, battery_mgmt_contract_addr)
+    if all(results.values()):
+        return f"{bcolors.OKGREEN}Ownership change was successfull{bcolors.ENDC}"
+    else:
+        return f"{bcolors.FAIL}Ownership change failed{bcolors.ENDC}"
 
-    utils.unlock_account(_w3, actor, data['password'])
 
-    tx_hash = battery_mgmt_contract.functions.transfer(_new_owner, decode_hex(_battery_id)).transact(tx)
-    receipt = web3.eth.wait_for_transaction_receipt(_w3, tx_hash, 120, 0.1)
-    result = receipt.status
+def get_inventory(_w3: Web3, _vendor: str) -> tuple:
+    """
+    Get batteries of the vendor from the local index
 
-    if result == 1:
-        return f"{bcolors.OKGREEN}Ownership change was successfull{bcolors.ENDC}"
+    :param Web3 _w3: Web3 instance
+    :param str _vendor: Vendor's address
+    :return: Number of registered batteries and ids of the batteries owned by the vendor
+    :rtype: tuple
+    """
+
+    index = indexer.get_index(_w3)
+
+    if index is None:
+        sys.exit(f"{bcolors.FAIL}Index is not created, run indexer.py --run{bcolors.ENDC}")
+
+    return index.vendor_battery_count(_vendor), index.batteries_of(_vendor)
+
+
+def read_battery_ids(_file) -> list:
+    """
+    Read battery IDs separated by whitespace
+
+    :param file _file: Opened file
+    :return: Battery IDs
+    :rtype: list
+    """
+
+    return _file.read().split()
+
+
+def transfer_lot(_w3: Web3, _battery_ids: list, _new_owner: str) -> str:
+    """
+    Change the owner of the batteries lot in a few batch transactions
+
+    :param Web3 _w3: Web3 instance
+    :param list _battery_ids: battery IDs
+    :param str _new_owner: New owner address
+    :return: Status message
+    :rtype: str
+    """
+
+    def report(battery_id: str, success: bool) -> None:
+        status = f"{bcolors.OKGREEN}Success{bcolors.ENDC}" if success else f"{bcolors.FAIL}Failed{bcolors.ENDC}"
+        print(f"{battery_id}: {status}")
+
+    results = utils.transfer_batteries(_w3, _battery_ids, _new_owner, ACCOUNT_DB_NAME, report)
+    transferred = sum(results.values())
+
+    if transferred == len(results):
+        return f"{bcolors.OKGREEN}Transferred {transferred} batteries{bcolors.ENDC}"
     else:
-        return f"{bcolors.FAIL}Ownership change failed{bcolors.ENDC}"
+        return f"{bcolors.FAIL}Transferred {transferred} of {len(results)} batteries{bcolors.ENDC}"
 
 
 def main() -> None:
@@ -277,14 +532,22 @@ def main() -> None:
     elif args.bat:
         w3.geth.personal.unlockAccount(actor, config['password'], 300)
 
+        def report(bat_ids: list) -> None:
+            for bat_id in bat_ids:
+                print(f'Created battery with id: {bcolors.HEADER}{bat_id[2:]}{bcolors.ENDC}')
+
         if len(args.bat) == 1:
-            result = register_battery(w3, int(args.bat[0]))
+            register_battery(w3, int(args.bat[0]), _callback=report, _hd=args.hd)
         else:
-            result = register_battery(w3, int(args.bat[0]), Web3.toWei(float(args.bat[1])))
+            register_battery(w3, int(args.bat[0]), Web3.toWei(float(args.bat[1]), 'ether'), _callback=report, _hd=args.hd)
 
-        if isinstance(result, list):
-            for bat_id in result:
-                print(f'Created battery with id: {bcolors.HEADER}{bat_id[2:]}{bcolors.ENDC}')
+    elif args.seed:
+        if 'seed' in config:
+            sys.exit(f"{bcolors.FAIL}Vendor master seed already exists{bcolors.ENDC}")
+
+        config['seed'] = new_seed()
+        utils.write_data_base(config, ACCOUNT_DB_NAME)
+        print(f"{bcolors.OKGREEN}Vendor master seed created{bcolors.ENDC}")
 
     elif args.regfee:
         print(f'Vendor registration fee: {bcolors.HEADER}{get_fee(w3) * 1000}{bcolors.ENDC} eth')
@@ -296,7 +559,31 @@ def main() -> None:
         print(f"Vendor deposit: {bcolors.HEADER}{get_deposit(w3)}{bcolors.ENDC} eth")
 
     elif args.owner:
-        print(change_owner(w3, args.owner[0], args.owner[1]))
+        if len(args.owner) < 2:
+            sys.exit(f"{bcolors.FAIL}Battery id and new owner are required{bcolors.ENDC}")
+
+        print(change_owner(w3, args.owner[:-1], args.owner[-1]))
+
+    elif args.inventory:
+        registered, owned = get_inventory(w3, actor)
+
+        for battery_id in owned:
+            print(battery_id)
+
+        print(f"Registered batteries: {bcolors.HEADER}{registered}{bcolors.ENDC}")
+        print(f"Batteries in stock: {bcolors.HEADER}{len(owned)}{bcolors.ENDC}")
+
+    elif args.lot:
+        if len(args.lot) > 1 and args.lot[1] != '-':
+            with open(args.lot[1]) as file:
+                battery_ids = read_battery_ids(file)
+        else:
+            battery_ids = read_battery_ids(sys.stdin)
+
+        if len(battery_ids) == 0:
+            sys.exit(f"{bcolors.FAIL}No battery ids provided{bcolors.ENDC}")
+
+        print(transfer_lot(w3, battery_ids, args.lot[0]))
 
     else:
         sys.exit(f"{bcolors.FAIL}No parameters provided{bcolors.ENDC}")